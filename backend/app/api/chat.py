@@ -1,13 +1,17 @@
 """
 Chat API endpoints for session and message management
 """
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Response
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
+from datetime import datetime
 import logging
 
 from ..services.chat_database_service import chat_db_service
 from ..services.openai_service import openai_service
+from ..services.usage_ledger import usage_ledger
+from ..services.history_store import history_store
+from ..services.pagination import InvalidCursorError
 from ..models.chat import ChatSession, ChatMessage
 
 logger = logging.getLogger(__name__)
@@ -29,6 +33,16 @@ class ChatMessageCreate(BaseModel):
     message_type: str
     metadata: Optional[Dict[str, Any]] = None
 
+class ChatMessageBatchCreate(BaseModel):
+    messages: List[ChatMessageCreate]
+
+class ChatMessageImport(ChatMessageCreate):
+    session_id: str
+    timestamp: Optional[datetime] = None
+
+class ChatMessageImportRequest(BaseModel):
+    messages: List[ChatMessageImport]
+
 class TitleGenerateRequest(BaseModel):
     message: str
 
@@ -50,12 +64,22 @@ class ChatMessageResponse(BaseModel):
     timestamp: str
     metadata: Optional[Dict[str, Any]]
 
+class ChatSearchResultResponse(ChatMessageResponse):
+    snippet: Optional[str] = None
+    rank: Optional[float] = None
+
+def _set_cursor_headers(response: Response, next_cursor: Optional[str], prev_cursor: Optional[str]):
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    if prev_cursor:
+        response.headers["X-Prev-Cursor"] = prev_cursor
+
 # Session endpoints
 @router.post("/sessions", response_model=ChatSessionResponse)
 async def create_chat_session(session_data: ChatSessionCreate):
     """Create a new chat session"""
     try:
-        session = chat_db_service.create_session(
+        session = await chat_db_service.create_session_async(
             title=session_data.title,
             description=session_data.description,
             metadata=session_data.metadata
@@ -67,13 +91,26 @@ async def create_chat_session(session_data: ChatSessionCreate):
 
 @router.get("/sessions", response_model=List[ChatSessionResponse])
 async def get_chat_sessions(
+    response: Response,
     limit: int = Query(100, ge=1, le=1000),
-    include_inactive: bool = Query(False)
+    include_inactive: bool = Query(False),
+    cursor: Optional[str] = Query(None)
 ):
-    """Get all chat sessions"""
+    """Get chat sessions, most recently updated first
+    
+    Paginated by cursor: follow the X-Next-Cursor / X-Prev-Cursor response
+    headers to fetch the following / preceding page.
+    """
     try:
-        sessions = chat_db_service.get_all_sessions(limit=limit, include_inactive=include_inactive)
+        sessions, next_cursor, prev_cursor = await chat_db_service.get_sessions_page_async(
+            limit=limit,
+            include_inactive=include_inactive,
+            cursor=cursor
+        )
+        _set_cursor_headers(response, next_cursor, prev_cursor)
         return [ChatSessionResponse(**session.to_dict()) for session in sessions]
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to get chat sessions: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -82,7 +119,7 @@ async def get_chat_sessions(
 async def get_chat_session(session_id: str):
     """Get a specific chat session"""
     try:
-        session = chat_db_service.get_session(session_id)
+        session = await chat_db_service.get_session_async(session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Chat session not found")
         return ChatSessionResponse(**session.to_dict())
@@ -96,7 +133,7 @@ async def get_chat_session(session_id: str):
 async def update_chat_session(session_id: str, session_data: ChatSessionUpdate):
     """Update a chat session"""
     try:
-        session = chat_db_service.update_session(
+        session = await chat_db_service.update_session_async(
             session_id=session_id,
             title=session_data.title,
             description=session_data.description,
@@ -116,12 +153,13 @@ async def delete_chat_session(session_id: str, permanent: bool = Query(False)):
     """Delete a chat session (soft delete by default)"""
     try:
         if permanent:
-            success = chat_db_service.delete_session_permanently(session_id)
+            success = await chat_db_service.delete_session_permanently_async(session_id)
         else:
-            success = chat_db_service.delete_session(session_id)
+            success = await chat_db_service.delete_session_async(session_id)
         
         if not success:
             raise HTTPException(status_code=404, detail="Chat session not found")
+        history_store.drop(session_id)
         
         return {"message": "Chat session deleted successfully"}
     except HTTPException:
@@ -135,7 +173,7 @@ async def delete_chat_session(session_id: str, permanent: bool = Query(False)):
 async def add_message(session_id: str, message_data: ChatMessageCreate):
     """Add a message to a chat session"""
     try:
-        message = chat_db_service.add_message(
+        message = await chat_db_service.add_message_async(
             session_id=session_id,
             content=message_data.content,
             message_type=message_data.message_type,
@@ -150,20 +188,71 @@ async def add_message(session_id: str, message_data: ChatMessageCreate):
         logger.error(f"Failed to add message: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/sessions/{session_id}/messages/batch", response_model=List[ChatMessageResponse])
+async def add_messages(session_id: str, batch: ChatMessageBatchCreate):
+    """Add several messages to a chat session in one transaction"""
+    try:
+        messages = await chat_db_service.add_messages_async(
+            session_id=session_id,
+            messages=[message.dict() for message in batch.messages]
+        )
+        if messages is None:
+            raise HTTPException(status_code=404, detail="Chat session not found")
+        return [ChatMessageResponse(**message.to_dict()) for message in messages]
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Failed to add messages: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/messages/import")
+async def import_messages(request: ChatMessageImportRequest):
+    """Bulk import historical messages into existing chat sessions"""
+    try:
+        imported = await chat_db_service.import_messages_async(
+            message.dict() for message in request.messages
+        )
+        return {"imported": imported}
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        logger.error(f"Failed to import messages: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/sessions/{session_id}/messages", response_model=List[ChatMessageResponse])
 async def get_session_messages(
     session_id: str,
+    response: Response,
     limit: int = Query(1000, ge=1, le=5000),
-    offset: int = Query(0, ge=0)
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None),
+    direction: str = Query("newer", pattern="^(newer|older)$")
 ):
-    """Get all messages for a chat session"""
+    """Get messages for a chat session in chronological order
+    
+    Paginated by cursor over (timestamp, id): without a cursor, direction
+    "newer" starts at the first message and "older" at the latest one. Follow
+    the X-Next-Cursor (newer) / X-Prev-Cursor (older) response headers to
+    fetch adjacent pages. A non-zero offset uses legacy offset paging.
+    """
     try:
-        messages = chat_db_service.get_session_messages(
-            session_id=session_id,
-            limit=limit,
-            offset=offset
-        )
+        if offset:
+            messages = await chat_db_service.get_session_messages_async(
+                session_id=session_id,
+                limit=limit,
+                offset=offset
+            )
+        else:
+            messages, next_cursor, prev_cursor = await chat_db_service.get_session_messages_page_async(
+                session_id=session_id,
+                limit=limit,
+                cursor=cursor,
+                direction=direction
+            )
+            _set_cursor_headers(response, next_cursor, prev_cursor)
         return [ChatMessageResponse(**message.to_dict()) for message in messages]
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Failed to get session messages: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -175,7 +264,7 @@ async def get_recent_messages(
 ):
     """Get recent messages for a chat session"""
     try:
-        messages = chat_db_service.get_recent_messages(session_id=session_id, limit=limit)
+        messages = await chat_db_service.get_recent_messages_async(session_id=session_id, limit=limit)
         # Reverse to get chronological order
         messages.reverse()
         return [ChatMessageResponse(**message.to_dict()) for message in messages]
@@ -187,7 +276,7 @@ async def get_recent_messages(
 async def delete_message(message_id: str):
     """Delete a specific message"""
     try:
-        success = chat_db_service.delete_message(message_id)
+        success = await chat_db_service.delete_message_async(message_id)
         if not success:
             raise HTTPException(status_code=404, detail="Message not found")
         return {"message": "Message deleted successfully"}
@@ -201,7 +290,7 @@ async def delete_message(message_id: str):
 async def get_session_stats(session_id: str):
     """Get statistics for a chat session"""
     try:
-        stats = chat_db_service.get_session_stats(session_id)
+        stats = await chat_db_service.get_session_stats_async(session_id)
         if not stats:
             raise HTTPException(status_code=404, detail="Chat session not found")
         return stats
@@ -211,20 +300,75 @@ async def get_session_stats(session_id: str):
         logger.error(f"Failed to get session stats: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/search", response_model=List[ChatMessageResponse])
+@router.get("/stats")
+async def get_global_stats(
+    days: int = Query(30, ge=1, le=366),
+    top_sessions: int = Query(10, ge=1, le=100)
+):
+    """Get message and token statistics across all sessions"""
+    try:
+        return await chat_db_service.get_global_stats_async(days=days, top_sessions=top_sessions)
+    except Exception as e:
+        logger.error(f"Failed to get chat stats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/usage")
+async def get_usage(
+    group_by: str = Query("model", pattern="^(session|model|day|task)$"),
+    days: int = Query(30, ge=1, le=366),
+    limit: int = Query(50, ge=1, le=500)
+):
+    """Get LLM tokens, calls and estimated cost grouped by session, model, day or task"""
+    try:
+        return await usage_ledger.get_usage_async(group_by=group_by, days=days, limit=limit)
+    except Exception as e:
+        logger.error(f"Failed to get LLM usage: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/sessions/{session_id}/usage")
+async def get_session_usage(
+    session_id: str,
+    group_by: str = Query("model", pattern="^(model|day|task)$"),
+    days: int = Query(366, ge=1, le=3660)
+):
+    """Get LLM tokens, calls and estimated cost of a chat session"""
+    try:
+        return await usage_ledger.get_usage_async(group_by=group_by, days=days, session_id=session_id)
+    except Exception as e:
+        logger.error(f"Failed to get session LLM usage: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/cache")
+async def get_cache_stats():
+    """Get hit/miss counters of the chat storage caches"""
+    return chat_db_service.cache_stats()
+
+@router.get("/history")
+async def get_history_stats():
+    """Get size, memory estimate and eviction counters of the in-memory chat histories"""
+    return history_store.stats()
+
+@router.get("/search", response_model=List[ChatSearchResultResponse])
 async def search_messages(
     query: str = Query(..., min_length=1),
     session_id: Optional[str] = Query(None),
     limit: int = Query(50, ge=1, le=500)
 ):
-    """Search messages by content"""
+    """Search messages by content, ranked by BM25 with highlighted snippets"""
     try:
-        messages = chat_db_service.search_messages(
+        messages = await chat_db_service.search_messages_async(
             query=query,
             session_id=session_id,
             limit=limit
         )
-        return [ChatMessageResponse(**message.to_dict()) for message in messages]
+        return [
+            ChatSearchResultResponse(
+                **message.to_dict(),
+                snippet=getattr(message, "_search_snippet", None),
+                rank=getattr(message, "_search_rank", None)
+            )
+            for message in messages
+        ]
     except Exception as e:
         logger.error(f"Failed to search messages: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -234,16 +378,16 @@ async def generate_session_title(session_id: str, request: TitleGenerateRequest)
     """Generate a title for a chat session based on the first message"""
     try:
         # Verify session exists
-        session = chat_db_service.get_session(session_id)
+        session = await chat_db_service.get_session_async(session_id)
         if not session:
             raise HTTPException(status_code=404, detail="Chat session not found")
         
         # Generate title using OpenAI
-        result = await openai_service.generate_chat_title(request.message)
+        result = await openai_service.generate_chat_title(request.message, session_id=session_id)
         
         if result["success"]:
             # Update session title
-            updated_session = chat_db_service.update_session(
+            updated_session = await chat_db_service.update_session_async(
                 session_id=session_id,
                 title=result["title"]
             )
@@ -259,7 +403,7 @@ async def generate_session_title(session_id: str, request: TitleGenerateRequest)
         else:
             # Return fallback title if AI generation fails
             fallback_title = result.get("title", f"Chat {request.message[:20]}...")
-            updated_session = chat_db_service.update_session(
+            updated_session = await chat_db_service.update_session_async(
                 session_id=session_id,
                 title=fallback_title
             )
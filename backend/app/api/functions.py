@@ -47,7 +47,7 @@ class FunctionResponse(BaseModel):
 async def get_available_functions(include_disabled: bool = False):
     """Get list of available functions from database"""
     try:
-        functions = function_db_service.get_all_functions(include_disabled=include_disabled)
+        functions = await function_db_service.get_all_functions_async(include_disabled=include_disabled)
         return [FunctionResponse(**func) for func in functions]
         
     except Exception as e:
@@ -58,7 +58,7 @@ async def get_available_functions(include_disabled: bool = False):
 async def create_function(function_data: FunctionCreate):
     """Create a new function"""
     try:
-        function = function_db_service.create_function(
+        function = await function_db_service.create_function_async(
             name=function_data.name,
             description=function_data.description,
             icon=function_data.icon,
@@ -82,7 +82,7 @@ async def create_function(function_data: FunctionCreate):
 async def get_function_categories():
     """Get all function categories"""
     try:
-        categories = function_db_service.get_categories()
+        categories = await function_db_service.get_categories_async()
         return {"categories": categories}
         
     except Exception as e:
@@ -93,7 +93,7 @@ async def get_function_categories():
 async def get_function(function_id: str):
     """Get a specific function"""
     try:
-        function = function_db_service.get_function(function_id)
+        function = await function_db_service.get_function_async(function_id)
         
         if not function:
             raise HTTPException(status_code=404, detail="Function not found")
@@ -110,7 +110,7 @@ async def get_function(function_id: str):
 async def update_function(function_id: str, function_data: FunctionUpdate):
     """Update an existing function"""
     try:
-        function = function_db_service.update_function(
+        function = await function_db_service.update_function_async(
             function_id=function_id,
             name=function_data.name,
             description=function_data.description,
@@ -136,7 +136,7 @@ async def update_function(function_id: str, function_data: FunctionUpdate):
 async def delete_function(function_id: str):
     """Delete a function"""
     try:
-        success = function_db_service.delete_function(function_id)
+        success = await function_db_service.delete_function_async(function_id)
         
         if not success:
             raise HTTPException(status_code=404, detail="Function not found or cannot be deleted")
@@ -75,4 +75,55 @@ async def get_openai_status():
         
     except Exception as e:
         logger.error(f"Failed to get OpenAI status: {e}")
+        raise HTTPException(status_code=500, detail=str(e)) 
+
+@router.get("/openai/cache")
+async def get_completion_cache_stats():
+    """Get completion cache hit ratio and saved tokens"""
+    try:
+        cache = openai_service.completion_cache
+        return cache.stats() if cache is not None else {"enabled": False}
+        
+    except Exception as e:
+        logger.error(f"Failed to get completion cache stats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/openai/in-flight")
+async def get_single_flight_stats():
+    """Get how many completion requests were coalesced with an identical one in flight"""
+    try:
+        return openai_service.single_flight.stats()
+        
+    except Exception as e:
+        logger.error(f"Failed to get single-flight stats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/openai/scheduler")
+async def get_scheduler_stats():
+    """Get request queue and rate-limit budget state per model"""
+    try:
+        return openai_service.scheduler.stats()
+        
+    except Exception as e:
+        logger.error(f"Failed to get scheduler stats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/openai/routing")
+async def get_routing_stats(limit: int = 50):
+    """Get the model routing policy, latencies per model and recent routing decisions"""
+    try:
+        return openai_service.router.stats(limit)
+        
+    except Exception as e:
+        logger.error(f"Failed to get routing stats: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/openai/hedging")
+async def get_hedging_stats():
+    """Get how many chat completions were hedged and how often the hedge won"""
+    try:
+        return openai_service.hedger.stats()
+        
+    except Exception as e:
+        logger.error(f"Failed to get hedging stats: {e}")
         raise HTTPException(status_code=500, detail=str(e)) 
\ No newline at end of file
@@ -1,8 +1,9 @@
 """
 Configuration settings for the application
 """
+import json
 import os
-from typing import Optional
+from typing import Dict, List, Optional
 
 class Settings:
     def __init__(self):
@@ -18,14 +19,125 @@ class Settings:
         
         # OpenAI settings
         self.openai_api_key: Optional[str] = os.getenv("OPENAI_API_KEY")
+        self.openai_base_url: Optional[str] = os.getenv("OPENAI_BASE_URL")
+        
+        # LLM backend: "openai", or "stub" to answer completions in-process for
+        # load tests and offline development (see app/services/llm_stub.py)
+        self.llm_backend: str = os.getenv("LLM_BACKEND", "openai")
+        self.llm_stub_latency_ms: float = float(os.getenv("LLM_STUB_LATENCY_MS", "300"))  # median time to first token
+        self.llm_stub_latency_distribution: str = os.getenv("LLM_STUB_LATENCY_DISTRIBUTION", "lognormal")  # fixed, uniform, exponential, lognormal
+        self.llm_stub_latency_sigma: float = float(os.getenv("LLM_STUB_LATENCY_SIGMA", "0.5"))  # lognormal spread
+        self.llm_stub_tokens_per_second: float = float(os.getenv("LLM_STUB_TOKENS_PER_SECOND", "80"))
+        self.llm_stub_completion_tokens: int = int(os.getenv("LLM_STUB_COMPLETION_TOKENS", "60"))
+        self.llm_stub_rate_limit_probability: float = float(os.getenv("LLM_STUB_RATE_LIMIT_PROBABILITY", "0"))  # share of 429s
+        self.llm_stub_retry_after_ms: int = int(os.getenv("LLM_STUB_RETRY_AFTER_MS", "200"))
+        
+        # OpenAI HTTP client (shared async connection pool)
+        self.openai_connect_timeout: float = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))  # seconds
+        self.openai_read_timeout: float = float(os.getenv("OPENAI_READ_TIMEOUT", "60"))  # seconds
+        self.openai_write_timeout: float = float(os.getenv("OPENAI_WRITE_TIMEOUT", "10"))  # seconds
+        self.openai_pool_timeout: float = float(os.getenv("OPENAI_POOL_TIMEOUT", "10"))  # seconds
+        self.openai_max_connections: int = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+        self.openai_max_keepalive_connections: int = int(os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", "20"))
+        self.openai_keepalive_expiry: float = float(os.getenv("OPENAI_KEEPALIVE_EXPIRY", "30"))  # seconds
+        
+        # OpenAI request scheduler; limits apply per model and are split between
+        # the uvicorn workers, 0 disables a budget
+        self.openai_max_concurrency: int = int(os.getenv("OPENAI_MAX_CONCURRENCY", "16"))
+        self.openai_requests_per_minute: int = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", "500"))
+        self.openai_tokens_per_minute: int = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", "200000"))
+        self.openai_model_limits: Dict[str, Dict[str, int]] = json.loads(os.getenv("OPENAI_MODEL_LIMITS", "{}"))  # {"gpt-4": {"rpm": 100, "tpm": 40000}}
+        self.openai_queue_timeout: float = float(os.getenv("OPENAI_QUEUE_TIMEOUT", "30"))  # seconds
+        self.openai_max_retries: int = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+        self.openai_backoff_base: float = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))  # seconds
+        self.openai_backoff_max: float = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))  # seconds
+        # Background calls (titles, summaries, connection tests) hold at most this
+        # share of the slots and overtake interactive ones after waiting max_wait
+        self.openai_background_share: float = float(os.getenv("OPENAI_BACKGROUND_SHARE", "0.25"))
+        self.openai_background_max_wait: float = float(os.getenv("OPENAI_BACKGROUND_MAX_WAIT", "5"))  # seconds
         
         # Database settings
         self.database_url: str = os.getenv("DATABASE_URL", "sqlite:///./app.db")
         
+        # SQLite storage profile
+        self.sqlite_path: Optional[str] = os.getenv("SQLITE_PATH")  # defaults to backend/data/attila.db
+        self.sqlite_journal_mode: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+        self.sqlite_synchronous: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+        self.sqlite_mmap_size: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+        self.sqlite_cache_size: int = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # negative = KiB
+        self.sqlite_busy_timeout: int = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # milliseconds
+        self.sqlite_read_pool_size: int = int(os.getenv("SQLITE_READ_POOL_SIZE", "4"))
+        
+        # Write-behind message persistence (queued inserts flushed in groups)
+        self.chat_write_behind: bool = os.getenv("CHAT_WRITE_BEHIND", "false").lower() == "true"
+        self.chat_write_behind_batch_size: int = int(os.getenv("CHAT_WRITE_BEHIND_BATCH_SIZE", "500"))
+        self.chat_write_behind_max_delay_ms: int = int(os.getenv("CHAT_WRITE_BEHIND_MAX_DELAY_MS", "50"))
+        self.chat_write_behind_max_pending: int = int(os.getenv("CHAT_WRITE_BEHIND_MAX_PENDING", "10000"))
+        
+        # Read-through cache for sessions and recent message windows (0 disables)
+        self.chat_session_cache_size: int = int(os.getenv("CHAT_SESSION_CACHE_SIZE", "1024"))
+        self.chat_recent_cache_size: int = int(os.getenv("CHAT_RECENT_CACHE_SIZE", "256"))
+        self.chat_cache_ttl: float = float(os.getenv("CHAT_CACHE_TTL", "30"))  # seconds
+        
+        # Rolling conversation summaries for long sessions
+        self.chat_summary_enabled: bool = os.getenv("CHAT_SUMMARY_ENABLED", "true").lower() == "true"
+        self.chat_summary_interval: int = int(os.getenv("CHAT_SUMMARY_INTERVAL", "8"))  # messages per refresh
+        self.chat_summary_keep_recent: int = int(os.getenv("CHAT_SUMMARY_KEEP_RECENT", "6"))  # messages kept verbatim
+        self.chat_summary_max_tokens: int = int(os.getenv("CHAT_SUMMARY_MAX_TOKENS", "400"))
+        # Prompt tokens of history sent with each turn, besides the summary; bounds the
+        # cost and latency of a turn in long conversations (0: as much as the model fits)
+        self.chat_context_history_tokens: int = int(os.getenv("CHAT_CONTEXT_HISTORY_TOKENS", "4000"))
+        
+        # In-memory histories of websocket chats: LRU with an idle TTL, capped per
+        # session; session histories cache the stored messages and, with sync, pick
+        # up messages stored by clients or other workers every turn (0 disables a limit)
+        self.chat_history_max_sessions: int = int(os.getenv("CHAT_HISTORY_MAX_SESSIONS", "1000"))
+        self.chat_history_ttl: float = float(os.getenv("CHAT_HISTORY_TTL", "1800"))  # seconds idle
+        self.chat_history_max_messages: int = int(os.getenv("CHAT_HISTORY_MAX_MESSAGES", "100"))  # per session
+        self.chat_history_max_bytes: int = int(os.getenv("CHAT_HISTORY_MAX_BYTES", str(64 * 1024 * 1024)))  # approximate
+        self.chat_history_load_limit: int = int(os.getenv("CHAT_HISTORY_LOAD_LIMIT", "20"))  # messages loaded per session
+        self.chat_history_sync: bool = os.getenv("CHAT_HISTORY_SYNC", "true").lower() == "true"
+        # Store user messages and replies of websocket chats server-side; leave off
+        # for clients that save them over the REST API (the web frontend does)
+        self.chat_persist_turns: bool = os.getenv("CHAT_PERSIST_TURNS", "false").lower() == "true"
+        
+        # Model routing: chat turns cascade down this list after the selected
+        # model on rate limits and timeouts; 0 disables a target
+        self.model_routing_enabled: bool = os.getenv("MODEL_ROUTING_ENABLED", "true").lower() == "true"
+        self.model_cascade: List[str] = [m.strip() for m in os.getenv("MODEL_CASCADE", "gpt-4o,gpt-4o-mini,gpt-3.5-turbo").split(",") if m.strip()]
+        self.model_latency_target_ms: float = float(os.getenv("MODEL_LATENCY_TARGET_MS", "0"))
+        self.model_max_cost_per_1k: float = float(os.getenv("MODEL_MAX_COST_PER_1K", "0"))  # USD
+        self.model_attempt_timeout: float = float(os.getenv("MODEL_ATTEMPT_TIMEOUT", "0"))  # seconds
+        
+        # Hedged chat completions (opt-in): a second request is sent once the first
+        # is slower than this percentile of recent latencies, for at most budget
+        # extra requests per request
+        self.openai_hedging_enabled: bool = os.getenv("OPENAI_HEDGING_ENABLED", "false").lower() == "true"
+        self.openai_hedge_percentile: float = float(os.getenv("OPENAI_HEDGE_PERCENTILE", "95"))
+        self.openai_hedge_min_delay: float = float(os.getenv("OPENAI_HEDGE_MIN_DELAY", "0.5"))  # seconds
+        self.openai_hedge_default_delay: float = float(os.getenv("OPENAI_HEDGE_DEFAULT_DELAY", "5"))  # seconds
+        self.openai_hedge_budget: float = float(os.getenv("OPENAI_HEDGE_BUDGET", "0.05"))
+        
+        # LLM usage ledger, written in batches off the request path
+        self.usage_ledger_enabled: bool = os.getenv("USAGE_LEDGER_ENABLED", "true").lower() == "true"
+        self.usage_ledger_batch_size: int = int(os.getenv("USAGE_LEDGER_BATCH_SIZE", "200"))
+        self.usage_ledger_max_delay_ms: float = float(os.getenv("USAGE_LEDGER_MAX_DELAY_MS", "1000"))
+        
+        # Completion cache for deterministic (low-temperature) LLM calls
+        self.completion_cache_enabled: bool = os.getenv("COMPLETION_CACHE_ENABLED", "true").lower() == "true"
+        self.completion_cache_size: int = int(os.getenv("COMPLETION_CACHE_SIZE", "1024"))
+        self.completion_cache_ttl: float = float(os.getenv("COMPLETION_CACHE_TTL", "3600"))  # seconds
+        self.completion_cache_max_temperature: float = float(os.getenv("COMPLETION_CACHE_MAX_TEMPERATURE", "0.3"))
+        self.completion_cache_persist: bool = os.getenv("COMPLETION_CACHE_PERSIST", "false").lower() == "true"
+        
+        # Event loop lag sampling for /health/loop (0 disables)
+        self.loop_lag_interval_ms: float = float(os.getenv("LOOP_LAG_INTERVAL_MS", "100"))
+        
         # Application settings
         self.app_name: str = "Attila AI Assistant"
         self.app_version: str = "1.0.0"
         self.debug: bool = os.getenv("DEBUG", "false").lower() == "true"
+        self.workers: int = int(os.getenv("WEB_CONCURRENCY", "1"))  # worker processes; also uvicorn's default --workers
 
 # Global settings instance
 settings = Settings() 
\ No newline at end of file
@@ -5,9 +5,19 @@ from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 import json
 import logging
+import threading
+import uuid
 
 from .services.chat_service import chat_service
 from .services.mcp_service import mcp_service
+from .services.database import db_service
+from .services.chat_database_service import chat_db_service
+from .services.openai_service import openai_service
+from .services.summarizer import conversation_summarizer
+from .services.usage_ledger import usage_ledger
+from .services.loop_monitor import loop_monitor
+from .services.context_builder import load_tokenizers
+from .services.model_catalog import MODEL_CONTEXT_WINDOWS
 from .api import functions, settings, chat
 from .api import simple_chat
 
@@ -24,6 +34,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Prev-Cursor"],  # Keyset pagination
 )
 
 # Include routers
@@ -32,6 +43,24 @@ app.include_router(settings.router, prefix="/api/settings", tags=["settings"])
 app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 app.include_router(simple_chat.router, prefix="/api/simple-chat", tags=["simple-chat"])
 
+@app.on_event("startup")
+async def startup():
+    loop_monitor.start()
+    # Loading may download tokenizer files; token counts are estimated meanwhile
+    threading.Thread(target=load_tokenizers, args=([openai_service.model, *MODEL_CONTEXT_WINDOWS],),
+                     name="tokenizer-loader", daemon=True).start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await loop_monitor.stop()
+    # Let summary refreshes finish and drain queued message and usage writes before
+    # closing the connection pools
+    await conversation_summarizer.drain()
+    await chat_db_service.close_async()
+    await usage_ledger.close_async()
+    await db_service.dispose()
+    await openai_service.aclose()
+
 @app.get("/")
 async def root():
     return {"message": "Attila AI Assistant API", "status": "running"}
@@ -40,9 +69,19 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/health/loop")
+async def loop_health(reset: bool = False):
+    """Event loop lag; reset=true starts a fresh measurement window"""
+    stats = loop_monitor.stats()
+    if reset:
+        loop_monitor.reset()
+    return stats
+
 @app.websocket("/ws/chat")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    # Keeps the history of chats without a session apart per connection
+    connection_id = uuid.uuid4().hex
     logger.info("WebSocket connection established")
     
     try:
@@ -54,13 +93,20 @@ async def websocket_endpoint(websocket: WebSocket):
             message = message_data.get("message", "")
             functions = message_data.get("functions", [])
             session_id = message_data.get("session_id")
+            stream = message_data.get("stream", False)
             
             logger.info(f"Received message: {message}")
             logger.info(f"Active functions: {functions}")
             logger.info(f"Session ID: {session_id}")
             
+            if stream:
+                # Forward start/delta/end frames as the completion is generated
+                async for frame in chat_service.process_message_stream(message, functions, session_id, connection_id):
+                    await websocket.send_text(json.dumps(frame))
+                continue
+            
             # Process message with session context
-            response = await chat_service.process_message(message, functions, session_id)
+            response = await chat_service.process_message(message, functions, session_id, connection_id)
             
             # Send response back to client
             await websocket.send_text(json.dumps(response))
@@ -69,4 +115,6 @@ async def websocket_endpoint(websocket: WebSocket):
         logger.info("WebSocket connection closed")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
-        await websocket.close() 
\ No newline at end of file
+        await websocket.close()
+    finally:
+        chat_service.end_connection(connection_id) 
\ No newline at end of file
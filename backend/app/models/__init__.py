@@ -1,3 +1,4 @@
 # Models package
 from .chat import *
-from .function import * 
\ No newline at end of file
+from .function import *
+from .llm import * 
\ No newline at end of file
@@ -1,7 +1,7 @@
 """
 Chat models for database storage
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, JSON, Boolean, Index
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
@@ -13,6 +13,11 @@ Base = declarative_base()
 class ChatSession(Base):
     """Chat Session Model"""
     __tablename__ = "chat_sessions"
+    __table_args__ = (
+        # Sidebar listing: active sessions ordered by most recent activity,
+        # with id as tie-breaker for keyset pagination
+        Index("ix_chat_sessions_active_updated_id", "is_active", "updated_at", "id"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     title = Column(String(255), nullable=False)
@@ -50,12 +55,21 @@ class ChatSession(Base):
 class ChatMessage(Base):
     """Chat Message Model"""
     __tablename__ = "chat_messages"
+    __table_args__ = (
+        # Per-session history, recent window and message counts, with id as
+        # tie-breaker for keyset pagination
+        Index("ix_chat_messages_session_timestamp_id", "session_id", "timestamp", "id"),
+        # Cross-session ordering by recency (search results)
+        Index("ix_chat_messages_timestamp", "timestamp"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     session_id = Column(String, ForeignKey("chat_sessions.id"), nullable=False)
     content = Column(Text, nullable=False)
     message_type = Column(String(50), nullable=False)  # 'user', 'assistant', 'system', 'error'
-    timestamp = Column(DateTime, default=func.now())
+    # Set client-side with microseconds, so messages stored within the same
+    # second keep their order
+    timestamp = Column(DateTime, default=datetime.utcnow)
     extra_data = Column(JSON)  # For storing functions, tokens, etc.
     
     # Relationship to session
@@ -69,4 +83,23 @@ class ChatMessage(Base):
             "type": self.message_type,
             "timestamp": self.timestamp.isoformat() if self.timestamp else None,
             "metadata": self.extra_data
-        } 
\ No newline at end of file
+        }
+
+class ChatMessageStat(Base):
+    """Daily message and token rollup per session and message type
+    
+    Maintained by triggers on chat_messages (see migrations), so aggregate
+    statistics never have to scan the message table.
+    """
+    __tablename__ = "chat_message_stats"
+    __table_args__ = (
+        Index("ix_chat_message_stats_session", "session_id"),
+    )
+    
+    day = Column(String(10), primary_key=True)  # 'YYYY-MM-DD' of the message timestamp
+    session_id = Column(String, primary_key=True)
+    message_type = Column(String(50), primary_key=True)
+    message_count = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+    total_tokens = Column(Integer, nullable=False, default=0) 
\ No newline at end of file
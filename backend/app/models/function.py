@@ -1,7 +1,7 @@
 """
 Function models for database storage
 """
-from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, JSON, Index
 from sqlalchemy.sql import func
 from datetime import datetime
 import uuid
@@ -10,6 +10,12 @@ from .chat import Base
 class Function(Base):
     """Function Model"""
     __tablename__ = "functions"
+    __table_args__ = (
+        # Enabled functions ordered by creation date
+        Index("ix_functions_enabled_created", "is_enabled", "created_at"),
+        # Enabled functions of a category ordered by creation date
+        Index("ix_functions_category_enabled_created", "category", "is_enabled", "created_at"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     name = Column(String(255), nullable=False)
@@ -0,0 +1,44 @@
+"""
+LLM call models for database storage
+"""
+from sqlalchemy import Column, Integer, String, DateTime, JSON, Float, Boolean, Index
+from sqlalchemy.sql import func
+from .chat import Base
+
+class CompletionCacheEntry(Base):
+    """Persisted completion for the deterministic completion cache"""
+    __tablename__ = "llm_completion_cache"
+    __table_args__ = (
+        # Pruning of expired entries
+        Index("ix_llm_completion_cache_expires_at", "expires_at"),
+    )
+    
+    key = Column(String(64), primary_key=True)  # sha256 of the canonical request
+    model = Column(String(100))
+    response = Column(JSON, nullable=False)  # content, model, usage, finish_reason
+    created_at = Column(DateTime, default=func.now())
+    expires_at = Column(DateTime, nullable=False)
+
+class UsageRecord(Base):
+    """One LLM call in the usage ledger"""
+    __tablename__ = "llm_usage"
+    __table_args__ = (
+        # Per-session totals and the time window of the aggregates
+        Index("ix_llm_usage_session_created", "session_id", "created_at"),
+        Index("ix_llm_usage_created_at", "created_at"),
+    )
+    
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    created_at = Column(DateTime, default=func.now(), nullable=False)
+    # Not foreign keys: the ledger outlives deleted sessions and messages
+    session_id = Column(String(36))
+    message_id = Column(String(36))
+    task = Column(String(20), nullable=False)  # chat, title, summary, connection_test
+    model = Column(String(100))
+    prompt_tokens = Column(Integer, default=0, nullable=False)
+    completion_tokens = Column(Integer, default=0, nullable=False)
+    total_tokens = Column(Integer, default=0, nullable=False)
+    latency_ms = Column(Integer)
+    cost = Column(Float)  # estimated USD, None for unknown models
+    cached = Column(Boolean, default=False, nullable=False)
+    success = Column(Boolean, default=True, nullable=False) 
\ No newline at end of file
@@ -0,0 +1,94 @@
+"""
+Bounded in-process LRU cache with per-entry TTL
+"""
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+import threading
+import time
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire after ttl seconds
+    
+    Loaders that read from the database should take `generation` before
+    the read and pass it to set(): if anything was invalidated meanwhile
+    the value may already be stale and is not stored. A maxsize of 0
+    disables the cache.
+    """
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 30.0, name: str = "cache"):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.name = name
+        self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    @property
+    def generation(self) -> int:
+        """Counter bumped by every invalidation"""
+        return self._generation
+    
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value for key, or default on a miss"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def set(self, key: Hashable, value: Any, generation: Optional[int] = None) -> bool:
+        """Store a value; returns False if it was skipped as possibly stale"""
+        if self.maxsize <= 0:
+            return False
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return False
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+            return True
+    
+    def invalidate(self, key: Hashable):
+        """Drop a key and make in-flight loads skip storing their result"""
+        with self._lock:
+            self._generation += 1
+            self._data.pop(key, None)
+    
+    def clear(self):
+        """Drop all entries"""
+        with self._lock:
+            self._generation += 1
+            self._data.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Size and hit/miss counters for sizing the cache"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "name": self.name,
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
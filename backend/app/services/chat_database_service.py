@@ -1,234 +1,933 @@
 """
 Chat Database Service for managing chat sessions and messages
 """
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple, Iterable, Iterator
 from sqlalchemy.orm import Session
-from sqlalchemy import desc, func
+from sqlalchemy import desc, func, select, text, literal_column, insert, update, bindparam, or_
+import asyncio
+import copy
 import logging
-from datetime import datetime
+import uuid
+from datetime import datetime, timedelta, timezone
 
-from ..models.chat import ChatSession, ChatMessage
-from .database import db_service
+from ..models.chat import ChatSession, ChatMessage, ChatMessageStat
+from ..core.config import settings
+from .database import DatabaseService, db_service
+from .cache import TTLCache
+from .pagination import keyset_paginate, keyset_tail
+from .write_behind import WriteBehindQueue
 
 logger = logging.getLogger(__name__)
 
+# Session metadata keys owned by the server (the conversation summary);
+# update_session() keeps them when a client replaces the metadata
+RESERVED_METADATA_KEYS = ("summary",)
+
 class ChatDatabaseService:
-    def __init__(self):
-        self.db = db_service
+    def __init__(self, db: DatabaseService = None, write_behind: bool = None):
+        self.db = db or db_service
+        
+        # Optional write-behind mode: add_message() queues the insert and a
+        # background thread commits queued messages in grouped transactions
+        if write_behind is None:
+            write_behind = settings.chat_write_behind
+        self.write_queue: Optional[WriteBehindQueue] = None
+        # Sessions already seen by add_message(), so queued inserts skip the lookup
+        self._known_sessions: set = set()
+        if write_behind:
+            self.write_queue = WriteBehindQueue(
+                self._flush_queued_messages,
+                max_batch=settings.chat_write_behind_batch_size,
+                max_delay=settings.chat_write_behind_max_delay_ms / 1000,
+                max_pending=settings.chat_write_behind_max_pending,
+                name="chat-write-behind"
+            )
+            self.write_queue.start()
+        
+        # Read-through caches for hot sessions and their recent message
+        # windows; entries are column snapshots, so every caller gets fresh
+        # detached objects. Per process: other workers' writes show up
+        # after at most the TTL.
+        self.session_cache = TTLCache(settings.chat_session_cache_size, settings.chat_cache_ttl, "sessions")
+        self.recent_cache = TTLCache(settings.chat_recent_cache_size, settings.chat_cache_ttl, "recent_messages")
+    
+    def _query_sessions_with_counts(self, session: Session):
+        """Query (ChatSession, message_count) rows in a single statement.
+        
+        The count is a correlated subquery per returned row, so the cost
+        follows the number of sessions returned rather than issuing one
+        extra COUNT(*) round-trip per session.
+        """
+        message_count = (select(func.count(ChatMessage.id))
+                         .where(ChatMessage.session_id == ChatSession.id)
+                         .correlate(ChatSession)
+                         .scalar_subquery())
+        return session.query(ChatSession, message_count)
+    
+    def _detach_with_count(self, session: Session, chat_session: ChatSession, message_count: int) -> ChatSession:
+        # Attach message count to avoid relationship access after detaching
+        chat_session._message_count = message_count or 0
+        session.expunge(chat_session)
+        return chat_session
+    
+    # Caching
+    @staticmethod
+    def _snapshot(instance) -> Dict[str, Any]:
+        return {column.key: getattr(instance, column.key) for column in instance.__table__.columns}
+    
+    @staticmethod
+    def _restore(model, snapshot: Dict[str, Any]):
+        # Copy JSON columns so callers cannot mutate the cached snapshot
+        return model(**{key: copy.deepcopy(value) if isinstance(value, (dict, list)) else value
+                        for key, value in snapshot.items()})
+    
+    def _cached_session(self, session_id: str) -> Optional[ChatSession]:
+        cached = self.session_cache.get(session_id)
+        if cached is None:
+            return None
+        snapshot, message_count = cached
+        chat_session = self._restore(ChatSession, snapshot)
+        chat_session._message_count = message_count
+        return chat_session
+    
+    def _cache_session(self, chat_session: Optional[ChatSession], generation: int):
+        if chat_session is not None:
+            self.session_cache.set(chat_session.id, (self._snapshot(chat_session), chat_session._message_count),
+                                   generation)
+    
+    def _cached_recent_messages(self, session_id: str, limit: int) -> Optional[List[ChatMessage]]:
+        cached = self.recent_cache.get(session_id)
+        if cached is None:
+            return None
+        window, snapshots = cached
+        # A shorter window than requested is only usable if it holds the whole history
+        if limit > window and len(snapshots) >= window:
+            return None
+        return [self._restore(ChatMessage, snapshot) for snapshot in snapshots[:limit]]
+    
+    def _cache_recent_messages(self, session_id: str, limit: int, messages: List[ChatMessage], generation: int):
+        # Only reached on a miss, so this never replaces a larger usable window
+        self.recent_cache.set(session_id, (limit, [self._snapshot(message) for message in messages]), generation)
+    
+    def _invalidate_session(self, session_id: str):
+        """Drop cached data of a session after a committed change"""
+        self.session_cache.invalidate(session_id)
+        self.recent_cache.invalidate(session_id)
+    
+    def cache_stats(self) -> Dict[str, Any]:
+        """Hit/miss counters of the read caches (and the write-behind queue, if enabled)"""
+        stats = {
+            "sessions": self.session_cache.stats(),
+            "recent_messages": self.recent_cache.stats()
+        }
+        if self.write_queue:
+            stats["write_queue"] = self.write_queue.stats()
+        return stats
+    
+    # Write-behind
+    def _read_your_writes(self, session_id: str = None):
+        """Flush queued messages a read depends on (all of them if session_id is None)"""
+        if self.write_queue and self.write_queue.has_pending(session_id):
+            self.write_queue.flush()
+    
+    async def _read_your_writes_async(self, session_id: str = None):
+        if self.write_queue and self.write_queue.has_pending(session_id):
+            await asyncio.to_thread(self.write_queue.flush)
+    
+    def _queue_message(self, session_id: str, content: str, message_type: str,
+                       metadata: Dict = None) -> ChatMessage:
+        # Id and timestamp are assigned now, so the returned message matches
+        # the row that is eventually written
+        row = self._build_message_rows([{
+            "session_id": session_id,
+            "content": content,
+            "message_type": message_type,
+            "metadata": metadata
+        }])[0]
+        self.write_queue.put(row, key=session_id)
+        self._invalidate_session(session_id)
+        return ChatMessage(**row)
+    
+    def _remember_session(self, session_id: str):
+        if len(self._known_sessions) >= 10000:
+            self._known_sessions.clear()
+        self._known_sessions.add(session_id)
+    
+    def _flush_queued_messages(self, rows: List[Dict[str, Any]]):
+        with self.db.get_session() as session:
+            session_ids = {row["session_id"] for row in rows}
+            existing = self._existing_session_ids(session, session_ids)
+            if existing != session_ids:
+                # Sessions deleted while their messages were queued
+                dropped = [row for row in rows if row["session_id"] not in existing]
+                logger.warning(f"Dropping {len(dropped)} queued messages for deleted chat sessions")
+                rows = [row for row in rows if row["session_id"] in existing]
+            if rows:
+                self._insert_message_rows(session, rows)
+        for session_id in existing:
+            self._invalidate_session(session_id)
+    
+    def flush_pending_writes(self) -> int:
+        """Write out queued messages now; returns the number of messages written"""
+        return self.write_queue.flush() if self.write_queue else 0
+    
+    def close(self):
+        """Drain queued messages and stop the write-behind flusher"""
+        if self.write_queue:
+            self.write_queue.close()
+    
+    async def close_async(self):
+        """Drain queued messages and stop the write-behind flusher (async)"""
+        await asyncio.to_thread(self.close)
     
     # Session Management
     def create_session(self, title: str, description: str = None, metadata: Dict = None) -> ChatSession:
         """Create a new chat session"""
         with self.db.get_session() as session:
-            chat_session = ChatSession(
-                title=title,
-                description=description,
-                extra_data=metadata or {}
-            )
-            session.add(chat_session)
-            session.flush()
-            session.refresh(chat_session)
-            # Get message count and attach it to avoid relationship access
-            message_count = session.query(ChatMessage).filter(ChatMessage.session_id == chat_session.id).count()
-            chat_session._message_count = message_count
-            session.expunge(chat_session)
-            return chat_session
+            return self._create_session(session, title, description, metadata)
+    
+    async def create_session_async(self, title: str, description: str = None, metadata: Dict = None) -> ChatSession:
+        """Create a new chat session (async)"""
+        async with self.db.get_async_session() as session:
+            return await session.run_sync(self._create_session, title, description, metadata)
+    
+    def _create_session(self, session: Session, title: str, description: str = None, metadata: Dict = None) -> ChatSession:
+        chat_session = ChatSession(
+            title=title,
+            description=description,
+            extra_data=metadata or {}
+        )
+        session.add(chat_session)
+        session.flush()
+        session.refresh(chat_session)
+        # A brand new session has no messages yet
+        return self._detach_with_count(session, chat_session, 0)
     
     def get_session(self, session_id: str) -> Optional[ChatSession]:
         """Get a chat session by ID"""
-        with self.db.get_session() as session:
-            chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
-            if chat_session:
-                # Get message count and attach it to avoid relationship access
-                message_count = session.query(ChatMessage).filter(ChatMessage.session_id == chat_session.id).count()
-                chat_session._message_count = message_count
-                session.expunge(chat_session)
+        self._read_your_writes(session_id)
+        chat_session = self._cached_session(session_id)
+        if chat_session is not None:
             return chat_session
+        generation = self.session_cache.generation
+        with self.db.get_read_session() as session:
+            chat_session = self._get_session(session, session_id)
+        self._cache_session(chat_session, generation)
+        return chat_session
+    
+    async def get_session_async(self, session_id: str) -> Optional[ChatSession]:
+        """Get a chat session by ID (async)"""
+        await self._read_your_writes_async(session_id)
+        chat_session = self._cached_session(session_id)
+        if chat_session is not None:
+            return chat_session
+        generation = self.session_cache.generation
+        async with self.db.get_async_read_session() as session:
+            chat_session = await session.run_sync(self._get_session, session_id)
+        self._cache_session(chat_session, generation)
+        return chat_session
+    
+    def _get_session(self, session: Session, session_id: str) -> Optional[ChatSession]:
+        row = self._query_sessions_with_counts(session).filter(ChatSession.id == session_id).first()
+        if not row:
+            return None
+        return self._detach_with_count(session, *row)
     
     def get_all_sessions(self, limit: int = 100, include_inactive: bool = False) -> List[ChatSession]:
         """Get all chat sessions"""
-        with self.db.get_session() as session:
-            query = session.query(ChatSession)
-            
-            if not include_inactive:
-                query = query.filter(ChatSession.is_active == True)
-            
-            chat_sessions = query.order_by(desc(ChatSession.updated_at)).limit(limit).all()
-            
-            # Get message count for each session to avoid relationship access
-            for chat_session in chat_sessions:
-                message_count = session.query(ChatMessage).filter(ChatMessage.session_id == chat_session.id).count()
-                chat_session._message_count = message_count
-                session.expunge(chat_session)
-            
-            return chat_sessions
+        self._read_your_writes()
+        with self.db.get_read_session() as session:
+            return self._get_all_sessions(session, limit, include_inactive)
+    
+    async def get_all_sessions_async(self, limit: int = 100, include_inactive: bool = False) -> List[ChatSession]:
+        """Get all chat sessions (async)"""
+        await self._read_your_writes_async()
+        async with self.db.get_async_read_session() as session:
+            return await session.run_sync(self._get_all_sessions, limit, include_inactive)
+    
+    def _get_all_sessions(self, session: Session, limit: int = 100, include_inactive: bool = False) -> List[ChatSession]:
+        query = self._query_sessions_with_counts(session)
+        
+        if not include_inactive:
+            query = query.filter(ChatSession.is_active == True)
+        
+        rows = query.order_by(desc(ChatSession.updated_at)).limit(limit).all()
+        
+        return [self._detach_with_count(session, chat_session, message_count)
+                for chat_session, message_count in rows]
+    
+    def get_sessions_page(self, limit: int = 100, include_inactive: bool = False,
+                          cursor: str = None) -> Tuple[List[ChatSession], Optional[str], Optional[str]]:
+        """Get one page of chat sessions, most recently updated first"""
+        self._read_your_writes()
+        with self.db.get_read_session() as session:
+            return self._get_sessions_page(session, limit, include_inactive, cursor)
+    
+    async def get_sessions_page_async(self, limit: int = 100, include_inactive: bool = False,
+                                      cursor: str = None) -> Tuple[List[ChatSession], Optional[str], Optional[str]]:
+        """Get one page of chat sessions, most recently updated first (async)"""
+        await self._read_your_writes_async()
+        async with self.db.get_async_read_session() as session:
+            return await session.run_sync(self._get_sessions_page, limit, include_inactive, cursor)
+    
+    def _get_sessions_page(self, session: Session, limit: int = 100, include_inactive: bool = False,
+                           cursor: str = None) -> Tuple[List[ChatSession], Optional[str], Optional[str]]:
+        query = self._query_sessions_with_counts(session)
+        
+        if not include_inactive:
+            query = query.filter(ChatSession.is_active == True)
+        
+        rows, next_cursor, prev_cursor = keyset_paginate(
+            query, (ChatSession.updated_at, ChatSession.id), limit, cursor, descending=True
+        )
+        sessions = [self._detach_with_count(session, chat_session, message_count)
+                    for chat_session, message_count in rows]
+        return sessions, next_cursor, prev_cursor
     
     def update_session(self, session_id: str, title: str = None, description: str = None, 
                       metadata: Dict = None) -> Optional[ChatSession]:
         """Update a chat session"""
+        self._read_your_writes(session_id)
         with self.db.get_session() as session:
-            chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
-            
-            if not chat_session:
-                return None
-            
-            if title is not None:
-                chat_session.title = title
-            if description is not None:
-                chat_session.description = description
-            if metadata is not None:
-                chat_session.extra_data = metadata
-            
-            chat_session.updated_at = func.now()
-            session.flush()
-            session.refresh(chat_session)
-            # Get message count and attach it to avoid relationship access
-            message_count = session.query(ChatMessage).filter(ChatMessage.session_id == chat_session.id).count()
-            chat_session._message_count = message_count
-            session.expunge(chat_session)
-            return chat_session
+            chat_session = self._update_session(session, session_id, title, description, metadata)
+        self._invalidate_session(session_id)
+        return chat_session
+    
+    async def update_session_async(self, session_id: str, title: str = None, description: str = None, 
+                                   metadata: Dict = None) -> Optional[ChatSession]:
+        """Update a chat session (async)"""
+        await self._read_your_writes_async(session_id)
+        async with self.db.get_async_session() as session:
+            chat_session = await session.run_sync(self._update_session, session_id, title, description, metadata)
+        self._invalidate_session(session_id)
+        return chat_session
+    
+    def _update_session(self, session: Session, session_id: str, title: str = None, description: str = None, 
+                        metadata: Dict = None) -> Optional[ChatSession]:
+        chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
+        
+        if not chat_session:
+            return None
+        
+        if title is not None:
+            chat_session.title = title
+        if description is not None:
+            chat_session.description = description
+        if metadata is not None:
+            # Replaced, except for the keys the server writes in the background
+            current = chat_session.extra_data or {}
+            reserved = {key: current[key] for key in RESERVED_METADATA_KEYS if key in current}
+            chat_session.extra_data = {**metadata, **reserved}
+        
+        chat_session.updated_at = func.now()
+        session.flush()
+        # Reload the row (for the server-side updated_at) together with its count
+        chat_session, message_count = (self._query_sessions_with_counts(session)
+                                       .filter(ChatSession.id == session_id)
+                                       .populate_existing()
+                                       .one())
+        return self._detach_with_count(session, chat_session, message_count)
+    
+    def update_session_metadata(self, session_id: str, updates: Dict[str, Any]) -> bool:
+        """Merge keys into a session's metadata, keeping the others and its updated_at"""
+        with self.db.get_session() as session:
+            updated = self._update_session_metadata(session, session_id, updates)
+        self._invalidate_session(session_id)
+        return updated
+    
+    async def update_session_metadata_async(self, session_id: str, updates: Dict[str, Any]) -> bool:
+        """Merge keys into a session's metadata, keeping the others and its updated_at (async)"""
+        async with self.db.get_async_session() as session:
+            updated = await session.run_sync(self._update_session_metadata, session_id, updates)
+        self._invalidate_session(session_id)
+        return updated
+    
+    def _update_session_metadata(self, session: Session, session_id: str, updates: Dict[str, Any]) -> bool:
+        chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
+        
+        if not chat_session:
+            return False
+        
+        # Setting updated_at to itself keeps onupdate from bumping it, so
+        # background metadata writes do not reorder the session list
+        sessions_table = ChatSession.__table__
+        session.execute(
+            update(sessions_table)
+            .where(sessions_table.c.id == session_id)
+            .values(extra_data={**(chat_session.extra_data or {}), **updates},
+                    updated_at=sessions_table.c.updated_at)
+        )
+        return True
     
     def delete_session(self, session_id: str) -> bool:
         """Delete a chat session (soft delete)"""
         with self.db.get_session() as session:
-            chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
-            
-            if not chat_session:
-                return False
-            
-            chat_session.is_active = False
-            chat_session.updated_at = func.now()
-            return True
+            deleted = self._delete_session(session, session_id)
+        self._invalidate_session(session_id)
+        return deleted
+    
+    async def delete_session_async(self, session_id: str) -> bool:
+        """Delete a chat session (soft delete, async)"""
+        async with self.db.get_async_session() as session:
+            deleted = await session.run_sync(self._delete_session, session_id)
+        self._invalidate_session(session_id)
+        return deleted
+    
+    def _delete_session(self, session: Session, session_id: str) -> bool:
+        chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
+        
+        if not chat_session:
+            return False
+        
+        chat_session.is_active = False
+        chat_session.updated_at = func.now()
+        return True
     
     def delete_session_permanently(self, session_id: str) -> bool:
         """Permanently delete a chat session and all its messages"""
+        self._read_your_writes(session_id)
         with self.db.get_session() as session:
-            chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
-            
-            if not chat_session:
-                return False
-            
-            session.delete(chat_session)
-            return True
+            deleted = self._delete_session_permanently(session, session_id)
+        self._invalidate_session(session_id)
+        return deleted
+    
+    async def delete_session_permanently_async(self, session_id: str) -> bool:
+        """Permanently delete a chat session and all its messages (async)"""
+        await self._read_your_writes_async(session_id)
+        async with self.db.get_async_session() as session:
+            deleted = await session.run_sync(self._delete_session_permanently, session_id)
+        self._invalidate_session(session_id)
+        return deleted
+    
+    def _delete_session_permanently(self, session: Session, session_id: str) -> bool:
+        self._known_sessions.discard(session_id)
+        chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
+        
+        if not chat_session:
+            return False
+        
+        session.delete(chat_session)
+        return True
     
     # Message Management
     def add_message(self, session_id: str, content: str, message_type: str, 
                    metadata: Dict = None) -> Optional[ChatMessage]:
         """Add a message to a chat session"""
+        if self.write_queue:
+            if session_id not in self._known_sessions:
+                with self.db.get_read_session() as session:
+                    if not self._existing_session_ids(session, {session_id}):
+                        logger.error(f"Chat session {session_id} not found")
+                        return None
+                self._remember_session(session_id)
+            return self._queue_message(session_id, content, message_type, metadata)
         with self.db.get_session() as session:
-            # Check if session exists
-            chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
-            if not chat_session:
-                logger.error(f"Chat session {session_id} not found")
-                return None
-            
-            # Create message
-            message = ChatMessage(
-                session_id=session_id,
-                content=content,
-                message_type=message_type,
-                extra_data=metadata or {}
-            )
-            
-            session.add(message)
-            
-            # Update session timestamp
-            chat_session.updated_at = func.now()
+            message = self._add_message(session, session_id, content, message_type, metadata)
+        self._invalidate_session(session_id)
+        return message
+    
+    async def add_message_async(self, session_id: str, content: str, message_type: str, 
+                                metadata: Dict = None) -> Optional[ChatMessage]:
+        """Add a message to a chat session (async)"""
+        if self.write_queue:
+            if session_id not in self._known_sessions:
+                async with self.db.get_async_read_session() as session:
+                    if not await session.run_sync(self._existing_session_ids, {session_id}):
+                        logger.error(f"Chat session {session_id} not found")
+                        return None
+                self._remember_session(session_id)
+            # May wait for room when the queue is full
+            return await asyncio.to_thread(self._queue_message, session_id, content, message_type, metadata)
+        async with self.db.get_async_session() as session:
+            message = await session.run_sync(self._add_message, session_id, content, message_type, metadata)
+        self._invalidate_session(session_id)
+        return message
+    
+    def _add_message(self, session: Session, session_id: str, content: str, message_type: str, 
+                     metadata: Dict = None) -> Optional[ChatMessage]:
+        # Check if session exists
+        chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
+        if not chat_session:
+            logger.error(f"Chat session {session_id} not found")
+            return None
+        
+        # Create message
+        message = ChatMessage(
+            session_id=session_id,
+            content=content,
+            message_type=message_type,
+            extra_data=metadata or {}
+        )
+        
+        session.add(message)
+        
+        # Update session timestamp
+        chat_session.updated_at = func.now()
+        
+        session.flush()
+        session.refresh(message)
+        # Expunge to make it detached from session
+        session.expunge(message)
+        return message
+    
+    def add_messages(self, session_id: str, messages: List[Dict[str, Any]]) -> Optional[List[ChatMessage]]:
+        """Add several messages to a chat session in a single transaction
+        
+        Each item holds content, message_type and optionally metadata and
+        timestamp. Returns None if the session does not exist.
+        """
+        self._read_your_writes(session_id)
+        with self.db.get_session() as session:
+            added = self._add_messages(session, session_id, messages)
+        self._invalidate_session(session_id)
+        return added
+    
+    async def add_messages_async(self, session_id: str, messages: List[Dict[str, Any]]) -> Optional[List[ChatMessage]]:
+        """Add several messages to a chat session in a single transaction (async)"""
+        await self._read_your_writes_async(session_id)
+        async with self.db.get_async_session() as session:
+            added = await session.run_sync(self._add_messages, session_id, messages)
+        self._invalidate_session(session_id)
+        return added
+    
+    def _add_messages(self, session: Session, session_id: str, messages: List[Dict[str, Any]]) -> Optional[List[ChatMessage]]:
+        # Touching the session timestamp doubles as the existence check
+        updated = (session.query(ChatSession)
+                   .filter(ChatSession.id == session_id)
+                   .update({ChatSession.updated_at: func.now()}, synchronize_session=False))
+        if not updated:
+            logger.error(f"Chat session {session_id} not found")
+            return None
+        
+        if not messages:
+            return []
+        
+        rows = self._build_message_rows([dict(message, session_id=session_id) for message in messages])
+        session.execute(insert(ChatMessage.__table__), rows)
+        return [ChatMessage(**row) for row in rows]
+    
+    def import_messages(self, messages: Iterable[Dict[str, Any]], batch_size: int = 5000) -> int:
+        """
+        Bulk load historical messages into existing sessions
+        
+        Messages are inserted with executemany in batches, one transaction
+        per batch, and each session's updated_at is moved forward to its
+        newest imported message. Raises ValueError if a batch references an
+        unknown session; earlier batches stay committed.
+        
+        Args:
+            messages: Dicts with session_id, content, message_type and
+                optionally metadata and timestamp
+            batch_size: Number of messages per transaction
             
-            session.flush()
-            session.refresh(message)
-            # Expunge to make it detached from session
-            session.expunge(message)
-            return message
+        Returns:
+            int: Number of imported messages
+        """
+        imported = 0
+        for batch in self._batched(messages, batch_size):
+            with self.db.get_session() as session:
+                imported += self._import_batch(session, batch)
+            for session_id in {message["session_id"] for message in batch}:
+                self._invalidate_session(session_id)
+        logger.info(f"Imported {imported} chat messages")
+        return imported
+    
+    async def import_messages_async(self, messages: Iterable[Dict[str, Any]], batch_size: int = 5000) -> int:
+        """Bulk load historical messages into existing sessions (async)"""
+        imported = 0
+        for batch in self._batched(messages, batch_size):
+            async with self.db.get_async_session() as session:
+                imported += await session.run_sync(self._import_batch, batch)
+            for session_id in {message["session_id"] for message in batch}:
+                self._invalidate_session(session_id)
+        logger.info(f"Imported {imported} chat messages")
+        return imported
+    
+    def _import_batch(self, session: Session, batch: List[Dict[str, Any]]) -> int:
+        session_ids = {message["session_id"] for message in batch}
+        missing = session_ids - self._existing_session_ids(session, session_ids)
+        if missing:
+            raise ValueError(f"Unknown chat sessions: {', '.join(sorted(missing))}")
+        
+        rows = self._build_message_rows(batch)
+        self._insert_message_rows(session, rows)
+        return len(rows)
+    
+    def _existing_session_ids(self, session: Session, session_ids: Iterable[str]) -> set:
+        return {row[0] for row in session.query(ChatSession.id).filter(ChatSession.id.in_(list(session_ids)))}
+    
+    def _insert_message_rows(self, session: Session, rows: List[Dict[str, Any]]):
+        session.execute(insert(ChatMessage.__table__), rows)
+        
+        # Move each session's activity timestamp forward to its newest message
+        newest: Dict[str, datetime] = {}
+        for row in rows:
+            if row["session_id"] not in newest or row["timestamp"] > newest[row["session_id"]]:
+                newest[row["session_id"]] = row["timestamp"]
+        sessions_table = ChatSession.__table__
+        session.execute(
+            update(sessions_table)
+            .where(sessions_table.c.id == bindparam("sid"),
+                   or_(sessions_table.c.updated_at.is_(None), sessions_table.c.updated_at < bindparam("ts")))
+            .values(updated_at=bindparam("ts")),
+            [{"sid": sid, "ts": ts} for sid, ts in newest.items()]
+        )
+    
+    @staticmethod
+    def _build_message_rows(messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Build chat_messages rows with client-side ids and timestamps"""
+        # Messages without a timestamp get increasing microseconds so their
+        # order within a batch survives (timestamp, id) sorting
+        now = datetime.utcnow()
+        return [
+            {
+                "id": str(uuid.uuid4()),
+                "session_id": message["session_id"],
+                "content": message["content"],
+                "message_type": message["message_type"],
+                "timestamp": ChatDatabaseService._naive_utc(message.get("timestamp"))
+                             or now + timedelta(microseconds=index),
+                "extra_data": message.get("metadata") or {}
+            }
+            for index, message in enumerate(messages)
+        ]
+    
+    @staticmethod
+    def _naive_utc(timestamp: Optional[datetime]) -> Optional[datetime]:
+        """Timestamps are stored as naive UTC, like the utcnow() defaults; aware ones are converted"""
+        if timestamp is not None and timestamp.tzinfo is not None:
+            return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+        return timestamp
+    
+    @staticmethod
+    def _batched(items: Iterable[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
     
     def get_session_messages(self, session_id: str, limit: int = 1000, 
                            offset: int = 0) -> List[ChatMessage]:
         """Get all messages for a chat session"""
-        with self.db.get_session() as session:
-            messages = (session.query(ChatMessage)
-                       .filter(ChatMessage.session_id == session_id)
-                       .order_by(ChatMessage.timestamp)
-                       .offset(offset)
-                       .limit(limit)
-                       .all())
-            
-            # Expunge messages to make them detached from session
-            for message in messages:
-                session.expunge(message)
-            
-            return messages
+        self._read_your_writes(session_id)
+        with self.db.get_read_session() as session:
+            return self._get_session_messages(session, session_id, limit, offset)
+    
+    async def get_session_messages_async(self, session_id: str, limit: int = 1000, 
+                                         offset: int = 0) -> List[ChatMessage]:
+        """Get all messages for a chat session (async)"""
+        await self._read_your_writes_async(session_id)
+        async with self.db.get_async_read_session() as session:
+            return await session.run_sync(self._get_session_messages, session_id, limit, offset)
+    
+    def _get_session_messages(self, session: Session, session_id: str, limit: int = 1000, 
+                              offset: int = 0) -> List[ChatMessage]:
+        messages = (session.query(ChatMessage)
+                   .filter(ChatMessage.session_id == session_id)
+                   .order_by(ChatMessage.timestamp, ChatMessage.id)
+                   .offset(offset)
+                   .limit(limit)
+                   .all())
+        
+        # Expunge messages to make them detached from session
+        for message in messages:
+            session.expunge(message)
+        
+        return messages
+    
+    def get_session_messages_page(self, session_id: str, limit: int = 100, cursor: str = None,
+                                  direction: str = "newer") -> Tuple[List[ChatMessage], Optional[str], Optional[str]]:
+        """Get one page of a session's messages in chronological order
+        
+        Without a cursor, direction "newer" starts at the first message and
+        "older" at the latest one (infinite scroll upwards). A cursor
+        returned by a previous page carries its own direction.
+        """
+        self._read_your_writes(session_id)
+        with self.db.get_read_session() as session:
+            return self._get_session_messages_page(session, session_id, limit, cursor, direction)
+    
+    async def get_session_messages_page_async(self, session_id: str, limit: int = 100, cursor: str = None,
+                                              direction: str = "newer"
+                                              ) -> Tuple[List[ChatMessage], Optional[str], Optional[str]]:
+        """Get one page of a session's messages in chronological order (async)"""
+        await self._read_your_writes_async(session_id)
+        async with self.db.get_async_read_session() as session:
+            return await session.run_sync(self._get_session_messages_page, session_id, limit, cursor, direction)
+    
+    def _get_session_messages_page(self, session: Session, session_id: str, limit: int = 100, cursor: str = None,
+                                   direction: str = "newer") -> Tuple[List[ChatMessage], Optional[str], Optional[str]]:
+        query = session.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+        messages, next_cursor, prev_cursor = keyset_paginate(
+            query, (ChatMessage.timestamp, ChatMessage.id), limit, cursor, from_end=(direction == "older")
+        )
+        
+        # Expunge messages to make them detached from session
+        for message in messages:
+            session.expunge(message)
+        
+        return messages, next_cursor, prev_cursor
     
     def get_recent_messages(self, session_id: str, limit: int = 10) -> List[ChatMessage]:
         """Get recent messages for a chat session"""
-        with self.db.get_session() as session:
-            messages = (session.query(ChatMessage)
-                       .filter(ChatMessage.session_id == session_id)
-                       .order_by(desc(ChatMessage.timestamp))
-                       .limit(limit)
-                       .all())
-            
-            # Expunge messages to make them detached from session
-            for message in messages:
-                session.expunge(message)
-            
+        self._read_your_writes(session_id)
+        messages = self._cached_recent_messages(session_id, limit)
+        if messages is not None:
+            return messages
+        generation = self.recent_cache.generation
+        with self.db.get_read_session() as session:
+            messages = self._get_recent_messages(session, session_id, limit)
+        self._cache_recent_messages(session_id, limit, messages, generation)
+        return messages
+    
+    async def get_recent_messages_async(self, session_id: str, limit: int = 10) -> List[ChatMessage]:
+        """Get recent messages for a chat session (async)"""
+        await self._read_your_writes_async(session_id)
+        messages = self._cached_recent_messages(session_id, limit)
+        if messages is not None:
             return messages
+        generation = self.recent_cache.generation
+        async with self.db.get_async_read_session() as session:
+            messages = await session.run_sync(self._get_recent_messages, session_id, limit)
+        self._cache_recent_messages(session_id, limit, messages, generation)
+        return messages
+    
+    def _get_recent_messages(self, session: Session, session_id: str, limit: int = 10) -> List[ChatMessage]:
+        messages = (session.query(ChatMessage)
+                   .filter(ChatMessage.session_id == session_id)
+                   .order_by(desc(ChatMessage.timestamp), desc(ChatMessage.id))
+                   .limit(limit)
+                   .all())
+        
+        # Expunge messages to make them detached from session
+        for message in messages:
+            session.expunge(message)
+        
+        return messages
+    
+    def get_messages_since(self, session_id: str, cursor: str = None,
+                           limit: int = 20) -> Tuple[List[ChatMessage], Optional[str]]:
+        """Get the messages added to a session after cursor (the last limit without one)
+        
+        Returns the messages in chronological order and the cursor to pass
+        next time; the newest limit are returned if more were added.
+        """
+        self._read_your_writes(session_id)
+        with self.db.get_read_session() as session:
+            return self._get_messages_since(session, session_id, cursor, limit)
+    
+    async def get_messages_since_async(self, session_id: str, cursor: str = None,
+                                       limit: int = 20) -> Tuple[List[ChatMessage], Optional[str]]:
+        """Get the messages added to a session after cursor (async)"""
+        await self._read_your_writes_async(session_id)
+        async with self.db.get_async_read_session() as session:
+            return await session.run_sync(self._get_messages_since, session_id, cursor, limit)
+    
+    def _get_messages_since(self, session: Session, session_id: str, cursor: str = None,
+                            limit: int = 20) -> Tuple[List[ChatMessage], Optional[str]]:
+        query = session.query(ChatMessage).filter(ChatMessage.session_id == session_id)
+        messages, cursor = keyset_tail(query, (ChatMessage.timestamp, ChatMessage.id), limit, cursor)
+        
+        # Expunge messages to make them detached from session
+        for message in messages:
+            session.expunge(message)
+        
+        return messages, cursor
     
     def delete_message(self, message_id: str) -> bool:
         """Delete a specific message"""
+        self._read_your_writes()
         with self.db.get_session() as session:
-            message = session.query(ChatMessage).filter(ChatMessage.id == message_id).first()
-            
-            if not message:
-                return False
-            
-            session.delete(message)
-            return True
+            session_id = self._delete_message(session, message_id)
+        if session_id is None:
+            return False
+        self._invalidate_session(session_id)
+        return True
+    
+    async def delete_message_async(self, message_id: str) -> bool:
+        """Delete a specific message (async)"""
+        await self._read_your_writes_async()
+        async with self.db.get_async_session() as session:
+            session_id = await session.run_sync(self._delete_message, message_id)
+        if session_id is None:
+            return False
+        self._invalidate_session(session_id)
+        return True
+    
+    def _delete_message(self, session: Session, message_id: str) -> Optional[str]:
+        # Returns the session id of the deleted message, for cache invalidation
+        message = session.query(ChatMessage).filter(ChatMessage.id == message_id).first()
+        
+        if not message:
+            return None
+        
+        session.delete(message)
+        return message.session_id
     
     def get_session_stats(self, session_id: str) -> Dict[str, Any]:
         """Get statistics for a chat session"""
-        with self.db.get_session() as session:
-            chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
-            
-            if not chat_session:
-                return {}
-            
-            message_count = session.query(ChatMessage).filter(ChatMessage.session_id == session_id).count()
-            
-            user_messages = (session.query(ChatMessage)
-                           .filter(ChatMessage.session_id == session_id,
-                                  ChatMessage.message_type == 'user')
-                           .count())
-            
-            assistant_messages = (session.query(ChatMessage)
-                                .filter(ChatMessage.session_id == session_id,
-                                       ChatMessage.message_type == 'assistant')
-                                .count())
-            
-            return {
-                "session_id": session_id,
-                "title": chat_session.title,
-                "total_messages": message_count,
-                "user_messages": user_messages,
-                "assistant_messages": assistant_messages,
-                "created_at": chat_session.created_at.isoformat() if chat_session.created_at else None,
-                "updated_at": chat_session.updated_at.isoformat() if chat_session.updated_at else None
-            }
+        self._read_your_writes(session_id)
+        with self.db.get_read_session() as session:
+            return self._get_session_stats(session, session_id)
+    
+    async def get_session_stats_async(self, session_id: str) -> Dict[str, Any]:
+        """Get statistics for a chat session (async)"""
+        await self._read_your_writes_async(session_id)
+        async with self.db.get_async_read_session() as session:
+            return await session.run_sync(self._get_session_stats, session_id)
+    
+    def _get_session_stats(self, session: Session, session_id: str) -> Dict[str, Any]:
+        chat_session = session.query(ChatSession).filter(ChatSession.id == session_id).first()
+        
+        if not chat_session:
+            return {}
+        
+        # One pass over the session's index range instead of a COUNT per type
+        by_type = dict(session.query(ChatMessage.message_type, func.count(ChatMessage.id))
+                       .filter(ChatMessage.session_id == session_id)
+                       .group_by(ChatMessage.message_type)
+                       .all())
+        
+        return {
+            "session_id": session_id,
+            "title": chat_session.title,
+            "total_messages": sum(by_type.values()),
+            "user_messages": by_type.get('user', 0),
+            "assistant_messages": by_type.get('assistant', 0),
+            "messages_by_type": by_type,
+            "created_at": chat_session.created_at.isoformat() if chat_session.created_at else None,
+            "updated_at": chat_session.updated_at.isoformat() if chat_session.updated_at else None
+        }
+    
+    def get_global_stats(self, days: int = 30, top_sessions: int = 10) -> Dict[str, Any]:
+        """Get message and token statistics across all sessions"""
+        self._read_your_writes()
+        with self.db.get_read_session() as session:
+            return self._get_global_stats(session, days, top_sessions)
+    
+    async def get_global_stats_async(self, days: int = 30, top_sessions: int = 10) -> Dict[str, Any]:
+        """Get message and token statistics across all sessions (async)"""
+        await self._read_your_writes_async()
+        async with self.db.get_async_read_session() as session:
+            return await session.run_sync(self._get_global_stats, days, top_sessions)
+    
+    def _get_global_stats(self, session: Session, days: int = 30, top_sessions: int = 10) -> Dict[str, Any]:
+        # Reads the trigger-maintained rollup only; its size follows the
+        # number of active session-days, not the number of messages
+        totals = (func.sum(ChatMessageStat.message_count),
+                  func.sum(ChatMessageStat.prompt_tokens),
+                  func.sum(ChatMessageStat.completion_tokens),
+                  func.sum(ChatMessageStat.total_tokens))
+        
+        def usage(row) -> Dict[str, int]:
+            messages, prompt, completion, total = (value or 0 for value in row)
+            return {"messages": messages, "prompt_tokens": prompt,
+                    "completion_tokens": completion, "total_tokens": total}
+        
+        by_type = {row[0]: usage(row[1:]) for row in
+                   session.query(ChatMessageStat.message_type, *totals)
+                   .group_by(ChatMessageStat.message_type)
+                   .all()}
+        
+        since = (datetime.utcnow().date() - timedelta(days=max(days - 1, 0))).isoformat()
+        by_day = [{"day": row[0], **usage(row[1:])} for row in
+                  session.query(ChatMessageStat.day, *totals)
+                  .filter(ChatMessageStat.day >= since)
+                  .group_by(ChatMessageStat.day)
+                  .order_by(ChatMessageStat.day)
+                  .all()]
+        
+        session_totals = (session.query(ChatMessageStat.session_id, *totals)
+                          .group_by(ChatMessageStat.session_id)
+                          .order_by(desc(totals[3]), desc(totals[0]))
+                          .limit(top_sessions)
+                          .all())
+        top = [{"session_id": row[0], **usage(row[1:])} for row in session_totals]
+        
+        overall = usage([sum(t[key] for t in by_type.values())
+                         for key in ("messages", "prompt_tokens", "completion_tokens", "total_tokens")])
+        
+        return {
+            **overall,
+            "by_type": by_type,
+            "by_day": by_day,
+            "top_sessions": top
+        }
     
     def search_messages(self, query: str, session_id: str = None, limit: int = 50) -> List[ChatMessage]:
-        """Search messages by content"""
-        with self.db.get_session() as session:
-            query_obj = session.query(ChatMessage).filter(ChatMessage.content.contains(query))
-            
-            if session_id:
-                query_obj = query_obj.filter(ChatMessage.session_id == session_id)
-            
-            messages = query_obj.order_by(desc(ChatMessage.timestamp)).limit(limit).all()
-            
-            # Expunge messages to make them detached from session
-            for message in messages:
-                session.expunge(message)
-            
-            return messages
+        """Search messages by content, best matches first"""
+        self._read_your_writes(session_id)
+        with self.db.get_read_session() as session:
+            return self._search_messages(session, query, session_id, limit)
+    
+    async def search_messages_async(self, query: str, session_id: str = None, limit: int = 50) -> List[ChatMessage]:
+        """Search messages by content, best matches first (async)"""
+        await self._read_your_writes_async(session_id)
+        async with self.db.get_async_read_session() as session:
+            return await session.run_sync(self._search_messages, query, session_id, limit)
+    
+    def _search_messages(self, session: Session, query: str, session_id: str = None, limit: int = 50) -> List[ChatMessage]:
+        match = self._build_match_expression(query)
+        if not self.db.has_message_search or not match:
+            return self._search_messages_like(session, query, session_id, limit)
+        
+        sql = ("SELECT chat_messages.*, "
+               "bm25(chat_messages_fts) AS rank, "
+               "snippet(chat_messages_fts, 0, '<mark>', '</mark>', '…', 16) AS snippet "
+               "FROM chat_messages_fts "
+               "JOIN chat_messages ON chat_messages.rowid = chat_messages_fts.rowid "
+               "WHERE chat_messages_fts MATCH :match")
+        params = {"match": match, "limit": limit}
+        if session_id:
+            sql += " AND chat_messages.session_id = :session_id"
+            params["session_id"] = session_id
+        sql += " ORDER BY rank LIMIT :limit"
+        
+        statement = (select(ChatMessage, literal_column("rank"), literal_column("snippet"))
+                     .from_statement(text(sql)))
+        rows = session.execute(statement, params).all()
+        
+        messages = []
+        for message, rank, snippet in rows:
+            # Attach ranking info like _message_count on sessions
+            message._search_rank = rank
+            message._search_snippet = snippet
+            session.expunge(message)
+            messages.append(message)
+        return messages
+    
+    def _search_messages_like(self, session: Session, query: str, session_id: str = None,
+                              limit: int = 50) -> List[ChatMessage]:
+        query_obj = session.query(ChatMessage).filter(ChatMessage.content.contains(query))
+        
+        if session_id:
+            query_obj = query_obj.filter(ChatMessage.session_id == session_id)
+        
+        messages = query_obj.order_by(desc(ChatMessage.timestamp)).limit(limit).all()
+        
+        # Expunge messages to make them detached from session
+        for message in messages:
+            session.expunge(message)
+        
+        return messages
+    
+    @staticmethod
+    def _build_match_expression(query: str) -> str:
+        """Turn free text into an FTS5 query matching all terms
+        
+        Every term is quoted so user input can never be parsed as FTS5
+        syntax; the last term is a prefix match for search-as-you-type.
+        """
+        terms = [term.replace('"', '""') for term in query.split()]
+        if not terms:
+            return ""
+        quoted = [f'"{term}"' for term in terms]
+        quoted[-1] += "*"
+        return " ".join(quoted)
 
 # Global service instance
 chat_db_service = ChatDatabaseService() 
\ No newline at end of file
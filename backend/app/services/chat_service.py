@@ -2,19 +2,32 @@
 Chat service for handling conversation logic
 """
 import logging
-from typing import Dict, Any, List
+from typing import Dict, Any, List, AsyncIterator, Optional
 from datetime import datetime
 
+from ..core.config import settings
 from .openai_service import openai_service
+from .summarizer import conversation_summarizer
+from .chat_database_service import chat_db_service
+from .history_store import HistoryStore, history_store
+from .turns import ASSISTANT, USER, Turn
 
 logger = logging.getLogger(__name__)
 
+# History key of chats with neither a session nor a connection
+DEFAULT_HISTORY = "default"
+
 class ChatService:
-    def __init__(self):
-        self.conversation_history = []
-        self.session_histories = {}  # Store conversation history per session
+    def __init__(self, history: HistoryStore = history_store, persist_turns: bool = False):
+        # Conversation history per session, or per connection for chats without one;
+        # session histories are loaded from the database, so no turn depends on the
+        # worker that served the previous one
+        self.history = history
+        # Store session turns here instead of relying on the client to
+        self.persist_turns = persist_turns
     
-    async def process_message(self, message: str, functions: List[str] = None, session_id: str = None) -> Dict[str, Any]:
+    async def process_message(self, message: str, functions: List[str] = None, session_id: str = None,
+                              connection_id: str = None) -> Dict[str, Any]:
         """
         Process user message and generate response
         
@@ -22,48 +35,40 @@ class ChatService:
             message: User message content
             functions: List of active function names
             session_id: Optional session ID for conversation context
+            connection_id: Connection the message came in on; keeps the
+                context of chats without a session apart
             
         Returns:
             Dict containing response message
         """
+        key = self._history_key(session_id, connection_id)
+        conversation_history = []
         try:
-            # Get or create session history
-            if session_id:
-                if session_id not in self.session_histories:
-                    self.session_histories[session_id] = []
-                conversation_history = self.session_histories[session_id]
-            else:
-                conversation_history = self.conversation_history
+            conversation_history = await self._load_history(key, session_id)
             
             # Store user message in history
-            user_msg = {
-                "role": "user",
-                "content": message,
-                "timestamp": datetime.now().isoformat(),
-                "functions": functions or []
-            }
-            conversation_history.append(user_msg)
+            user_msg = self._add_user_message(key, conversation_history, Turn(USER, message, functions=functions))
             
             # Generate AI response
             if openai_service.is_configured():
+                summary, recent_history = await conversation_summarizer.get_context(session_id, conversation_history)
                 ai_response = await openai_service.generate_response(
                     message=message,
-                    conversation_history=conversation_history,
-                    functions=functions
+                    conversation_history=recent_history,
+                    functions=functions,
+                    summary=summary,
+                    session_id=session_id
                 )
                 
                 if ai_response["success"]:
                     response_content = ai_response["content"]
                     
                     # Store AI response in history
-                    ai_msg = {
-                        "role": "assistant",
-                        "content": response_content,
-                        "timestamp": datetime.now().isoformat(),
-                        "model": ai_response.get("model"),
-                        "usage": ai_response.get("usage")
-                    }
-                    conversation_history.append(ai_msg)
+                    ai_msg = Turn(ASSISTANT, response_content, model=ai_response.get("model"),
+                                  usage=ai_response.get("usage"))
+                    self.history.append(key, ai_msg)
+                    await self._persist_turn(session_id, user_msg, ai_msg)
+                    conversation_summarizer.schedule(session_id, conversation_history)
                     
                     return {
                         "id": str(len(conversation_history)),
@@ -99,8 +104,6 @@ class ChatService:
                 
         except Exception as e:
             logger.error(f"Error processing message: {e}")
-            # Use appropriate conversation history for error response
-            conversation_history = self.session_histories.get(session_id, self.conversation_history) if session_id else self.conversation_history
             return {
                 "id": str(len(conversation_history)),
                 "type": "ai",
@@ -110,6 +113,144 @@ class ChatService:
                 "session_id": session_id
             }
     
+    async def process_message_stream(self, message: str, functions: List[str] = None, session_id: str = None,
+                                     connection_id: str = None) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Process user message and stream the response as it is generated
+        
+        Args:
+            message: User message content
+            functions: List of active function names
+            session_id: Optional session ID for conversation context
+            connection_id: Connection the message came in on
+            
+        Yields:
+            A "start" frame, a "delta" frame per text fragment and a final
+            "end" frame carrying the full content, model and usage
+        """
+        key = self._history_key(session_id, connection_id)
+        conversation_history = await self._load_history(key, session_id)
+        response_id = str(len(conversation_history) + 1)
+        
+        yield {
+            "type": "start",
+            "id": response_id,
+            "timestamp": datetime.now().isoformat(),
+            "session_id": session_id
+        }
+        
+        try:
+            user_msg = self._add_user_message(key, conversation_history, Turn(USER, message, functions=functions))
+            
+            if not openai_service.is_configured():
+                yield {
+                    "type": "end",
+                    "id": response_id,
+                    "content": self._generate_fallback_response(message, functions),
+                    "timestamp": datetime.now().isoformat(),
+                    "fallback": True,
+                    "session_id": session_id
+                }
+                return
+            
+            summary, recent_history = await conversation_summarizer.get_context(session_id, conversation_history)
+            result = None
+            async for event in openai_service.generate_response_stream(
+                message=message,
+                conversation_history=recent_history,
+                functions=functions,
+                summary=summary,
+                session_id=session_id
+            ):
+                if event["type"] == "delta":
+                    yield {"type": "delta", "id": response_id, "content": event["content"]}
+                else:
+                    result = event
+            
+            if result and result["success"]:
+                # Assembled once from the deltas by the OpenAI service
+                ai_msg = Turn(ASSISTANT, result["content"], model=result.get("model"), usage=result.get("usage"))
+                self.history.append(key, ai_msg)
+                await self._persist_turn(session_id, user_msg, ai_msg)
+                conversation_summarizer.schedule(session_id, conversation_history)
+                yield {
+                    "type": "end",
+                    "id": response_id,
+                    "content": result["content"],
+                    "timestamp": datetime.now().isoformat(),
+                    "model": result.get("model"),
+                    "usage": result.get("usage"),
+                    "finish_reason": result.get("finish_reason"),
+                    "session_id": session_id
+                }
+            else:
+                error = result.get("error", "Unknown error") if result else "Unknown error"
+                yield {
+                    "type": "end",
+                    "id": response_id,
+                    "content": f"❌ AI Error: {error}",
+                    "timestamp": datetime.now().isoformat(),
+                    "error": True,
+                    "session_id": session_id
+                }
+        
+        except Exception as e:
+            logger.error(f"Error streaming message: {e}")
+            yield {
+                "type": "end",
+                "id": response_id,
+                "content": f"❌ System Error: {str(e)}",
+                "timestamp": datetime.now().isoformat(),
+                "error": True,
+                "session_id": session_id
+            }
+    
+    def _history_key(self, session_id: str = None, connection_id: str = None) -> str:
+        if session_id:
+            return session_id
+        if connection_id:
+            return f"connection:{connection_id}"
+        return DEFAULT_HISTORY
+    
+    async def _load_history(self, key: str, session_id: str = None) -> List[Turn]:
+        """Get the conversation history of a key; sessions are loaded from the database"""
+        if session_id:
+            return await self.history.load(session_id)
+        return self.history.get(key)
+    
+    def _add_user_message(self, key: str, history: List[Turn], user_msg: Turn) -> Optional[Turn]:
+        """Append the user message unless the client already stored it; returns the turn if appended"""
+        last = history[-1] if history else None
+        if last and last.id is not None and last.role == USER and last.content == user_msg.content:
+            return None
+        self.history.append(key, user_msg)
+        return user_msg
+    
+    async def _persist_turn(self, session_id: str, user_msg: Optional[Turn], ai_msg: Turn):
+        """Store a session's user message and reply, if the server stores turns"""
+        if not self.persist_turns or not session_id:
+            return
+        entries = [(entry, message_type) for entry, message_type in ((user_msg, "user"), (ai_msg, "assistant"))
+                   if entry is not None]
+        try:
+            stored = await chat_db_service.add_messages_async(session_id, [
+                {
+                    "content": entry.content,
+                    "message_type": message_type,
+                    "metadata": entry.metadata()
+                }
+                for entry, message_type in entries
+            ])
+            # Marks the turns as stored, so the next load does not add them twice
+            for (entry, _), message in zip(entries, stored or []):
+                entry.id = message.id
+        except Exception as e:
+            logger.error(f"Failed to store turn of session {session_id}: {e}")
+    
+    def end_connection(self, connection_id: str):
+        """Forget the history of a closed connection's session-less chat"""
+        self.history.drop(self._history_key(connection_id=connection_id))
+    
     def _generate_fallback_response(self, message: str, functions: List[str] = None) -> str:
         """Generate a helpful fallback response when OpenAI is not configured"""
         
@@ -135,12 +276,12 @@ class ChatService:
     
     def get_conversation_history(self) -> List[Dict[str, Any]]:
         """Get the current conversation history"""
-        return self.conversation_history
+        return [turn.to_dict() for turn in self.history.get(DEFAULT_HISTORY)]
     
     def clear_history(self):
         """Clear conversation history"""
-        self.conversation_history = []
+        self.history.drop(DEFAULT_HISTORY)
         logger.info("Conversation history cleared")
 
 # Global service instance
-chat_service = ChatService() 
\ No newline at end of file
+chat_service = ChatService(persist_turns=settings.chat_persist_turns) 
\ No newline at end of file
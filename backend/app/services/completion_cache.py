@@ -0,0 +1,160 @@
+"""
+Cache for deterministic LLM completions
+"""
+from datetime import datetime, timedelta
+from hashlib import sha256
+from typing import Any, Dict, List, Optional
+import copy
+import json
+import logging
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models.llm import CompletionCacheEntry
+from .cache import TTLCache
+from .database import DatabaseService, db_service
+
+logger = logging.getLogger(__name__)
+
+class CompletionCache:
+    """
+    Completion cache keyed on a canonical hash of the request
+    
+    Only calls at or below max_temperature are cached; sampling at higher
+    temperatures is meant to vary, so those calls bypass the cache. Entries
+    live in an in-memory LRU/TTL cache and, with persist enabled, also in
+    the llm_completion_cache table so they survive restarts and are shared
+    between workers.
+    """
+    
+    # Expired rows are pruned every this many writes
+    PRUNE_EVERY = 100
+    
+    def __init__(self, maxsize: int = 1024, ttl: float = 3600, max_temperature: float = 0.3,
+                 persist: bool = False, enabled: bool = True, db: DatabaseService = None):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.max_temperature = max_temperature
+        self.persist = persist
+        self.db = db or db_service
+        self.memory = TTLCache(maxsize, ttl, "completions")
+        
+        self.hits = 0
+        self.persisted_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.saved_tokens = 0
+        self._writes = 0
+    
+    @staticmethod
+    def make_key(model: str, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                 scope: Optional[str] = None) -> str:
+        """
+        Canonical sha256 key of a completion request
+        
+        Args:
+            model: Model name
+            messages: Chat messages; only role and content take part
+            temperature: Sampling temperature
+            max_tokens: Completion token limit
+            scope: Extra discriminator, e.g. a fingerprint of the API key
+        """
+        payload = {
+            "model": model,
+            "messages": [{"role": msg.get("role"), "content": msg.get("content")} for msg in messages],
+            "temperature": round(float(temperature), 4),
+            "max_tokens": int(max_tokens),
+            "scope": scope
+        }
+        canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return sha256(canonical.encode("utf-8")).hexdigest()
+    
+    def is_cacheable(self, temperature: float) -> bool:
+        """Whether calls at this temperature are deterministic enough to cache"""
+        return self.enabled and temperature <= self.max_temperature
+    
+    def record_bypass(self):
+        self.bypassed += 1
+    
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a cached completion (marked "cached") or None"""
+        value = self.memory.get(key)
+        if value is None and self.persist:
+            try:
+                async with self.db.get_async_read_session() as session:
+                    value = await session.run_sync(self._load, key)
+            except Exception as e:
+                logger.warning(f"Completion cache lookup failed: {e}")
+                value = None
+            if value is not None:
+                self.persisted_hits += 1
+                self.memory.set(key, value)
+        
+        if value is None:
+            self.misses += 1
+            return None
+        
+        self.hits += 1
+        self.saved_tokens += (value.get("usage") or {}).get("total_tokens", 0)
+        return dict(copy.deepcopy(value), cached=True)
+    
+    async def set(self, key: str, value: Dict[str, Any]):
+        """Store a completion result"""
+        self.memory.set(key, value)
+        if not self.persist:
+            return
+        try:
+            async with self.db.get_async_session() as session:
+                await session.run_sync(self._store, key, value)
+        except Exception as e:
+            logger.warning(f"Failed to persist completion cache entry: {e}")
+    
+    def _load(self, session: Session, key: str) -> Optional[Dict[str, Any]]:
+        entry = session.get(CompletionCacheEntry, key)
+        if entry is None or entry.expires_at <= datetime.utcnow():
+            return None
+        return entry.response
+    
+    def _store(self, session: Session, key: str, value: Dict[str, Any]):
+        now = datetime.utcnow()
+        session.merge(CompletionCacheEntry(
+            key=key,
+            model=value.get("model"),
+            response=value,
+            created_at=now,
+            expires_at=now + timedelta(seconds=self.ttl)
+        ))
+        self._writes += 1
+        if self._writes % self.PRUNE_EVERY == 0:
+            session.execute(delete(CompletionCacheEntry).where(CompletionCacheEntry.expires_at <= now))
+    
+    def clear(self):
+        """Drop the in-memory entries"""
+        self.memory.clear()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hit ratio and tokens saved by the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "persist": self.persist,
+            "max_temperature": self.max_temperature,
+            "hits": self.hits,
+            "persisted_hits": self.persisted_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "saved_tokens": self.saved_tokens,
+            "memory": self.memory.stats()
+        }
+
+# Global completion cache instance
+completion_cache = CompletionCache(
+    maxsize=settings.completion_cache_size,
+    ttl=settings.completion_cache_ttl,
+    max_temperature=settings.completion_cache_max_temperature,
+    persist=settings.completion_cache_persist,
+    enabled=settings.completion_cache_enabled
+)
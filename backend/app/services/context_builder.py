@@ -0,0 +1,196 @@
+"""
+Token-budget-aware context window builder for chat completions
+"""
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import logging
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+from .model_catalog import get_context_window
+from .turns import USER, Turn
+
+logger = logging.getLogger(__name__)
+
+# Tokens the chat format adds around every message, and to prime the reply
+MESSAGE_OVERHEAD_TOKENS = 3
+REPLY_PRIMING_TOKENS = 3
+# Headroom for counting differences between the estimate and the server
+SAFETY_MARGIN_TOKENS = 64
+
+# Fallback estimate when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+TRUNCATION_MARKER = "\n\n[... truncated ...]\n\n"
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# Tokenizers loaded by load_tokenizers(), by encoding name. Counting never
+# loads one itself: that may download the BPE file, which would block the
+# event loop on the first turn.
+_encodings: Dict[str, Any] = {}
+
+@lru_cache(maxsize=None)
+def _encoding_name(model: str) -> str:
+    try:
+        return tiktoken.model.encoding_name_for_model(model)
+    except KeyError:
+        return DEFAULT_ENCODING
+
+def load_tokenizers(models: Iterable[str]) -> List[str]:
+    """
+    Load the tokenizers of models; blocking, so run it off the event loop
+    
+    tiktoken downloads the encoding files unless TIKTOKEN_CACHE_DIR points
+    at a directory that already holds them. Until a model's tokenizer is
+    loaded, its token counts are estimated from the text length.
+    
+    Returns:
+        Names of the encodings loaded so far
+    """
+    if tiktoken is None:
+        logger.warning("tiktoken is not installed, estimating token counts")
+        return []
+    for name in sorted({_encoding_name(model) for model in models} - set(_encodings)):
+        try:
+            _encodings[name] = tiktoken.get_encoding(name)
+        except Exception as e:
+            # e.g. the encoding file cannot be downloaded
+            logger.warning(f"Tokenizer {name} unavailable, estimating its token counts: {e}")
+    return sorted(_encodings)
+
+def _get_encoding(model: str):
+    """Loaded tokenizer for a model, or None to fall back to the character estimate"""
+    if tiktoken is None:
+        return None
+    return _encodings.get(_encoding_name(model))
+
+def tokenizer_name(model: str) -> str:
+    """Name of the tokenizer used for a model; counts are only comparable within one"""
+    encoding = _get_encoding(model)
+    return encoding.name if encoding is not None else "estimate"
+
+def count_tokens(text: str, model: str) -> int:
+    """Number of tokens in a piece of text"""
+    if not text:
+        return 0
+    encoding = _get_encoding(model)
+    if encoding is None:
+        return len(text) // CHARS_PER_TOKEN + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def message_tokens(turn: Turn, model: str) -> int:
+    """
+    Tokens a history turn costs in the prompt
+    
+    The count is cached on the turn itself (token_count/token_encoding),
+    so each message is only tokenized once per tokenizer.
+    """
+    encoding = tokenizer_name(model)
+    if turn.token_encoding != encoding or turn.token_count is None:
+        turn.token_count = count_tokens(turn.content, model)
+        turn.token_encoding = encoding
+    return turn.token_count + MESSAGE_OVERHEAD_TOKENS
+
+def truncate_to_tokens(text: str, max_tokens: int, model: str) -> str:
+    """Shorten text to about max_tokens, keeping its beginning and end"""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    budget = max(max_tokens - count_tokens(TRUNCATION_MARKER, model), 0)
+    encoding = _get_encoding(model)
+    if encoding is None:
+        head = budget * CHARS_PER_TOKEN // 2
+        tail = budget * CHARS_PER_TOKEN - head
+        return text[:head] + TRUNCATION_MARKER + (text[-tail:] if tail else "")
+    tokens = encoding.encode(text, disallowed_special=())
+    head = budget // 2
+    tail = budget - head
+    return (encoding.decode(tokens[:head]) + TRUNCATION_MARKER
+            + (encoding.decode(tokens[-tail:]) if tail else ""))
+
+def prompt_budget(model: str, max_tokens: int) -> int:
+    """Tokens available for the prompt once the completion is reserved"""
+    return max(get_context_window(model) - max_tokens - SAFETY_MARGIN_TOKENS, 0)
+
+def build_context(
+    system_prompt: str,
+    message: str,
+    conversation_history: Optional[List[Turn]] = None,
+    functions: Optional[List[str]] = None,
+    model: str = "gpt-3.5-turbo",
+    max_tokens: int = 2000,
+    summary: Optional[str] = None,
+    history_tokens: int = 0
+) -> Tuple[List[Dict[str, str]], int]:
+    """
+    Pack the system prompt, the newest history and the user message into
+    the model's context window
+    
+    The system prompt, the conversation summary and the current message are
+    always sent; the summary is capped at a quarter of the budget and the
+    current message is truncated in the middle if it alone exceeds the rest.
+    History is added newest first until the next message no longer fits
+    the budget, or history_tokens of history, so older turns are dropped
+    as a whole rather than cut.
+    
+    Args:
+        system_prompt: System prompt sent first
+        message: Current user message
+        conversation_history: Previous turns; a trailing user turn holding
+            the current message is skipped
+        functions: Names of active functions, appended to the user message
+        model: Model the prompt is built for
+        max_tokens: Completion tokens to reserve
+        summary: Running summary of the turns no longer in the history
+        history_tokens: Most tokens of history to send, 0 for no limit
+    
+    Returns:
+        Tuple of (messages for the completion API, prompt token count)
+    """
+    budget = prompt_budget(model, max_tokens)
+    
+    user_content = message
+    if functions:
+        user_content += f"\n\nActive functions: {', '.join(functions)}"
+    
+    system_tokens = count_tokens(system_prompt, model) + MESSAGE_OVERHEAD_TOKENS
+    summary_message = None
+    if summary:
+        summary_content = truncate_to_tokens(f"{SUMMARY_PREFIX}{summary}", budget // 4, model)
+        summary_message = {"role": "system", "content": summary_content}
+        system_tokens += count_tokens(summary_content, model) + MESSAGE_OVERHEAD_TOKENS
+    available = budget - system_tokens - REPLY_PRIMING_TOKENS - MESSAGE_OVERHEAD_TOKENS
+    user_tokens = count_tokens(user_content, model)
+    if user_tokens > available:
+        user_content = truncate_to_tokens(user_content, max(available, 0), model)
+        user_tokens = count_tokens(user_content, model)
+    used = system_tokens + REPLY_PRIMING_TOKENS + user_tokens + MESSAGE_OVERHEAD_TOKENS
+    
+    history = list(conversation_history or [])
+    if history and history[-1].role == USER and history[-1].content == message:
+        history.pop()
+    
+    # A long conversation would otherwise fill the whole context window
+    # every turn; older turns are covered by the summary
+    history_budget = budget - used
+    if history_tokens:
+        history_budget = min(history_budget, history_tokens)
+    packed: List[Dict[str, str]] = []
+    for entry in reversed(history):
+        cost = message_tokens(entry, model)
+        if cost > history_budget:
+            break
+        packed.append(entry.to_message())
+        history_budget -= cost
+        used += cost
+    packed.reverse()
+    
+    messages = [{"role": "system", "content": system_prompt}]
+    if summary_message:
+        messages.append(summary_message)
+    messages += [*packed, {"role": "user", "content": user_content}]
+    return messages, used
@@ -1,67 +1,222 @@
 """
 Database service for SQLite connection and session management
+
+Connections of the async engines each run in a worker thread that keeps the
+interpreter alive until the connection is closed, and atexit handlers only run
+after those threads have ended. The app disposes the engines on shutdown;
+scripts using the async sessions must await db_service.dispose() before they
+return, or the process never exits.
 """
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.orm import sessionmaker, Session
-from contextlib import contextmanager
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from contextlib import contextmanager, asynccontextmanager
+from functools import partial
+from typing import AsyncIterator, Optional
+import asyncio
 import os
+import threading
 from pathlib import Path
 import logging
 
+from ..core.config import settings
 from ..models import *
+from .migrations import run_migrations, has_message_search_index
 
 logger = logging.getLogger(__name__)
 
+def _apply_sqlite_pragmas(dbapi_connection, connection_record, readonly: bool = False):
+    """Configure a new SQLite connection according to the storage profile"""
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA busy_timeout = {int(settings.sqlite_busy_timeout)}")
+        if not readonly:
+            # journal_mode is persistent in the database file; set it from the writer
+            cursor.execute(f"PRAGMA journal_mode = {settings.sqlite_journal_mode}")
+        cursor.execute(f"PRAGMA synchronous = {settings.sqlite_synchronous}")
+        cursor.execute(f"PRAGMA cache_size = {int(settings.sqlite_cache_size)}")
+        cursor.execute(f"PRAGMA mmap_size = {int(settings.sqlite_mmap_size)}")
+        cursor.execute("PRAGMA temp_store = MEMORY")
+        if readonly:
+            cursor.execute("PRAGMA query_only = ON")
+    finally:
+        cursor.close()
+
 class DatabaseService:
-    def __init__(self):
-        # Create database directory
-        db_dir = Path(__file__).parent.parent.parent / "data"
-        db_dir.mkdir(exist_ok=True)
+    def __init__(self, db_path: Path = None):
+        if db_path is None:
+            # Create database directory
+            db_dir = Path(__file__).parent.parent.parent / "data"
+            db_dir.mkdir(exist_ok=True)
+            
+            # SQLite database path
+            db_path = db_dir / "attila.db"
+        self.db_path = Path(db_path)
         
-        # SQLite database path
-        db_path = db_dir / "attila.db"
+        # SQLite allows a single writer at a time. The sync and the async engine
+        # each have one writer connection, and a process-wide writer lock lets
+        # only one of them hold a write session at a time, so writes of this
+        # process queue on the lock instead of contending for the database
+        # lock. Other processes (more workers) still contend, which
+        # busy_timeout absorbs. With WAL enabled, readers use their own pools
+        # and keep running while a write transaction is open.
+        self._writer_lock = threading.Lock()
+        # Async writers wait their turn here, so at most one of them ties up
+        # a thread waiting for the writer lock
+        self._async_writer: Optional[asyncio.Lock] = None
+        self._async_writer_loop: Optional[asyncio.AbstractEventLoop] = None
+        writer_pool = {"pool_size": 1, "max_overflow": 0}
+        reader_pool = {"pool_size": settings.sqlite_read_pool_size, "max_overflow": 0}
         
-        # Create engine
+        # Create engines
         self.engine = create_engine(
-            f"sqlite:///{db_path}",
+            f"sqlite:///{self.db_path}",
             echo=False,  # Set to True for SQL query logging
-            connect_args={"check_same_thread": False}
+            connect_args={"check_same_thread": False},
+            **writer_pool
+        )
+        self.read_engine = create_engine(
+            f"sqlite:///{self.db_path}",
+            echo=False,
+            connect_args={"check_same_thread": False},
+            **reader_pool
+        )
+        
+        # Async engines on the same database file; aiosqlite runs each connection
+        # in its own thread so queries never block the event loop. Pool the
+        # connections instead of the dialect's NullPool default so every request
+        # does not pay for a new connection and worker thread.
+        self.async_engine = create_async_engine(
+            f"sqlite+aiosqlite:///{self.db_path}",
+            echo=False,
+            poolclass=AsyncAdaptedQueuePool,
+            **writer_pool
+        )
+        self.async_read_engine = create_async_engine(
+            f"sqlite+aiosqlite:///{self.db_path}",
+            echo=False,
+            poolclass=AsyncAdaptedQueuePool,
+            **reader_pool
         )
         
-        # Create session factory
+        # Apply the storage profile to every new connection
+        for sync_engine, readonly in ((self.engine, False), (self.read_engine, True),
+                                      (self.async_engine.sync_engine, False),
+                                      (self.async_read_engine.sync_engine, True)):
+            event.listen(sync_engine, "connect", partial(_apply_sqlite_pragmas, readonly=readonly))
+        
+        # Create session factories
         self.SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.engine)
+        self.ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=self.read_engine)
+        self.AsyncSessionLocal = async_sessionmaker(
+            bind=self.async_engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False
+        )
+        self.AsyncReadSessionLocal = async_sessionmaker(
+            bind=self.async_read_engine,
+            class_=AsyncSession,
+            autoflush=False,
+            expire_on_commit=False
+        )
         
         # Create tables
         self.create_tables()
         
-        logger.info(f"Database initialized at {db_path}")
+        logger.info(f"Database initialized at {self.db_path}")
     
     def create_tables(self):
-        """Create all database tables"""
+        """Create all database tables and upgrade existing ones"""
         try:
             Base.metadata.create_all(bind=self.engine)
             logger.info("Database tables created successfully")
+            self.schema_version = run_migrations(self.engine)
+            with self.engine.connect() as conn:
+                self.has_message_search = has_message_search_index(conn)
         except Exception as e:
             logger.error(f"Failed to create database tables: {e}")
             raise
     
     @contextmanager
     def get_session(self) -> Session:
-        """Get database session with context manager"""
-        session = self.SessionLocal()
+        """Get database session with context manager; holds the writer lock until closed"""
+        with self._writer_lock:
+            session = self.SessionLocal()
+            try:
+                yield session
+                session.commit()
+            except Exception as e:
+                session.rollback()
+                logger.error(f"Database session error: {e}")
+                raise
+            finally:
+                session.close()
+    
+    @contextmanager
+    def get_read_session(self) -> Session:
+        """Get read-only database session from the reader pool"""
+        session = self.ReadSessionLocal()
         try:
             yield session
-            session.commit()
-        except Exception as e:
-            session.rollback()
-            logger.error(f"Database session error: {e}")
-            raise
         finally:
             session.close()
     
     def get_session_sync(self) -> Session:
-        """Get database session (non-context manager)"""
+        """Get database session (non-context manager); bypasses the writer lock"""
         return self.SessionLocal()
+    
+    @asynccontextmanager
+    async def get_async_session(self) -> AsyncIterator[AsyncSession]:
+        """Get async database session with context manager; holds the writer lock until closed"""
+        loop = asyncio.get_running_loop()
+        if self._async_writer_loop is not loop:
+            self._async_writer = asyncio.Lock()
+            self._async_writer_loop = loop
+        async with self._async_writer:
+            await self._acquire_writer_lock()
+            try:
+                session = self.AsyncSessionLocal()
+                try:
+                    yield session
+                    await session.commit()
+                except Exception as e:
+                    await session.rollback()
+                    logger.error(f"Async database session error: {e}")
+                    raise
+                finally:
+                    await session.close()
+            finally:
+                self._writer_lock.release()
+    
+    async def _acquire_writer_lock(self):
+        """Take the writer lock without blocking the event loop"""
+        if self._writer_lock.acquire(blocking=False):
+            return
+        waiter = self._async_writer_loop.run_in_executor(None, self._writer_lock.acquire)
+        try:
+            await asyncio.shield(waiter)
+        except asyncio.CancelledError:
+            # The thread still gets the lock; hand it back once it does
+            waiter.add_done_callback(lambda _: self._writer_lock.release())
+            raise
+    
+    @asynccontextmanager
+    async def get_async_read_session(self) -> AsyncIterator[AsyncSession]:
+        """Get async read-only database session from the reader pool"""
+        session = self.AsyncReadSessionLocal()
+        try:
+            yield session
+        finally:
+            await session.close()
+    
+    async def dispose(self):
+        """Close pooled connections of all engines; required before exit once the async engines were used"""
+        await self.async_engine.dispose()
+        await self.async_read_engine.dispose()
+        self.engine.dispose()
+        self.read_engine.dispose()
 
 # Global database service instance
-db_service = DatabaseService() 
\ No newline at end of file
+db_service = DatabaseService(settings.sqlite_path) 
\ No newline at end of file
@@ -6,14 +6,14 @@ from typing import List, Optional, Dict, Any
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
 
-from .database import db_service
+from .database import DatabaseService, db_service
 from ..models.function import Function
 
 logger = logging.getLogger(__name__)
 
 class FunctionDatabaseService:
-    def __init__(self):
-        self.db = db_service
+    def __init__(self, db: DatabaseService = None):
+        self.db = db or db_service
         self._create_default_functions()
     
     def _create_default_functions(self):
@@ -75,56 +75,97 @@ class FunctionDatabaseService:
     def get_all_functions(self, include_disabled: bool = False) -> List[dict]:
         """Get all functions"""
         try:
-            with self.db.get_session() as session:
-                query = session.query(Function)
-                if not include_disabled:
-                    query = query.filter(Function.is_enabled == True)
-                functions = query.order_by(desc(Function.created_at)).all()
-                # Convert to dictionaries to avoid session detachment issues
-                return [func.to_dict() for func in functions]
+            with self.db.get_read_session() as session:
+                return self._get_all_functions(session, include_disabled)
+        except Exception as e:
+            logger.error(f"Failed to get functions: {e}")
+            return []
+    
+    async def get_all_functions_async(self, include_disabled: bool = False) -> List[dict]:
+        """Get all functions (async)"""
+        try:
+            async with self.db.get_async_read_session() as session:
+                return await session.run_sync(self._get_all_functions, include_disabled)
         except Exception as e:
             logger.error(f"Failed to get functions: {e}")
             return []
     
+    def _get_all_functions(self, session: Session, include_disabled: bool = False) -> List[dict]:
+        query = session.query(Function)
+        if not include_disabled:
+            query = query.filter(Function.is_enabled == True)
+        functions = query.order_by(desc(Function.created_at)).all()
+        # Convert to dictionaries to avoid session detachment issues
+        return [func.to_dict() for func in functions]
+    
     def get_function(self, function_id: str) -> Optional[dict]:
         """Get a specific function by ID"""
         try:
-            with self.db.get_session() as session:
-                function = session.query(Function).filter(Function.id == function_id).first()
-                return function.to_dict() if function else None
+            with self.db.get_read_session() as session:
+                return self._get_function(session, function_id)
         except Exception as e:
             logger.error(f"Failed to get function {function_id}: {e}")
             return None
     
+    async def get_function_async(self, function_id: str) -> Optional[dict]:
+        """Get a specific function by ID (async)"""
+        try:
+            async with self.db.get_async_read_session() as session:
+                return await session.run_sync(self._get_function, function_id)
+        except Exception as e:
+            logger.error(f"Failed to get function {function_id}: {e}")
+            return None
+    
+    def _get_function(self, session: Session, function_id: str) -> Optional[dict]:
+        function = session.query(Function).filter(Function.id == function_id).first()
+        return function.to_dict() if function else None
+    
     def create_function(self, name: str, description: str = None, icon: str = 'gear', 
                        category: str = 'custom', parameters: List[Dict] = None, 
                        implementation: str = None, metadata: Dict = None) -> Optional[dict]:
         """Create a new function"""
         try:
             with self.db.get_session() as session:
-                function = Function(
-                    name=name,
-                    description=description,
-                    icon=icon,
-                    category=category,
-                    parameters=parameters or [],
-                    implementation=implementation,
-                    extra_data=metadata
-                )
-                
-                session.add(function)
-                session.flush()  # To get the ID
-                
-                # Get the data before session closes
-                function_dict = function.to_dict()
-                
-                logger.info(f"Created function: {function.name} (ID: {function.id})")
-                return function_dict
-                
+                return self._create_function(session, name, description, icon, category,
+                                             parameters, implementation, metadata)
+        except Exception as e:
+            logger.error(f"Failed to create function: {e}")
+            return None
+    
+    async def create_function_async(self, name: str, description: str = None, icon: str = 'gear',
+                                    category: str = 'custom', parameters: List[Dict] = None,
+                                    implementation: str = None, metadata: Dict = None) -> Optional[dict]:
+        """Create a new function (async)"""
+        try:
+            async with self.db.get_async_session() as session:
+                return await session.run_sync(self._create_function, name, description, icon, category,
+                                              parameters, implementation, metadata)
         except Exception as e:
             logger.error(f"Failed to create function: {e}")
             return None
     
+    def _create_function(self, session: Session, name: str, description: str = None, icon: str = 'gear',
+                         category: str = 'custom', parameters: List[Dict] = None,
+                         implementation: str = None, metadata: Dict = None) -> dict:
+        function = Function(
+            name=name,
+            description=description,
+            icon=icon,
+            category=category,
+            parameters=parameters or [],
+            implementation=implementation,
+            extra_data=metadata
+        )
+        
+        session.add(function)
+        session.flush()  # To get the ID
+        
+        # Get the data before session closes
+        function_dict = function.to_dict()
+        
+        logger.info(f"Created function: {function.name} (ID: {function.id})")
+        return function_dict
+    
     def update_function(self, function_id: str, name: str = None, description: str = None,
                        icon: str = None, category: str = None, parameters: List[Dict] = None,
                        is_enabled: bool = None, implementation: str = None,
@@ -132,85 +173,139 @@ class FunctionDatabaseService:
         """Update an existing function"""
         try:
             with self.db.get_session() as session:
-                function = session.query(Function).filter(Function.id == function_id).first()
-                
-                if not function:
-                    return None
-                
-                # Update fields if provided
-                if name is not None:
-                    function.name = name
-                if description is not None:
-                    function.description = description
-                if icon is not None:
-                    function.icon = icon
-                if category is not None:
-                    function.category = category
-                if parameters is not None:
-                    function.parameters = parameters
-                if is_enabled is not None:
-                    function.is_enabled = is_enabled
-                if implementation is not None:
-                    function.implementation = implementation
-                if metadata is not None:
-                    function.extra_data = metadata
-                
-                session.flush()
-                
-                # Get the data before session closes
-                function_dict = function.to_dict()
-                
-                logger.info(f"Updated function: {function.name} (ID: {function.id})")
-                return function_dict
-                
+                return self._update_function(session, function_id, name, description, icon, category,
+                                             parameters, is_enabled, implementation, metadata)
         except Exception as e:
             logger.error(f"Failed to update function {function_id}: {e}")
             return None
     
+    async def update_function_async(self, function_id: str, name: str = None, description: str = None,
+                                    icon: str = None, category: str = None, parameters: List[Dict] = None,
+                                    is_enabled: bool = None, implementation: str = None,
+                                    metadata: Dict = None) -> Optional[dict]:
+        """Update an existing function (async)"""
+        try:
+            async with self.db.get_async_session() as session:
+                return await session.run_sync(self._update_function, function_id, name, description, icon,
+                                              category, parameters, is_enabled, implementation, metadata)
+        except Exception as e:
+            logger.error(f"Failed to update function {function_id}: {e}")
+            return None
+    
+    def _update_function(self, session: Session, function_id: str, name: str = None, description: str = None,
+                         icon: str = None, category: str = None, parameters: List[Dict] = None,
+                         is_enabled: bool = None, implementation: str = None,
+                         metadata: Dict = None) -> Optional[dict]:
+        function = session.query(Function).filter(Function.id == function_id).first()
+        
+        if not function:
+            return None
+        
+        # Update fields if provided
+        if name is not None:
+            function.name = name
+        if description is not None:
+            function.description = description
+        if icon is not None:
+            function.icon = icon
+        if category is not None:
+            function.category = category
+        if parameters is not None:
+            function.parameters = parameters
+        if is_enabled is not None:
+            function.is_enabled = is_enabled
+        if implementation is not None:
+            function.implementation = implementation
+        if metadata is not None:
+            function.extra_data = metadata
+        
+        session.flush()
+        
+        # Get the data before session closes
+        function_dict = function.to_dict()
+        
+        logger.info(f"Updated function: {function.name} (ID: {function.id})")
+        return function_dict
+    
     def delete_function(self, function_id: str) -> bool:
         """Delete a function (only if not system function)"""
         try:
             with self.db.get_session() as session:
-                function = session.query(Function).filter(Function.id == function_id).first()
-                
-                if not function:
-                    return False
-                
-                if function.is_system:
-                    logger.warning(f"Cannot delete system function: {function.name}")
-                    return False
-                
-                session.delete(function)
-                logger.info(f"Deleted function: {function.name} (ID: {function.id})")
-                return True
-                
+                return self._delete_function(session, function_id)
         except Exception as e:
             logger.error(f"Failed to delete function {function_id}: {e}")
             return False
     
+    async def delete_function_async(self, function_id: str) -> bool:
+        """Delete a function (only if not system function, async)"""
+        try:
+            async with self.db.get_async_session() as session:
+                return await session.run_sync(self._delete_function, function_id)
+        except Exception as e:
+            logger.error(f"Failed to delete function {function_id}: {e}")
+            return False
+    
+    def _delete_function(self, session: Session, function_id: str) -> bool:
+        function = session.query(Function).filter(Function.id == function_id).first()
+        
+        if not function:
+            return False
+        
+        if function.is_system:
+            logger.warning(f"Cannot delete system function: {function.name}")
+            return False
+        
+        session.delete(function)
+        logger.info(f"Deleted function: {function.name} (ID: {function.id})")
+        return True
+    
     def get_functions_by_category(self, category: str) -> List[dict]:
         """Get functions by category"""
         try:
-            with self.db.get_session() as session:
-                functions = session.query(Function)\
-                    .filter(Function.category == category, Function.is_enabled == True)\
-                    .order_by(desc(Function.created_at)).all()
-                return [func.to_dict() for func in functions]
+            with self.db.get_read_session() as session:
+                return self._get_functions_by_category(session, category)
+        except Exception as e:
+            logger.error(f"Failed to get functions by category {category}: {e}")
+            return []
+    
+    async def get_functions_by_category_async(self, category: str) -> List[dict]:
+        """Get functions by category (async)"""
+        try:
+            async with self.db.get_async_read_session() as session:
+                return await session.run_sync(self._get_functions_by_category, category)
         except Exception as e:
             logger.error(f"Failed to get functions by category {category}: {e}")
             return []
     
+    def _get_functions_by_category(self, session: Session, category: str) -> List[dict]:
+        functions = session.query(Function)\
+            .filter(Function.category == category, Function.is_enabled == True)\
+            .order_by(desc(Function.created_at)).all()
+        return [func.to_dict() for func in functions]
+    
     def get_categories(self) -> List[str]:
         """Get all function categories"""
         try:
-            with self.db.get_session() as session:
-                categories = session.query(Function.category)\
-                    .filter(Function.is_enabled == True)\
-                    .distinct().all()
-                return [cat[0] for cat in categories]
+            with self.db.get_read_session() as session:
+                return self._get_categories(session)
         except Exception as e:
             logger.error(f"Failed to get categories: {e}")
             return []
+    
+    async def get_categories_async(self) -> List[str]:
+        """Get all function categories (async)"""
+        try:
+            async with self.db.get_async_read_session() as session:
+                return await session.run_sync(self._get_categories)
+        except Exception as e:
+            logger.error(f"Failed to get categories: {e}")
+            return []
+    
+    def _get_categories(self, session: Session) -> List[str]:
+        categories = session.query(Function.category)\
+            .filter(Function.is_enabled == True)\
+            .distinct().all()
+        return [cat[0] for cat in categories]
 
 # Global service instance
 function_db_service = FunctionDatabaseService() 
\ No newline at end of file
@@ -0,0 +1,152 @@
+"""
+Hedged LLM requests against slow upstream completions
+"""
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import time
+
+from ..core.config import settings
+from .model_router import ModelRouter, model_router
+
+logger = logging.getLogger(__name__)
+
+# Latency samples needed before the percentile replaces default_delay
+MIN_HEDGE_SAMPLES = 20
+
+class RequestHedger:
+    """
+    Send a second request when the first one is unusually slow
+    
+    If a request has not completed after the given percentile of its
+    model's recent latencies, an identical request is sent, to a faster
+    model of the cascade when one is known to be faster, and whichever
+    completes first wins; the other is cancelled. Every request earns
+    budget (a fraction of a hedge) and every hedge spends one, so hedges
+    stay below that fraction of the traffic however slow upstream gets.
+    
+    The time a cancelled request had run is recorded as a latency sample
+    of its model: a lower bound, but dropping it would keep only the
+    requests that beat the hedge and pull the delay down over time. The
+    cancelled call is awaited, so it can settle its rate-limit
+    reservation and record the tokens it spent.
+    """
+    
+    def __init__(self, router: ModelRouter, enabled: bool = False, percentile: float = 95,
+                 min_delay: float = 0.5, default_delay: float = 5.0, budget: float = 0.05, burst: float = 3.0):
+        self.router = router
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.default_delay = default_delay
+        self.budget = budget
+        self.burst = burst
+        self.tokens = burst
+        
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.over_budget = 0
+        self.cancelled = 0
+    
+    def delay(self, model: str) -> float:
+        """Seconds to wait for the first request before hedging"""
+        latency = self.router.latencies.get(model)
+        samples = sorted(latency.samples) if latency else []
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return self.default_delay
+        index = min(int(len(samples) * self.percentile / 100), len(samples) - 1)
+        return max(samples[index], self.min_delay)
+    
+    def _hedge_model(self, model: str, candidates: List[str]) -> str:
+        """The fastest known model among the candidates, or model itself"""
+        def p50(name: str) -> Optional[float]:
+            latency = self.router.latencies.get(name)
+            return latency.p50() if latency else None
+        
+        best, best_p50 = model, p50(model)
+        for candidate in candidates:
+            candidate_p50 = p50(candidate)
+            if candidate_p50 is not None and (best_p50 is None or candidate_p50 < best_p50):
+                best, best_p50 = candidate, candidate_p50
+        return best
+    
+    async def run(self, model: str, candidates: List[str],
+                  call: Callable[[str], Awaitable[Any]]) -> Tuple[Any, str, float]:
+        """
+        Await call(model), hedged with a second call if it is slow
+        
+        Args:
+            model: Model of the first request
+            candidates: Models the hedge may go to instead
+            call: Coroutine function sending the request to a model
+        
+        Returns:
+            Tuple of (result of the call that finished first, its model,
+            its latency in seconds)
+        """
+        self.requests += 1
+        self.tokens = min(self.tokens + self.budget, self.burst)
+        first = asyncio.ensure_future(call(model))
+        tasks: Dict[asyncio.Future, str] = {first: model}
+        started: Dict[asyncio.Future, float] = {first: time.perf_counter()}
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.delay(model))
+            if not done:
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.hedges += 1
+                    hedge_model = self._hedge_model(model, candidates)
+                    logger.info(f"{model} request slow, hedging on {hedge_model}")
+                    hedge = asyncio.ensure_future(call(hedge_model))
+                    tasks[hedge] = hedge_model
+                    started[hedge] = time.perf_counter()
+                else:
+                    self.over_budget += 1
+            
+            # The first success wins; an error only counts once both failed
+            error = None
+            while tasks:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    task_model = tasks.pop(task)
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        return task.result(), task_model, time.perf_counter() - started[task]
+                    error = task.exception()
+            raise error
+        finally:
+            # The slower request is no longer needed
+            now = time.perf_counter()
+            for task, task_model in tasks.items():
+                task.cancel()
+                self.router.record_latency(task_model, now - started[task])
+            if tasks:
+                self.cancelled += len(tasks)
+                # Also retrieves whatever the cancelled calls end with
+                await asyncio.gather(*tasks, return_exceptions=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Hedges sent and won, and the share of requests they added"""
+        return {
+            "enabled": self.enabled,
+            "percentile": self.percentile,
+            "budget": self.budget,
+            "requests": self.requests,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "over_budget": self.over_budget,
+            "cancelled": self.cancelled,
+            "extra_requests_ratio": round(self.hedges / self.requests, 3) if self.requests else 0.0
+        }
+
+# Global hedger instance
+request_hedger = RequestHedger(
+    model_router,
+    enabled=settings.openai_hedging_enabled,
+    percentile=settings.openai_hedge_percentile,
+    min_delay=settings.openai_hedge_min_delay,
+    default_delay=settings.openai_hedge_default_delay,
+    budget=settings.openai_hedge_budget
+)
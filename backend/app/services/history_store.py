@@ -0,0 +1,251 @@
+"""
+Bounded in-memory conversation histories of the chat service
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional
+import logging
+import time
+
+from ..core.config import settings
+from .chat_database_service import ChatDatabaseService, chat_db_service
+from .summarizer import conversation_summarizer
+from .turns import ASSISTANT, USER, Turn
+
+logger = logging.getLogger(__name__)
+
+# Stored message types and the chat roles they are replayed as
+ROLES = {"user": USER, "assistant": ASSISTANT, "ai": ASSISTANT}
+
+@dataclass
+class History:
+    messages: List[Turn] = field(default_factory=list)
+    size: int = 0  # approximate bytes
+    touched: float = field(default_factory=time.monotonic)
+    cursor: Optional[str] = None  # position after the newest stored message seen
+
+class HistoryStore:
+    """
+    LRU + idle TTL store of conversation histories, capped per key
+    
+    Histories are keyed by chat session, or by connection for chats without
+    one. Session histories are a per-worker cache of the stored messages:
+    with sync, each turn first picks up the messages stored since the
+    previous one, so any worker can serve any session, and an evicted
+    history only costs a database read to get back. Each history keeps at
+    most max_messages entries (the oldest are trimmed), and whole histories
+    are evicted when idle for ttl seconds, beyond max_sessions, or while
+    the store holds more than max_bytes. A limit of 0 disables it.
+    
+    on_trim(key, count), on_truncate(key, length) and on_evict(key) let
+    holders of positions into a history (the summarizer) follow along as
+    entries are dropped from its front, from its end (unstored turns
+    replaced by stored ones) or all at once; on_evict is also called when
+    a history is reloaded from scratch.
+    """
+    
+    def __init__(self, max_sessions: int = 1000, ttl: float = 1800, max_messages: int = 100,
+                 max_bytes: int = 0, load_limit: int = 20, sync: bool = True, db: ChatDatabaseService = None,
+                 on_trim: Optional[Callable[[str, int], None]] = None,
+                 on_truncate: Optional[Callable[[str, int], None]] = None,
+                 on_evict: Optional[Callable[[str], None]] = None):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.load_limit = load_limit
+        self.sync = sync
+        self.db = db or chat_db_service
+        self.on_trim = on_trim
+        self.on_truncate = on_truncate
+        self.on_evict = on_evict
+        self._histories: "OrderedDict[str, History]" = OrderedDict()
+        self.size = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.loaded = 0
+        self.synced = 0
+        self.trimmed = 0
+        self.evictions = 0
+        self.expirations = 0
+    
+    def get(self, key: str) -> List[Turn]:
+        """The history of key, created empty if it is not in memory"""
+        self._expire()
+        history = self._histories.get(key)
+        if history is None:
+            self.misses += 1
+            history = self._histories[key] = History()
+            self._evict(keep=key)
+        else:
+            self.hits += 1
+            history.touched = time.monotonic()
+            self._histories.move_to_end(key)
+        return history.messages
+    
+    async def load(self, session_id: str) -> List[Turn]:
+        """
+        The history of a chat session, in step with its stored messages
+        
+        Messages stored since the last load, by the client or by another
+        worker, are appended and replace the trailing entries this worker
+        kept without storing them. A session that is not in memory starts
+        from its last load_limit stored messages.
+        
+        Args:
+            session_id: Chat session ID, also the history key
+        
+        Returns:
+            The session's live history list
+        """
+        history = self._histories.get(session_id)
+        if not self.load_limit or (history is not None and not self.sync):
+            return self.get(session_id)
+        cursor = history.cursor if history is not None else None
+        try:
+            stored, next_cursor = await self.db.get_messages_since_async(session_id, cursor, self.load_limit)
+        except Exception as e:
+            logger.error(f"Failed to load history of session {session_id}: {e}")
+            return self.get(session_id)
+        
+        messages = self.get(session_id)
+        history = self._histories[session_id]
+        if history.cursor != cursor:
+            return messages  # loaded by a concurrent turn meanwhile
+        history.cursor = next_cursor
+        
+        if cursor is not None and len(stored) >= self.load_limit:
+            # Possibly more were added than fetched; start over from the window,
+            # including the turns this worker stored itself
+            self._reset(session_id)
+        known = {turn.id for turn in messages}
+        added = [message for message in stored if message.id not in known and message.message_type in ROLES]
+        if not added:
+            return messages
+        while messages and messages[-1].id is None:
+            self._pop(session_id)
+        for message in added:
+            self.append(session_id, Turn.from_stored(ROLES[message.message_type], message.content,
+                                                     message.timestamp, message.id))
+        if cursor is None:
+            self.loaded += 1
+        else:
+            self.synced += len(added)
+        return messages
+    
+    def append(self, key: str, turn: Turn):
+        """Append a turn, trimming the history to max_messages"""
+        history = self._histories.get(key)
+        if history is None:
+            history = self._histories[key] = History()
+        else:
+            history.touched = time.monotonic()
+            self._histories.move_to_end(key)
+        history.messages.append(turn)
+        size = turn.nbytes()
+        history.size += size
+        self.size += size
+        
+        excess = len(history.messages) - self.max_messages if self.max_messages else 0
+        if excess > 0:
+            del history.messages[:excess]
+            self._measure(history)
+            self.trimmed += excess
+            if self.on_trim:
+                self.on_trim(key, excess)
+        self._evict(keep=key)
+    
+    def _reset(self, key: str):
+        history = self._histories[key]
+        history.messages.clear()
+        self.size -= history.size
+        history.size = 0
+        if self.on_evict:
+            self.on_evict(key)
+    
+    def _pop(self, key: str):
+        history = self._histories[key]
+        history.messages.pop()
+        self._measure(history)
+        if self.on_truncate:
+            self.on_truncate(key, len(history.messages))
+    
+    def _measure(self, history: History):
+        # Turns gain an id once stored, so sizes are taken afresh whenever
+        # some are removed
+        size = sum(turn.nbytes() for turn in history.messages)
+        self.size += size - history.size
+        history.size = size
+    
+    def drop(self, key: str):
+        """Forget the history of key"""
+        history = self._histories.pop(key, None)
+        if history is not None:
+            self.size -= history.size
+            if self.on_evict:
+                self.on_evict(key)
+    
+    def clear(self):
+        """Forget every history"""
+        for key in list(self._histories):
+            self.drop(key)
+    
+    def _expire(self):
+        # LRU order is also idle order, so expired histories are at the front
+        if not self.ttl:
+            return
+        deadline = time.monotonic() - self.ttl
+        while self._histories:
+            key, history = next(iter(self._histories.items()))
+            if history.touched > deadline:
+                break
+            self.drop(key)
+            self.expirations += 1
+    
+    def _evict(self, keep: Optional[str] = None):
+        # The history being written to is never evicted
+        while self._histories and (
+            (self.max_sessions and len(self._histories) > self.max_sessions)
+            or (self.max_bytes and self.size > self.max_bytes)
+        ):
+            key = next(iter(self._histories))
+            if key == keep:
+                break
+            self.drop(key)
+            self.evictions += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Sizes, memory estimate and eviction counters"""
+        self._expire()
+        lookups = self.hits + self.misses
+        return {
+            "histories": len(self._histories),
+            "messages": sum(len(history.messages) for history in self._histories.values()),
+            "bytes": self.size,
+            "max_sessions": self.max_sessions,
+            "max_messages": self.max_messages,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0.0,
+            "loaded": self.loaded,
+            "synced_messages": self.synced,
+            "trimmed_messages": self.trimmed,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+# Global history store instance
+history_store = HistoryStore(
+    max_sessions=settings.chat_history_max_sessions,
+    ttl=settings.chat_history_ttl,
+    max_messages=settings.chat_history_max_messages,
+    max_bytes=settings.chat_history_max_bytes,
+    load_limit=settings.chat_history_load_limit,
+    sync=settings.chat_history_sync,
+    on_trim=conversation_summarizer.trim,
+    on_truncate=conversation_summarizer.truncate,
+    on_evict=conversation_summarizer.forget
+)
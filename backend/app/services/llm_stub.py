@@ -0,0 +1,246 @@
+"""
+OpenAI-compatible stub backend for load tests and local development
+
+The stub answers chat completions (plain and streamed) after a sampled
+latency, reports token usage and can be told to reject a share of the
+requests with 429s. It runs in-process as an httpx transport under
+OpenAIService (LLM_BACKEND=stub) or as a standalone server:
+    
+    python -m app.services.llm_stub --port 8765
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 uvicorn app.main:app
+"""
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import argparse
+import asyncio
+import json
+import math
+import random
+import time
+import uuid
+
+import httpx
+
+from ..core.config import settings
+from .context_builder import MESSAGE_OVERHEAD_TOKENS, REPLY_PRIMING_TOKENS, count_tokens
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "exponential", "lognormal")
+
+FILLER = ("the", "plan", "looks", "good", "and", "we", "can", "ship", "it", "after", "a", "short", "review")
+
+class StubLLM:
+    """
+    Fake chat completion model
+    
+    Each request waits a time-to-first-token sampled from the latency
+    distribution around latency_ms, then produces completion_tokens words
+    (capped by max_tokens) at tokens_per_second. With rate_limit_probability
+    a request is instead rejected with a 429 and a Retry-After of
+    retry_after_ms.
+    """
+    
+    def __init__(self, latency_ms: float = 300, distribution: str = "lognormal", sigma: float = 0.5,
+                 tokens_per_second: float = 80, completion_tokens: int = 60,
+                 rate_limit_probability: float = 0.0, retry_after_ms: int = 200, seed: Optional[int] = None):
+        if distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Unknown latency distribution {distribution!r}, expected one of {', '.join(LATENCY_DISTRIBUTIONS)}")
+        self.latency = latency_ms / 1000
+        self.distribution = distribution
+        self.sigma = sigma
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.rate_limit_probability = rate_limit_probability
+        self.retry_after_ms = retry_after_ms
+        self.random = random.Random(seed)
+        
+        self.requests = 0
+        self.rate_limited = 0
+    
+    @classmethod
+    def from_settings(cls) -> "StubLLM":
+        return cls(
+            latency_ms=settings.llm_stub_latency_ms,
+            distribution=settings.llm_stub_latency_distribution,
+            sigma=settings.llm_stub_latency_sigma,
+            tokens_per_second=settings.llm_stub_tokens_per_second,
+            completion_tokens=settings.llm_stub_completion_tokens,
+            rate_limit_probability=settings.llm_stub_rate_limit_probability,
+            retry_after_ms=settings.llm_stub_retry_after_ms
+        )
+    
+    def sample_latency(self) -> float:
+        """Seconds until the first token; latency is the median (mean for exponential)"""
+        if self.distribution == "fixed":
+            return self.latency
+        if self.distribution == "uniform":
+            return self.random.uniform(0, 2 * self.latency)
+        if self.distribution == "exponential":
+            return self.random.expovariate(1 / self.latency) if self.latency else 0.0
+        return self.random.lognormvariate(math.log(self.latency), self.sigma) if self.latency else 0.0
+    
+    def _reply(self, body: Dict[str, Any]) -> Tuple[List[str], Dict[str, int]]:
+        model = body.get("model", "gpt-3.5-turbo")
+        messages = body.get("messages", [])
+        prompt_tokens = REPLY_PRIMING_TOKENS + sum(
+            count_tokens(msg.get("content") or "", model) + MESSAGE_OVERHEAD_TOKENS for msg in messages
+        )
+        length = max(min(self.completion_tokens, body.get("max_tokens") or self.completion_tokens), 1)
+        last = next((msg.get("content") or "" for msg in reversed(messages) if msg.get("role") == "user"), "")
+        words = [f"Stub reply to {len(last)} characters:"] + [
+            f" {FILLER[i % len(FILLER)]}" for i in range(length - 1)
+        ]
+        return words, {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": length,
+            "total_tokens": prompt_tokens + length
+        }
+    
+    def _rate_limited(self) -> bool:
+        self.requests += 1
+        if self.rate_limit_probability and self.random.random() < self.rate_limit_probability:
+            self.rate_limited += 1
+            return True
+        return False
+    
+    def rate_limit_response(self) -> Tuple[int, Dict[str, str], Dict[str, Any]]:
+        return 429, {"retry-after-ms": str(self.retry_after_ms)}, {
+            "error": {"message": "Rate limit reached (stub)", "type": "requests", "code": "rate_limit_exceeded"}
+        }
+    
+    async def complete(self, body: Dict[str, Any]) -> Tuple[int, Dict[str, str], Dict[str, Any]]:
+        """Answer a non-streamed chat completion; returns (status, headers, json)"""
+        if self._rate_limited():
+            return self.rate_limit_response()
+        words, usage = self._reply(body)
+        await asyncio.sleep(self.sample_latency() + len(words) / self.tokens_per_second)
+        return 200, {}, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:24]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(words)},
+                "finish_reason": "stop" if usage["completion_tokens"] < (body.get("max_tokens") or math.inf) else "length"
+            }],
+            "usage": usage
+        }
+    
+    async def stream(self, body: Dict[str, Any]) -> AsyncIterator[bytes]:
+        """Answer a streamed chat completion as server-sent events"""
+        words, usage = self._reply(body)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        
+        def event(choices: List[Dict[str, Any]], **extra) -> bytes:
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": body.get("model"), "choices": choices, **extra}
+            return f"data: {json.dumps(chunk)}\n\n".encode()
+        
+        await asyncio.sleep(self.sample_latency())
+        for i, word in enumerate(words):
+            if i:
+                await asyncio.sleep(1 / self.tokens_per_second)
+            delta = {"role": "assistant", "content": word} if i == 0 else {"content": word}
+            yield event([{"index": 0, "delta": delta, "finish_reason": None}])
+        yield event([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield event([], usage=usage)
+        yield b"data: [DONE]\n\n"
+    
+    def models(self) -> Dict[str, Any]:
+        return {"object": "list", "data": [
+            {"id": model, "object": "model", "created": 0, "owned_by": "stub"}
+            for model in ("gpt-3.5-turbo", "gpt-4", "gpt-4-turbo", "gpt-4o", "gpt-4o-mini")
+        ]}
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "distribution": self.distribution,
+            "latency_ms": self.latency * 1000,
+            "requests": self.requests,
+            "rate_limited": self.rate_limited
+        }
+
+class _EventStream(httpx.AsyncByteStream):
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        self.chunks = chunks
+    
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        async for chunk in self.chunks:
+            yield chunk
+    
+    async def aclose(self):
+        await self.chunks.aclose()
+
+class StubTransport(httpx.AsyncBaseTransport):
+    """httpx transport that answers OpenAI API requests from a StubLLM, without any network"""
+    
+    def __init__(self, stub: StubLLM):
+        self.stub = stub
+    
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        path = request.url.path
+        if request.method == "GET" and path.endswith("/models"):
+            return httpx.Response(200, json=self.stub.models())
+        if request.method != "POST" or not path.endswith("/chat/completions"):
+            return httpx.Response(404, json={"error": {"message": f"Unknown stub endpoint {path}"}})
+        
+        body = json.loads(await request.aread())
+        if body.get("stream"):
+            if self.stub._rate_limited():
+                status, headers, payload = self.stub.rate_limit_response()
+                return httpx.Response(status, headers=headers, json=payload)
+            return httpx.Response(200, headers={"content-type": "text/event-stream"},
+                                  stream=_EventStream(self.stub.stream(body)))
+        status, headers, payload = await self.stub.complete(body)
+        return httpx.Response(status, headers=headers, json=payload)
+
+def create_app(stub: StubLLM):
+    """Standalone OpenAI-compatible server around a StubLLM"""
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse, StreamingResponse
+    
+    app = FastAPI(title="Attila LLM stub")
+    
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        if body.get("stream"):
+            if stub._rate_limited():
+                status, headers, payload = stub.rate_limit_response()
+                return JSONResponse(payload, status_code=status, headers=headers)
+            return StreamingResponse(stub.stream(body), media_type="text/event-stream")
+        status, headers, payload = await stub.complete(body)
+        return JSONResponse(payload, status_code=status, headers=headers)
+    
+    @app.get("/v1/models")
+    async def models():
+        return stub.models()
+    
+    @app.get("/stats")
+    async def stats():
+        return stub.stats()
+    
+    return app
+
+def main():
+    import uvicorn
+    
+    parser = argparse.ArgumentParser(description="Run the OpenAI-compatible LLM stub")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=settings.llm_stub_latency_ms)
+    parser.add_argument("--distribution", choices=LATENCY_DISTRIBUTIONS, default=settings.llm_stub_latency_distribution)
+    parser.add_argument("--sigma", type=float, default=settings.llm_stub_latency_sigma)
+    parser.add_argument("--tokens-per-second", type=float, default=settings.llm_stub_tokens_per_second)
+    parser.add_argument("--completion-tokens", type=int, default=settings.llm_stub_completion_tokens)
+    parser.add_argument("--rate-limit", type=float, default=settings.llm_stub_rate_limit_probability,
+                        help="share of requests answered with 429")
+    parser.add_argument("--retry-after-ms", type=int, default=settings.llm_stub_retry_after_ms)
+    args = parser.parse_args()
+    
+    stub = StubLLM(args.latency_ms, args.distribution, args.sigma, args.tokens_per_second,
+                   args.completion_tokens, args.rate_limit, args.retry_after_ms)
+    uvicorn.run(create_app(stub), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Event loop lag monitor
+"""
+from collections import deque
+from typing import Any, Deque, Dict, Optional
+import asyncio
+import logging
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class LoopLagMonitor:
+    """
+    Measure how late the event loop wakes up a sleeping task
+    
+    A background task sleeps for interval seconds at a time; whatever it
+    oversleeps is time the loop spent running something else without
+    yielding (blocking calls, heavy CPU work). Every request served by the
+    loop is delayed by at least as much.
+    """
+    
+    def __init__(self, interval: float = 0.1, history_size: int = 1000):
+        self.interval = interval
+        self.samples: Deque[float] = deque(maxlen=history_size)
+        self.max_lag = 0.0
+        self.task: Optional[asyncio.Task] = None
+    
+    def start(self):
+        """Start sampling on the running loop; no-op when disabled or running"""
+        if self.interval > 0 and self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self._sample())
+    
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
+            self.task = None
+    
+    async def _sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.interval)
+            lag = max(loop.time() - started - self.interval, 0.0)
+            self.samples.append(lag)
+            self.max_lag = max(self.max_lag, lag)
+    
+    def reset(self):
+        """Forget the samples taken so far"""
+        self.samples.clear()
+        self.max_lag = 0.0
+    
+    def stats(self) -> Dict[str, Any]:
+        """Lag percentiles over the recent samples, in milliseconds"""
+        ordered = sorted(self.samples)
+        
+        def percentile(p: float) -> Optional[float]:
+            if not ordered:
+                return None
+            return round(ordered[min(int(len(ordered) * p / 100), len(ordered) - 1)] * 1000, 2)
+        
+        return {
+            "running": self.task is not None,
+            "interval_ms": self.interval * 1000,
+            "samples": len(ordered),
+            "p50_ms": percentile(50),
+            "p95_ms": percentile(95),
+            "p99_ms": percentile(99),
+            "max_ms": round(self.max_lag * 1000, 2)
+        }
+
+# Global loop lag monitor instance
+loop_monitor = LoopLagMonitor(interval=settings.loop_lag_interval_ms / 1000)
@@ -0,0 +1,257 @@
+"""
+Lightweight versioned schema migrations for the SQLite database
+"""
+from dataclasses import dataclass
+from typing import Callable, List
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.engine import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    description: str
+    apply: Callable[[Connection], None]
+
+MIGRATIONS: List[Migration] = []
+
+def migration(version: int, description: str):
+    """Register a migration step; versions must be applied in increasing order"""
+    def decorator(fn: Callable[[Connection], None]):
+        MIGRATIONS.append(Migration(version, description, fn))
+        MIGRATIONS.sort(key=lambda m: m.version)
+        return fn
+    return decorator
+
+def get_schema_version(conn: Connection) -> int:
+    """Read the schema version stored in the SQLite header"""
+    return conn.exec_driver_sql("PRAGMA user_version").scalar() or 0
+
+def _set_schema_version(conn: Connection, version: int):
+    # PRAGMA statements do not accept bound parameters
+    conn.exec_driver_sql(f"PRAGMA user_version = {int(version)}")
+
+def run_migrations(engine: Engine) -> int:
+    """
+    Upgrade the database in place to the latest schema version
+    
+    Pending migrations are applied one step at a time and the version is
+    recorded after each step, so an interrupted upgrade resumes from the
+    last step that completed. Migrations must be idempotent: a brand new
+    database already has the current schema from create_all(), and SQLite
+    DDL is not always covered by the surrounding transaction.
+    
+    Returns:
+        int: The schema version after upgrading
+    """
+    with engine.connect() as conn:
+        current = get_schema_version(conn)
+    
+    pending = [m for m in MIGRATIONS if m.version > current]
+    for step in pending:
+        logger.info(f"Applying database migration {step.version}: {step.description}")
+        with engine.connect() as conn:
+            # Steps may commit intermediate batches themselves
+            step.apply(conn)
+            _set_schema_version(conn, step.version)
+            conn.commit()
+        current = step.version
+    
+    if pending:
+        # Refresh planner statistics so new indexes are picked up immediately
+        with engine.begin() as conn:
+            conn.exec_driver_sql("PRAGMA optimize")
+        logger.info(f"Database schema upgraded to version {current}")
+    
+    return current
+
+@migration(1, "Add indexes for session listing, message history and function lookups")
+def _add_query_indexes(conn: Connection):
+    statements = [
+        "CREATE INDEX IF NOT EXISTS ix_chat_sessions_active_updated "
+        "ON chat_sessions (is_active, updated_at)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_session_timestamp "
+        "ON chat_messages (session_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_timestamp "
+        "ON chat_messages (timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_functions_enabled_created "
+        "ON functions (is_enabled, created_at)",
+        "CREATE INDEX IF NOT EXISTS ix_functions_category_enabled_created "
+        "ON functions (category, is_enabled, created_at)",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+    conn.exec_driver_sql("ANALYZE")
+
+def has_message_search_index(conn: Connection) -> bool:
+    """Check whether the FTS5 message search index exists"""
+    return conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_messages_fts'")
+    ).first() is not None
+
+def rebuild_message_search_index(conn: Connection, batch_size: int = 5000):
+    """
+    Re-index all chat messages into the FTS5 table in batches
+    
+    Commits after every batch so the write lock is released periodically on
+    large databases. Also use this after VACUUM: the index is keyed by the
+    implicit rowid of chat_messages, which VACUUM may renumber.
+    """
+    conn.execute(text("INSERT INTO chat_messages_fts(chat_messages_fts) VALUES ('delete-all')"))
+    conn.commit()
+    
+    last_rowid = 0
+    indexed = 0
+    while True:
+        batch_end = conn.execute(
+            text("SELECT max(rowid) FROM (SELECT rowid FROM chat_messages "
+                 "WHERE rowid > :last ORDER BY rowid LIMIT :batch)"),
+            {"last": last_rowid, "batch": batch_size}
+        ).scalar()
+        if batch_end is None:
+            break
+        result = conn.execute(
+            text("INSERT INTO chat_messages_fts(rowid, content) "
+                 "SELECT rowid, content FROM chat_messages WHERE rowid > :last AND rowid <= :end"),
+            {"last": last_rowid, "end": batch_end}
+        )
+        conn.commit()
+        indexed += result.rowcount
+        last_rowid = batch_end
+    
+    logger.info(f"Indexed {indexed} chat messages for full-text search")
+
+@migration(2, "Add FTS5 full-text index for chat message search")
+def _add_message_search_index(conn: Connection):
+    try:
+        conn.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS chat_messages_fts USING fts5("
+            "content, content='chat_messages', content_rowid='rowid', "
+            "tokenize='unicode61 remove_diacritics 2')"
+        ))
+    except OperationalError as e:
+        # SQLite built without FTS5: search keeps using the LIKE fallback
+        logger.warning(f"FTS5 is not available, skipping message search index: {e}")
+        return
+    
+    # Keep the external-content index in sync with chat_messages
+    triggers = [
+        "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_insert AFTER INSERT ON chat_messages BEGIN "
+        "INSERT INTO chat_messages_fts(rowid, content) VALUES (new.rowid, new.content); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_delete AFTER DELETE ON chat_messages BEGIN "
+        "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) "
+        "VALUES ('delete', old.rowid, old.content); "
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS chat_messages_fts_update AFTER UPDATE OF content ON chat_messages BEGIN "
+        "INSERT INTO chat_messages_fts(chat_messages_fts, rowid, content) "
+        "VALUES ('delete', old.rowid, old.content); "
+        "INSERT INTO chat_messages_fts(rowid, content) VALUES (new.rowid, new.content); "
+        "END",
+    ]
+    for statement in triggers:
+        conn.execute(text(statement))
+    conn.commit()
+    
+    rebuild_message_search_index(conn)
+
+@migration(3, "Extend session and message ordering indexes with id for keyset pagination")
+def _add_keyset_indexes(conn: Connection):
+    statements = [
+        "CREATE INDEX IF NOT EXISTS ix_chat_sessions_active_updated_id "
+        "ON chat_sessions (is_active, updated_at, id)",
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_session_timestamp_id "
+        "ON chat_messages (session_id, timestamp, id)",
+        "DROP INDEX IF EXISTS ix_chat_sessions_active_updated",
+        "DROP INDEX IF EXISTS ix_chat_messages_session_timestamp",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+# Day bucket and token usage of a chat_messages row, for the stats rollup
+_STATS_DAY = "coalesce(date({row}.timestamp), date('now'))"
+_STATS_TOKENS = ("CASE WHEN json_valid({row}.extra_data) "
+                 "THEN CAST(coalesce(json_extract({row}.extra_data, '$.usage.{field}'), 0) AS INTEGER) "
+                 "ELSE 0 END")
+
+def _stats_values(row: str) -> str:
+    return ", ".join([
+        _STATS_DAY.format(row=row), f"{row}.session_id", f"{row}.message_type", "1",
+        *[_STATS_TOKENS.format(row=row, field=field)
+          for field in ("prompt_tokens", "completion_tokens", "total_tokens")],
+    ])
+
+def _stats_add(row: str) -> str:
+    return (
+        "INSERT INTO chat_message_stats (day, session_id, message_type, message_count, "
+        "prompt_tokens, completion_tokens, total_tokens) "
+        f"VALUES ({_stats_values(row)}) "
+        "ON CONFLICT (day, session_id, message_type) DO UPDATE SET "
+        "message_count = message_count + excluded.message_count, "
+        "prompt_tokens = prompt_tokens + excluded.prompt_tokens, "
+        "completion_tokens = completion_tokens + excluded.completion_tokens, "
+        "total_tokens = total_tokens + excluded.total_tokens; "
+    )
+
+def _stats_remove(row: str) -> str:
+    match = (f"WHERE day = {_STATS_DAY.format(row=row)} AND session_id = {row}.session_id "
+             f"AND message_type = {row}.message_type")
+    tokens = {field: _STATS_TOKENS.format(row=row, field=field)
+              for field in ("prompt_tokens", "completion_tokens", "total_tokens")}
+    return (
+        "UPDATE chat_message_stats SET message_count = message_count - 1, "
+        f"prompt_tokens = prompt_tokens - {tokens['prompt_tokens']}, "
+        f"completion_tokens = completion_tokens - {tokens['completion_tokens']}, "
+        f"total_tokens = total_tokens - {tokens['total_tokens']} "
+        f"{match}; "
+        f"DELETE FROM chat_message_stats {match} AND message_count <= 0; "
+    )
+
+def rebuild_message_stats(conn: Connection):
+    """Recompute the chat_message_stats rollup from chat_messages"""
+    conn.execute(text("DELETE FROM chat_message_stats"))
+    result = conn.execute(text(
+        "INSERT INTO chat_message_stats (day, session_id, message_type, message_count, "
+        "prompt_tokens, completion_tokens, total_tokens) "
+        "SELECT day, session_id, message_type, count(*), sum(prompt_tokens), "
+        "sum(completion_tokens), sum(total_tokens) FROM ("
+        f"SELECT {_STATS_DAY.format(row='m')} AS day, m.session_id, m.message_type, "
+        f"{_STATS_TOKENS.format(row='m', field='prompt_tokens')} AS prompt_tokens, "
+        f"{_STATS_TOKENS.format(row='m', field='completion_tokens')} AS completion_tokens, "
+        f"{_STATS_TOKENS.format(row='m', field='total_tokens')} AS total_tokens "
+        "FROM chat_messages AS m) GROUP BY day, session_id, message_type"
+    ))
+    conn.commit()
+    logger.info(f"Rebuilt chat message stats rollup ({result.rowcount} rows)")
+
+@migration(4, "Add trigger-maintained chat message stats rollup")
+def _add_message_stats_rollup(conn: Connection):
+    statements = [
+        "CREATE TABLE IF NOT EXISTS chat_message_stats ("
+        "day VARCHAR(10) NOT NULL, session_id VARCHAR NOT NULL, message_type VARCHAR(50) NOT NULL, "
+        "message_count INTEGER NOT NULL DEFAULT 0, prompt_tokens INTEGER NOT NULL DEFAULT 0, "
+        "completion_tokens INTEGER NOT NULL DEFAULT 0, total_tokens INTEGER NOT NULL DEFAULT 0, "
+        "PRIMARY KEY (day, session_id, message_type))",
+        "CREATE INDEX IF NOT EXISTS ix_chat_message_stats_session ON chat_message_stats (session_id)",
+        # Every insert path (ORM, batch, import) and every delete, including
+        # cascades from session deletion, goes through these triggers
+        "CREATE TRIGGER IF NOT EXISTS chat_message_stats_insert AFTER INSERT ON chat_messages BEGIN "
+        f"{_stats_add('new')}"
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS chat_message_stats_delete AFTER DELETE ON chat_messages BEGIN "
+        f"{_stats_remove('old')}"
+        "END",
+        "CREATE TRIGGER IF NOT EXISTS chat_message_stats_update "
+        "AFTER UPDATE OF session_id, message_type, timestamp, extra_data ON chat_messages BEGIN "
+        f"{_stats_remove('old')}{_stats_add('new')}"
+        "END",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+    conn.commit()
+    
+    rebuild_message_stats(conn)
@@ -0,0 +1,44 @@
+"""
+Per-model context windows and prices
+"""
+from typing import Any, Dict, Optional, Tuple
+
+# Context window (prompt + completion tokens) per model
+MODEL_CONTEXT_WINDOWS: Dict[str, int] = {
+    "gpt-3.5-turbo": 16385,
+    "gpt-4": 8192,
+    "gpt-4-turbo": 128000,
+    "gpt-4o": 128000,
+    "gpt-4o-mini": 128000,
+}
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Price in USD per 1k (prompt, completion) tokens, for cost estimates
+MODEL_PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-3.5-turbo": (0.0005, 0.0015),
+    "gpt-4": (0.03, 0.06),
+    "gpt-4-turbo": (0.01, 0.03),
+    "gpt-4o": (0.005, 0.015),
+    "gpt-4o-mini": (0.00015, 0.0006),
+}
+
+def _lookup(table: Dict[str, Any], model: str, default: Any = None) -> Any:
+    """Entry of a per-model table, by exact name or longest known prefix"""
+    if model in table:
+        return table[model]
+    # Dated snapshots (e.g. gpt-4o-2024-05-13) share their family's entry
+    for name in sorted(table, key=len, reverse=True):
+        if model.startswith(name):
+            return table[name]
+    return default
+
+def get_context_window(model: str) -> int:
+    """Context window size of a model"""
+    return _lookup(MODEL_CONTEXT_WINDOWS, model, DEFAULT_CONTEXT_WINDOW)
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """Estimated price of a call in USD, or None for models without a known price"""
+    price = _lookup(MODEL_PRICES, model or "")
+    if price is None:
+        return None
+    return (prompt_tokens * price[0] + completion_tokens * price[1]) / 1000
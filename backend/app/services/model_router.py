@@ -0,0 +1,195 @@
+"""
+Per-request model routing with a fallback cascade
+"""
+from collections import deque
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+import asyncio
+import logging
+import statistics
+
+import openai
+
+from ..core.config import settings
+from .model_catalog import estimate_cost, get_context_window
+from .rate_limiter import RateLimitTimeout
+
+logger = logging.getLogger(__name__)
+
+# Errors after which the next model of the cascade is tried
+FALLBACK_ERRORS = (RateLimitTimeout, openai.RateLimitError, openai.APITimeoutError, asyncio.TimeoutError)
+
+# Tasks nobody reads as they are generated; routed to the cheapest model that fits
+BACKGROUND_TASKS = ("title", "summary")
+
+# Latency samples needed before a model's latency is trusted
+MIN_LATENCY_SAMPLES = 5
+
+def model_cost(model: str) -> float:
+    """
+    Blended price of a model in USD per 1k tokens, for the cost policies
+    
+    Models without a known price count as the most expensive: they never
+    meet a cost target and are the last choice for background tasks.
+    """
+    cost = estimate_cost(model, 1000, 1000)
+    return cost / 2 if cost is not None else float("inf")
+
+@dataclass
+class RouteDecision:
+    task: str
+    requested: str
+    models: List[str]  # primary model first, then the fallbacks
+    reason: str
+    prompt_tokens: int
+    attempts: List[Dict[str, Any]] = field(default_factory=list)
+    created_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
+
+@dataclass
+class ModelLatency:
+    samples: Deque[float] = field(default_factory=lambda: deque(maxlen=100))
+    calls: int = 0
+    failures: int = 0
+    
+    def p50(self) -> Optional[float]:
+        return statistics.median(self.samples) if len(self.samples) >= MIN_LATENCY_SAMPLES else None
+    
+    def p95(self) -> Optional[float]:
+        if len(self.samples) < MIN_LATENCY_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)]
+
+class ModelRouter:
+    """
+    Pick the models a request is tried on
+    
+    Chat turns start on the model selected in settings and cascade down
+    the configured list after it. Models whose context window cannot hold
+    the prompt plus the completion are skipped. With a latency target,
+    models whose observed median latency misses it are moved behind the
+    ones that meet it, unless functions are active (those turns keep the
+    most capable model). With a cost target, models above it are skipped
+    while a cheaper one is left. Titles and summaries go to the cheapest
+    model that fits. Models without a known price are treated as the most
+    expensive by both.
+    
+    Every decision and attempt is kept in a short log, and latencies per
+    model are tracked to drive and tune the policy.
+    """
+    
+    def __init__(self, cascade: List[str], enabled: bool = True, latency_target_ms: float = 0,
+                 max_cost_per_1k: float = 0, attempt_timeout: float = 0, history_size: int = 200):
+        self.cascade = cascade
+        self.enabled = enabled
+        self.latency_target_ms = latency_target_ms
+        self.max_cost_per_1k = max_cost_per_1k
+        self.attempt_timeout = attempt_timeout or None
+        self.latencies: Dict[str, ModelLatency] = {}
+        self.decisions: Deque[RouteDecision] = deque(maxlen=history_size)
+    
+    def route(self, task: str, requested: str, prompt_tokens: int, max_tokens: int,
+              functions: Optional[List[str]] = None) -> RouteDecision:
+        """
+        Decide the models to try for a request
+        
+        Args:
+            task: "chat", "title" or "summary"
+            requested: Model the caller would use without routing
+            prompt_tokens: Estimated prompt size
+            max_tokens: Completion tokens to reserve
+            functions: Active functions of the turn
+        
+        Returns:
+            RouteDecision whose models are tried in order
+        """
+        if not self.enabled:
+            return self._decide(task, requested, [requested], "routing disabled", prompt_tokens)
+        
+        if requested in self.cascade:
+            chain = self.cascade[self.cascade.index(requested):]
+        else:
+            chain = [requested] + self.cascade
+        fitting = [model for model in chain if prompt_tokens + max_tokens <= get_context_window(model)]
+        if not fitting:
+            return self._decide(task, requested, [requested], "no model fits the prompt", prompt_tokens)
+        reasons = [] if len(fitting) == len(chain) else ["prompt size"]
+        
+        if self.max_cost_per_1k:
+            affordable = [model for model in fitting if model_cost(model) <= self.max_cost_per_1k]
+            if affordable and len(affordable) < len(fitting):
+                fitting = affordable
+                reasons.append("cost target")
+        
+        if task in BACKGROUND_TASKS:
+            fitting = sorted(fitting, key=model_cost)
+            reasons.append("cheapest for background task")
+        elif self.latency_target_ms and not functions:
+            within = [model for model in fitting if not self._misses_target(model)]
+            if within and within[0] != fitting[0]:
+                fitting = within + [model for model in fitting if model not in within]
+                reasons.append("latency target")
+        
+        return self._decide(task, requested, fitting, ", ".join(reasons) or "requested model", prompt_tokens)
+    
+    def _misses_target(self, model: str) -> bool:
+        latency = self.latencies.get(model)
+        p50 = latency.p50() if latency else None
+        return p50 is not None and p50 * 1000 > self.latency_target_ms
+    
+    def _decide(self, task: str, requested: str, models: List[str], reason: str, prompt_tokens: int) -> RouteDecision:
+        decision = RouteDecision(task, requested, models, reason, prompt_tokens)
+        self.decisions.append(decision)
+        return decision
+    
+    def record(self, decision: RouteDecision, model: str, latency: float, error: Optional[Exception] = None):
+        """Record one attempt of a routed request"""
+        stats = self.latencies.setdefault(model, ModelLatency())
+        stats.calls += 1
+        if error is None:
+            stats.samples.append(latency)
+        else:
+            stats.failures += 1
+        decision.attempts.append({
+            "model": model,
+            "latency_ms": round(latency * 1000),
+            "error": error.__class__.__name__ if error else None
+        })
+    
+    def record_latency(self, model: str, latency: float):
+        """Record a latency sample outside a routed attempt, e.g. the lower bound of a cancelled request"""
+        self.latencies.setdefault(model, ModelLatency()).samples.append(latency)
+    
+    def stats(self, limit: int = 50) -> Dict[str, Any]:
+        """Routing policy, per-model latencies and the latest decisions"""
+        def ms(value: Optional[float]) -> Optional[int]:
+            return round(value * 1000) if value is not None else None
+        
+        return {
+            "enabled": self.enabled,
+            "cascade": self.cascade,
+            "latency_target_ms": self.latency_target_ms,
+            "max_cost_per_1k": self.max_cost_per_1k,
+            "attempt_timeout": self.attempt_timeout,
+            "models": {
+                model: {
+                    "calls": latency.calls,
+                    "failures": latency.failures,
+                    "p50_ms": ms(latency.p50()),
+                    "p95_ms": ms(latency.p95())
+                }
+                for model, latency in self.latencies.items()
+            },
+            "fallbacks": sum(1 for decision in self.decisions if len(decision.attempts) > 1),
+            "decisions": [asdict(decision) for decision in list(self.decisions)[-limit:]]
+        }
+
+# Global router instance
+model_router = ModelRouter(
+    cascade=settings.model_cascade,
+    enabled=settings.model_routing_enabled,
+    latency_target_ms=settings.model_latency_target_ms,
+    max_cost_per_1k=settings.model_max_cost_per_1k,
+    attempt_timeout=settings.model_attempt_timeout
+)
@@ -2,17 +2,38 @@
 OpenAI Service for chat completions and model management
 """
 import os
+import asyncio
+import contextlib
+import copy
 import json
+import time
+from hashlib import sha256
 from pathlib import Path
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, AsyncIterator, Tuple
+import httpx
 import openai
-from openai import OpenAI
+from openai import AsyncOpenAI
 import logging
 
+from ..core.config import settings as app_settings
+from .completion_cache import CompletionCache, completion_cache
+from .single_flight import SingleFlight
+from .rate_limiter import BACKGROUND, INTERACTIVE, RateLimitTimeout, RequestScheduler, request_scheduler
+from .model_router import FALLBACK_ERRORS, ModelRouter, RouteDecision, model_router
+from .hedging import RequestHedger, request_hedger
+from .usage_ledger import UsageLedger, usage_ledger
+from .turns import Turn
+from .context_builder import (
+    MESSAGE_OVERHEAD_TOKENS, build_context, count_tokens, truncate_to_tokens
+)
+from .model_catalog import get_context_window
+
 logger = logging.getLogger(__name__)
 
 class OpenAIService:
-    def __init__(self):
+    def __init__(self, cache: Optional[CompletionCache] = completion_cache,
+                 scheduler: RequestScheduler = request_scheduler, router: ModelRouter = model_router,
+                 hedger: RequestHedger = request_hedger, ledger: Optional[UsageLedger] = usage_ledger):
         self.client = None
         self.api_key = None
         self.model = "gpt-3.5-turbo"
@@ -20,6 +41,39 @@ class OpenAIService:
         self.max_tokens = 2000
         self.system_prompt = "You are Attila, a helpful AI assistant for project management, idea development, and task automation. You can help with Jira tickets, Confluence documentation, and idea analysis."
         
+        # One pooled HTTP client shared by every OpenAI client this service
+        # creates, so concurrent completions reuse warm keep-alive connections
+        self.timeout = httpx.Timeout(
+            connect=app_settings.openai_connect_timeout,
+            read=app_settings.openai_read_timeout,
+            write=app_settings.openai_write_timeout,
+            pool=app_settings.openai_pool_timeout
+        )
+        self.backend = app_settings.llm_backend
+        self.http_client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(
+                max_connections=app_settings.openai_max_connections,
+                max_keepalive_connections=app_settings.openai_max_keepalive_connections,
+                keepalive_expiry=app_settings.openai_keepalive_expiry
+            ),
+            transport=self._create_transport()
+        )
+        
+        # Low-temperature completions are served from here when possible;
+        # None disables caching
+        self.completion_cache = cache
+        # Concurrent identical completions share one upstream call
+        self.single_flight = SingleFlight("completions")
+        # Paces requests within the rate limits and owns retries
+        self.scheduler = scheduler
+        # Picks the model per request and the cascade to fall back on
+        self.router = router
+        # Duplicates slow interactive completions when enabled
+        self.hedger = hedger
+        # Records tokens, latency and cost of every call; None disables metering
+        self.ledger = ledger
+        
         # Config file path
         self.config_path = Path(__file__).parent.parent.parent / "config" / "settings.json"
         self.config_path.parent.mkdir(exist_ok=True)
@@ -28,6 +82,11 @@ class OpenAIService:
         self._load_from_config()
         if not self.api_key:
             self._load_from_env()
+        if not self.client and self.backend == "stub":
+            # The stub needs no key; requests never leave the process
+            self.api_key = "stub"
+            self.client = self._create_client(self.api_key)
+            logger.info("OpenAI client initialized on the stub backend")
     
     def _load_from_config(self):
         """Load OpenAI configuration from saved config file"""
@@ -43,7 +102,7 @@ class OpenAIService:
                 self.system_prompt = config.get("systemPrompt", self.system_prompt)
                 
                 if self.api_key:
-                    self.client = OpenAI(api_key=self.api_key)
+                    self.client = self._create_client(self.api_key)
                     logger.info("OpenAI client initialized from saved config")
                     
         except Exception as e:
@@ -53,9 +112,33 @@ class OpenAIService:
         """Load OpenAI configuration from environment variables"""
         self.api_key = os.getenv("OPENAI_API_KEY")
         if self.api_key:
-            self.client = OpenAI(api_key=self.api_key)
+            self.client = self._create_client(self.api_key)
             logger.info("OpenAI client initialized from environment")
     
+    def _create_transport(self) -> Optional[httpx.AsyncBaseTransport]:
+        """Transport of the configured LLM backend; None for the network"""
+        if self.backend == "stub":
+            from .llm_stub import StubLLM, StubTransport
+            logger.warning("LLM_BACKEND=stub: completions are answered by the in-process stub")
+            return StubTransport(StubLLM.from_settings())
+        if self.backend != "openai":
+            raise ValueError(f"Unknown LLM backend {self.backend!r}, expected 'openai' or 'stub'")
+        return None
+    
+    def _create_client(self, api_key: str) -> AsyncOpenAI:
+        """Create an async OpenAI client on the shared connection pool"""
+        return AsyncOpenAI(
+            api_key=api_key,
+            base_url=app_settings.openai_base_url,
+            timeout=self.timeout,
+            max_retries=0,  # retried by the scheduler, which sees every model's budget
+            http_client=self.http_client
+        )
+    
+    async def aclose(self):
+        """Close the shared HTTP connection pool"""
+        await self.http_client.aclose()
+    
     def _save_to_config(self, settings: Dict[str, Any]):
         """Save settings to config file"""
         try:
@@ -92,7 +175,7 @@ class OpenAIService:
         try:
             if "openaiApiKey" in settings:
                 self.api_key = settings["openaiApiKey"]
-                self.client = OpenAI(api_key=self.api_key)
+                self.client = self._create_client(self.api_key)
             
             if "selectedModel" in settings:
                 self.model = settings["selectedModel"]
@@ -128,10 +211,11 @@ class OpenAIService:
             Dict with success status and error message if any
         """
         try:
-            test_client = OpenAI(api_key=api_key)
+            test_client = self._create_client(api_key)
             
             # Try a simple completion to test the connection
-            response = test_client.chat.completions.create(
+            started = time.perf_counter()
+            response = await self.scheduler.run(model, 30, lambda: test_client.chat.completions.create(
                 model=model,
                 messages=[
                     {"role": "system", "content": "You are a helpful assistant."},
@@ -139,7 +223,9 @@ class OpenAIService:
                 ],
                 max_tokens=10,
                 temperature=0.1
-            )
+            ), lane=BACKGROUND)
+            self._meter("connection_test", response.model,
+                        self._usage_dict(response.usage) if response.usage else None, started)
             
             return {
                 "success": True,
@@ -158,7 +244,7 @@ class OpenAIService:
                 "success": False,
                 "error": f"Model '{model}' not found or not accessible"
             }
-        except openai.RateLimitError:
+        except (openai.RateLimitError, RateLimitTimeout):
             return {
                 "success": False,
                 "error": "Rate limit exceeded"
@@ -177,8 +263,10 @@ class OpenAIService:
     async def generate_response(
         self, 
         message: str, 
-        conversation_history: List[Dict[str, str]] = None,
-        functions: List[str] = None
+        conversation_history: List[Turn] = None,
+        functions: List[str] = None,
+        summary: Optional[str] = None,
+        session_id: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Generate AI response for given message
@@ -187,6 +275,8 @@ class OpenAIService:
             message: User message
             conversation_history: Previous messages in conversation
             functions: List of active functions
+            summary: Running summary of turns older than conversation_history
+            session_id: Chat session the usage is recorded for
             
         Returns:
             Dict containing response and metadata
@@ -198,60 +288,393 @@ class OpenAIService:
             }
         
         try:
-            # Build conversation messages
-            messages = [{"role": "system", "content": self.system_prompt}]
+            messages, _ = self._build_messages(message, conversation_history, functions, summary)
             
-            # Add conversation history
-            if conversation_history:
-                for msg in conversation_history[-10:]:  # Keep last 10 messages
-                    messages.append({
-                        "role": msg.get("role", "user"),
-                        "content": msg.get("content", "")
-                    })
+            # Generate response
+            result = await self._complete(messages, self.temperature, self.max_tokens, functions=functions,
+                                          session_id=session_id)
             
-            # Add context about active functions
-            if functions:
-                function_context = f"\n\nActive functions: {', '.join(functions)}"
-                if messages and messages[-1]["role"] == "user":
-                    messages[-1]["content"] += function_context
-                else:
-                    messages.append({"role": "user", "content": message + function_context})
-            else:
-                messages.append({"role": "user", "content": message})
+            return {"success": True, **result}
             
-            # Generate response
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages,
-                temperature=self.temperature,
-                max_tokens=self.max_tokens
+        except (RateLimitTimeout, openai.RateLimitError) as e:
+            logger.warning(f"Response not generated, rate limited: {e}")
+            return self._busy_error()
+        except Exception as e:
+            logger.error(f"Failed to generate response: {e}")
+            return {
+                "success": False,
+                "error": f"Failed to generate response: {str(e)}"
+            }
+    
+    async def generate_response_stream(
+        self, 
+        message: str, 
+        conversation_history: List[Turn] = None,
+        functions: List[str] = None,
+        summary: Optional[str] = None,
+        session_id: Optional[str] = None
+    ) -> AsyncIterator[Dict[str, Any]]:
+        """
+        Generate AI response for given message, yielding text as it arrives
+        
+        Args:
+            message: User message
+            conversation_history: Previous messages in conversation
+            functions: List of active functions
+            summary: Running summary of turns older than conversation_history
+            session_id: Chat session the usage is recorded for
+            
+        Yields:
+            {"type": "delta", "content": ...} for every text fragment, then
+            one final {"type": "end", ...} with the same fields as
+            generate_response (content is the assembled text)
+        """
+        if not self.client:
+            yield {
+                "type": "end",
+                "success": False,
+                "error": "OpenAI client not configured. Please add your API key in settings."
+            }
+            return
+        
+        begun = time.perf_counter()
+        messages, prompt_tokens = self._build_messages(message, conversation_history, functions, summary)
+        decision = self.router.route("chat", self.model, prompt_tokens, self.max_tokens, functions)
+        cache_key = self._cache_key(decision.models[0], messages, self.temperature, self.max_tokens)
+        if cache_key is not None:
+            cached = await self.completion_cache.get(cache_key)
+            if cached is not None:
+                self._meter("chat", cached["model"], None, begun, session_id, cached=True)
+                # Replay the stored completion as a single fragment
+                if cached["content"]:
+                    yield {"type": "delta", "content": cached["content"]}
+                yield {"type": "end", "success": True, **cached}
+                return
+        
+        parts: List[str] = []
+        model = None
+        usage = None
+        finish_reason = None
+        stream = None
+        # Holds the request slot until the stream has been read or closed
+        slot = contextlib.AsyncExitStack()
+        client = self.client
+        estimated = prompt_tokens + self.max_tokens
+        try:
+            # Only opening the stream can fall back; once text has been
+            # sent the reply has to come from the same model
+            for attempt, model in enumerate(decision.models):
+                started = time.perf_counter()
+                try:
+                    stream = await asyncio.wait_for(
+                        slot.enter_async_context(self.scheduler.stream(
+                            model, estimated, lambda model=model: client.chat.completions.create(
+                                model=model,
+                                messages=messages,
+                                temperature=self.temperature,
+                                max_tokens=self.max_tokens,
+                                stream=True,
+                                # Ask for a final usage chunk; servers that ignore it get an estimate
+                                extra_body={"stream_options": {"include_usage": True}}
+                            )
+                        )),
+                        self.router.attempt_timeout
+                    )
+                    break
+                except FALLBACK_ERRORS as e:
+                    self._record_fallback(decision, attempt, model, started, e)
+            requested_model = model
+            async for chunk in stream:
+                model = chunk.model or model
+                chunk_usage = getattr(chunk, "usage", None)
+                if chunk_usage:
+                    usage = self._usage_dict(chunk_usage)
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.finish_reason:
+                    finish_reason = choice.finish_reason
+                if choice.delta and choice.delta.content:
+                    parts.append(choice.delta.content)
+                    yield {"type": "delta", "content": choice.delta.content}
+        except (RateLimitTimeout, openai.RateLimitError) as e:
+            logger.warning(f"Response not streamed, rate limited: {e}")
+            self._meter("chat", model, None, begun, session_id, success=False)
+            yield {"type": "end", **self._busy_error(), "content": "".join(parts)}
+            return
+        except Exception as e:
+            logger.error(f"Failed to stream response: {e}")
+            self._meter("chat", model, None, begun, session_id, success=False)
+            yield {
+                "type": "end",
+                "success": False,
+                "error": f"Failed to generate response: {str(e)}",
+                "content": "".join(parts)
+            }
+            return
+        finally:
+            # Stop the upstream generation if the consumer went away early
+            if stream is not None:
+                await stream.response.aclose()
+            await slot.aclose()
+        
+        result = {
+            "content": "".join(parts),
+            "model": model,
+            "usage": usage or self._estimate_usage(prompt_tokens, "".join(parts)),
+            "finish_reason": finish_reason
+        }
+        self.router.record(decision, requested_model, time.perf_counter() - started)
+        self.scheduler.settle(requested_model, estimated, result["usage"]["total_tokens"])
+        self._meter("chat", model, result["usage"], begun, session_id)
+        if cache_key is not None:
+            await self.completion_cache.set(cache_key, result)
+        yield {"type": "end", "success": True, **result}
+    
+    async def _complete(self, messages: List[Dict[str, str]], temperature: float, max_tokens: int,
+                        model: Optional[str] = None, lane: str = INTERACTIVE, task: str = "chat",
+                        functions: Optional[List[str]] = None, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Run a chat completion on the configured client, through the completion cache
+        
+        The model router picks the model from the task and the prompt, and
+        the next model of its cascade is tried on rate limits and timeouts.
+        Identical requests made while one is in flight share its result
+        (or its error) instead of calling the API again.
+        
+        Returns:
+            Dict with content, model, usage and finish_reason; "cached" is
+            set when the result was served from the cache
+        """
+        begun = time.perf_counter()
+        requested = model or self.model
+        prompt_tokens = sum(count_tokens(msg["content"], requested) + MESSAGE_OVERHEAD_TOKENS for msg in messages)
+        decision = self.router.route(task, requested, prompt_tokens, max_tokens, functions)
+        cache_key = self._cache_key(decision.models[0], messages, temperature, max_tokens)
+        if cache_key is not None:
+            cached = await self.completion_cache.get(cache_key)
+            if cached is not None:
+                self._meter(task, cached["model"], None, begun, session_id, cached=True)
+                return cached
+        
+        request_key = cache_key or self._request_key(decision.models[0], messages, temperature, max_tokens)
+        led = False
+        
+        async def lead():
+            nonlocal led
+            led = True
+            return await self._create_completion(self.client, messages, temperature, max_tokens, decision, cache_key,
+                                                 lane, session_id)
+        
+        try:
+            result = await self.single_flight.do(request_key, lead)
+        except Exception:
+            if not led:
+                self._meter(decision.task, None, None, begun, session_id, success=False)
+            raise
+        if not led:
+            # The leader metered the upstream call for its session; callers that
+            # joined it are metered for theirs, with the shared usage at no cost
+            self._meter(decision.task, result["model"], result["usage"], begun, session_id, cached=True)
+        # Every caller of the flight gets its own copy
+        return copy.deepcopy(result)
+    
+    async def _create_completion(self, client: AsyncOpenAI, messages: List[Dict[str, str]], temperature: float,
+                                 max_tokens: int, decision: RouteDecision, cache_key: Optional[str],
+                                 lane: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+        begun = time.perf_counter()
+        estimated = decision.prompt_tokens + max_tokens
+        
+        async def send(model: str):
+            sent = None
+            
+            def create():
+                nonlocal sent
+                sent = time.perf_counter()
+                return client.chat.completions.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                )
+            
+            try:
+                return await asyncio.wait_for(self.scheduler.run(model, estimated, create, lane=lane),
+                                              self.router.attempt_timeout)
+            except asyncio.CancelledError:
+                if sent is not None:
+                    # Abandoned after it was sent (a hedge that lost, a closed
+                    # request): the prompt was spent, the completion was not
+                    self.scheduler.settle(model, estimated, decision.prompt_tokens)
+                    self._meter(decision.task, model, {"prompt_tokens": decision.prompt_tokens}, sent, session_id,
+                                success=False)
+                raise
+        
+        hedged = self.hedger is not None and self.hedger.enabled and lane == INTERACTIVE and decision.task == "chat"
+        try:
+            for attempt, model in enumerate(decision.models):
+                started = time.perf_counter()
+                latency = None
+                try:
+                    if hedged:
+                        response, model, latency = await self.hedger.run(model, decision.models[attempt + 1:], send)
+                    else:
+                        response = await send(model)
+                    break
+                except FALLBACK_ERRORS as e:
+                    self._record_fallback(decision, attempt, model, started, e)
+        except Exception:
+            self._meter(decision.task, model, None, begun, session_id, success=False)
+            raise
+        # A hedge that won is timed from when it was sent
+        self.router.record(decision, model, latency if latency is not None else time.perf_counter() - started)
+        self.scheduler.settle(model, estimated, response.usage.total_tokens if response.usage else None)
+        result = {
+            "content": response.choices[0].message.content,
+            "model": response.model,
+            "usage": self._usage_dict(response.usage) if response.usage else None,
+            "finish_reason": response.choices[0].finish_reason
+        }
+        self._meter(decision.task, result["model"], result["usage"], begun, session_id)
+        if cache_key is not None and result["content"] is not None:
+            await self.completion_cache.set(cache_key, result)
+        return result
+    
+    def _meter(self, task: str, model: Optional[str], usage: Optional[Dict[str, Any]], started: float,
+               session_id: Optional[str] = None, cached: bool = False, success: bool = True):
+        """Record a call in the usage ledger"""
+        if self.ledger is not None:
+            self.ledger.record(task, model, usage, time.perf_counter() - started, session_id=session_id,
+                               cached=cached, success=success)
+    
+    def _record_fallback(self, decision: RouteDecision, attempt: int, model: str, started: float, error: Exception):
+        """Record a failed attempt; re-raises the error if no model is left to fall back to"""
+        self.router.record(decision, model, time.perf_counter() - started, error)
+        if attempt == len(decision.models) - 1:
+            raise error
+        logger.warning(f"{model} failed ({error.__class__.__name__}), falling back to {decision.models[attempt + 1]}")
+    
+    @staticmethod
+    def _busy_error() -> Dict[str, Any]:
+        return {
+            "success": False,
+            "error": "The AI service is busy right now, please try again in a moment.",
+            "retryable": True
+        }
+    
+    def _cache_key(self, model: str, messages: List[Dict[str, str]], temperature: float,
+                   max_tokens: int) -> Optional[str]:
+        """Completion cache key of a request, or None if it must not be cached"""
+        cache = self.completion_cache
+        if cache is None or not cache.enabled:
+            return None
+        if not cache.is_cacheable(temperature):
+            cache.record_bypass()
+            return None
+        return self._request_key(model, messages, temperature, max_tokens)
+    
+    def _request_key(self, model: str, messages: List[Dict[str, str]], temperature: float,
+                     max_tokens: int) -> str:
+        """Canonical hash identifying a completion request"""
+        # Different keys may belong to different accounts or fine-tunes
+        scope = sha256((self.api_key or "").encode("utf-8")).hexdigest()[:16]
+        return CompletionCache.make_key(model, messages, temperature, max_tokens, scope)
+    
+    def _build_messages(self, message: str, conversation_history: List[Turn] = None,
+                        functions: List[str] = None, summary: Optional[str] = None
+                        ) -> Tuple[List[Dict[str, str]], int]:
+        """Build the chat completion messages within the model's token budget"""
+        return build_context(
+            system_prompt=self.system_prompt,
+            message=message,
+            conversation_history=conversation_history,
+            functions=functions,
+            model=self.model,
+            max_tokens=self.max_tokens,
+            summary=summary,
+            history_tokens=app_settings.chat_context_history_tokens
+        )
+    
+    @staticmethod
+    def _usage_dict(usage: Any) -> Dict[str, int]:
+        # Usage arrives as a model or, on older clients, as a plain dict
+        if not isinstance(usage, dict):
+            usage = usage.model_dump()
+        return {
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "total_tokens": usage.get("total_tokens", 0)
+        }
+    
+    def _estimate_usage(self, prompt_tokens: int, completion: str) -> Dict[str, Any]:
+        """Usage counted locally when the server reports none"""
+        completion_tokens = count_tokens(completion, self.model)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "estimated": True
+        }
+    
+    async def summarize_conversation(self, previous_summary: Optional[str], messages: List[Dict[str, str]],
+                                     max_tokens: int = 400, session_id: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Fold conversation turns into a running summary
+        
+        Args:
+            previous_summary: Summary of everything before messages, if any
+            messages: Turns to fold in, as {"role", "content"} dicts
+            max_tokens: Maximum length of the new summary
+            session_id: Chat session the usage is recorded for
+            
+        Returns:
+            Dict containing the new summary and usage
+        """
+        if not self.client:
+            return {
+                "success": False,
+                "error": "OpenAI client not configured. Please add your API key in settings."
+            }
+        
+        try:
+            # Long pasted messages only need their gist
+            transcript = "\n".join(
+                f"{msg.get('role', 'user')}: {truncate_to_tokens(msg.get('content', ''), 1000, self.model)}"
+                for msg in messages
             )
+            summary_prompt = f"""Update the running summary of a conversation between a user and an AI assistant.
+
+Current summary:
+{previous_summary or "(none yet)"}
+
+New messages:
+{transcript}
+
+Write the updated summary in the language of the conversation. Keep facts, decisions, names, open questions and user preferences; drop small talk. Respond with the summary only."""
+            
+            result = await self._complete([{"role": "user", "content": summary_prompt}], 0.2, max_tokens,
+                                          lane=BACKGROUND, task="summary", session_id=session_id)
             
             return {
                 "success": True,
-                "content": response.choices[0].message.content,
-                "model": response.model,
-                "usage": {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                } if response.usage else None,
-                "finish_reason": response.choices[0].finish_reason
+                "summary": result["content"].strip(),
+                "usage": result["usage"]
             }
             
         except Exception as e:
-            logger.error(f"Failed to generate response: {e}")
+            logger.error(f"Failed to summarize conversation: {e}")
             return {
                 "success": False,
-                "error": f"Failed to generate response: {str(e)}"
+                "error": f"Failed to summarize conversation: {str(e)}"
             }
     
-    async def generate_chat_title(self, first_message: str) -> Dict[str, Any]:
+    async def generate_chat_title(self, first_message: str, session_id: Optional[str] = None) -> Dict[str, Any]:
         """
         Generate a concise chat title based on the first user message
         
         Args:
             first_message: The first user message in the conversation
+            session_id: Chat session the usage is recorded for
             
         Returns:
             Dict containing the generated title and metadata
@@ -274,16 +697,16 @@ User message: "{first_message}"
 
 Please respond with only the title, nothing else."""
 
-            response = self.client.chat.completions.create(
-                model="gpt-3.5-turbo",  # Use faster model for title generation
-                messages=[
-                    {"role": "user", "content": title_prompt}
-                ],
+            result = await self._complete(
+                [{"role": "user", "content": title_prompt}],
                 temperature=0.3,  # Lower temperature for more consistent titles
-                max_tokens=20
+                max_tokens=20,
+                lane=BACKGROUND,
+                task="title",  # routed to the cheapest model
+                session_id=session_id
             )
             
-            title = response.choices[0].message.content.strip()
+            title = result["content"].strip()
             
             # Clean up the title (remove quotes if any)
             title = title.strip('"').strip("'").strip()
@@ -291,11 +714,7 @@ Please respond with only the title, nothing else."""
             return {
                 "success": True,
                 "title": title,
-                "usage": {
-                    "prompt_tokens": response.usage.prompt_tokens,
-                    "completion_tokens": response.usage.completion_tokens,
-                    "total_tokens": response.usage.total_tokens
-                } if response.usage else None
+                "usage": result["usage"]
             }
             
         except Exception as e:
@@ -306,9 +725,9 @@ Please respond with only the title, nothing else."""
                 "title": f"Chat {first_message[:20]}..."  # Fallback title
             }
     
-    def get_available_models(self) -> List[Dict[str, str]]:
+    def get_available_models(self) -> List[Dict[str, Any]]:
         """Get list of available OpenAI models"""
-        return [
+        models = [
             {
                 "id": "gpt-3.5-turbo",
                 "name": "GPT-3.5 Turbo",
@@ -335,6 +754,9 @@ Please respond with only the title, nothing else."""
                 "description": "Faster and more affordable"
             }
         ]
+        for model in models:
+            model["context_window"] = get_context_window(model["id"])
+        return models
     
     def is_configured(self) -> bool:
         """Check if OpenAI service is properly configured"""
@@ -0,0 +1,140 @@
+"""
+Keyset (cursor) pagination helpers for SQLAlchemy queries
+"""
+import base64
+import json
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import String, asc, desc, tuple_, type_coerce
+from sqlalchemy.orm import Query
+
+class InvalidCursorError(ValueError):
+    """Raised when a pagination cursor cannot be decoded"""
+
+# Cursor directions, relative to the natural order of the list
+NEXT = "next"
+PREV = "prev"
+
+def encode_cursor(direction: str, key: Sequence[Any]) -> str:
+    """Encode a position in a list as an opaque URL-safe token"""
+    payload = json.dumps({"d": direction, "k": list(key)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[str, List[Any]]:
+    """Decode a token produced by encode_cursor into (direction, key)"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        direction, key = payload["d"], payload["k"]
+    except (ValueError, KeyError, TypeError) as e:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}") from e
+    if direction not in (NEXT, PREV) or not isinstance(key, list):
+        raise InvalidCursorError(f"Invalid cursor: {cursor}")
+    return direction, key
+
+def keyset_paginate(query: Query, key_columns: Sequence, limit: int, cursor: Optional[str] = None,
+                    from_end: bool = False, descending: bool = False
+                    ) -> Tuple[List[Any], Optional[str], Optional[str]]:
+    """
+    Fetch one page of a query ordered by a unique composite key
+    
+    Instead of OFFSET, the page starts right after (or before) the key of
+    the last row the client has seen, so every page costs the same index
+    seek however deep into the list it is.
+    
+    Args:
+        query: Query returning the page rows
+        key_columns: Columns forming a unique sort key, e.g. (timestamp, id)
+        limit: Maximum number of rows in the page
+        cursor: Opaque cursor from a previous page, or None for the first page
+        from_end: Without a cursor, start at the end of the list instead of the beginning
+        descending: Whether the natural order of the list is descending
+    
+    Returns:
+        Tuple of (rows in natural order, next cursor, prev cursor); the row
+        tuples are those of the query, and cursors are None at either end
+    """
+    if cursor:
+        direction, key = decode_cursor(cursor)
+        if len(key) != len(key_columns):
+            raise InvalidCursorError(f"Invalid cursor: {cursor}")
+    else:
+        direction, key = (PREV if from_end else NEXT), None
+    backwards = direction == PREV
+    
+    # Compare on the stored representation so keys round-trip exactly
+    # (e.g. DateTime values with and without fractional seconds)
+    raw_columns = [type_coerce(column, String) for column in key_columns]
+    
+    if key is not None:
+        row_key = tuple_(*raw_columns)
+        cursor_key = tuple_(*[type_coerce(value, String) for value in key])
+        query = query.filter(row_key < cursor_key if backwards != descending else row_key > cursor_key)
+    
+    order = asc if backwards == descending else desc
+    rows = (query.add_columns(*raw_columns)
+            .order_by(*[order(column) for column in key_columns])
+            .limit(limit + 1)
+            .all())
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if backwards:
+        rows.reverse()
+    
+    width = len(key_columns)
+    page = [tuple(row[:-width]) if len(row) - width > 1 else row[0] for row in rows]
+    first_key = list(rows[0][-width:]) if rows else None
+    last_key = list(rows[-1][-width:]) if rows else None
+    
+    next_cursor = prev_cursor = None
+    if rows:
+        if (has_more and not backwards) or (backwards and key is not None):
+            next_cursor = encode_cursor(NEXT, last_key)
+        if (has_more and backwards) or (not backwards and key is not None):
+            prev_cursor = encode_cursor(PREV, first_key)
+    elif key is not None:
+        # Ran past the end; let the client turn around from the same position
+        if backwards:
+            next_cursor = encode_cursor(NEXT, key)
+        else:
+            prev_cursor = encode_cursor(PREV, key)
+    
+    return page, next_cursor, prev_cursor
+
+def keyset_tail(query: Query, key_columns: Sequence, limit: int, cursor: Optional[str] = None
+                ) -> Tuple[List[Any], Optional[str]]:
+    """
+    Fetch the rows added after a cursor, to follow a growing list
+    
+    Without a cursor the last limit rows are returned. When more than limit
+    rows were added since the cursor, only the newest limit are returned.
+    
+    Args:
+        query: Query returning the rows
+        key_columns: Columns forming a unique ascending sort key, e.g. (timestamp, id)
+        limit: Maximum number of rows returned
+        cursor: Cursor returned by a previous call, or None
+    
+    Returns:
+        Tuple of (rows in ascending order, cursor after the newest row); the
+        cursor is returned unchanged when there are no new rows
+    """
+    raw_columns = [type_coerce(column, String) for column in key_columns]
+    if cursor:
+        direction, key = decode_cursor(cursor)
+        if direction != NEXT or len(key) != len(key_columns):
+            raise InvalidCursorError(f"Invalid cursor: {cursor}")
+        query = query.filter(tuple_(*raw_columns) > tuple_(*[type_coerce(value, String) for value in key]))
+    
+    rows = (query.add_columns(*raw_columns)
+            .order_by(*[desc(column) for column in key_columns])
+            .limit(limit)
+            .all())
+    rows.reverse()
+    
+    width = len(key_columns)
+    page = [tuple(row[:-width]) if len(row) - width > 1 else row[0] for row in rows]
+    if rows:
+        cursor = encode_cursor(NEXT, list(rows[-1][-width:]))
+    return page, cursor
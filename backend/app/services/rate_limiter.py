@@ -0,0 +1,375 @@
+"""
+Request scheduler that keeps LLM calls within rate limits
+"""
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, Optional, Tuple
+import asyncio
+import logging
+import random
+import time
+
+import openai
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class RateLimitTimeout(Exception):
+    """The request could not be started before its deadline"""
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously at rate_per_minute
+    
+    reserve() always takes the amount and lets the level go negative, so
+    each caller gets the time at which its share is available and callers
+    are served in the order they reserved.
+    """
+    
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def reserve(self, amount: float) -> float:
+        """Take amount from the bucket; returns the seconds until it is available"""
+        self._refill()
+        # A single request larger than the bucket would otherwise never fit
+        self.level -= min(amount, self.capacity)
+        return max(-self.level / self.rate, 0.0)
+    
+    def refund(self, amount: float):
+        """Give back (part of) an earlier reservation"""
+        self._refill()
+        self.level = min(self.capacity, self.level + min(amount, self.capacity))
+
+@dataclass
+class ModelBudget:
+    requests: Optional[TokenBucket]
+    tokens: Optional[TokenBucket]
+    paused_until: float = 0.0  # monotonic time before which no request starts
+    stats: Dict[str, int] = field(default_factory=lambda: {
+        "requests": 0, "rate_limited": 0, "retries": 0, "timeouts": 0, "failures": 0
+    })
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+LANES = (INTERACTIVE, BACKGROUND)
+
+class LanePool:
+    """
+    Concurrency slots shared by an interactive and a background lane
+    
+    A free slot goes to the oldest interactive waiter first, so live turns
+    overtake queued background work. Background requests may hold at most
+    background_share of the slots, leaving the rest for interactive ones,
+    and a background request that has waited max_background_wait seconds
+    is served before new interactive ones so it cannot starve. A slot is
+    held for the whole request, including reading a streamed reply, and
+    stats() reports the slot-seconds each lane actually held.
+    """
+    
+    def __init__(self, size: int, background_share: float = 0.25, max_background_wait: float = 5.0):
+        self.size = size
+        self.background_limit = max(1, int(size * background_share))
+        self.max_background_wait = max_background_wait
+        self.running = {lane: 0 for lane in LANES}
+        self.waiters: Dict[str, Deque[Tuple[asyncio.Future, float]]] = {lane: deque() for lane in LANES}
+        self.granted = {lane: 0 for lane in LANES}
+        self.wait_time = {lane: 0.0 for lane in LANES}
+        self.max_wait = {lane: 0.0 for lane in LANES}
+        # Slot-seconds held per lane, i.e. how the capacity was actually shared
+        self.busy_time = {lane: 0.0 for lane in LANES}
+        self._counted = time.monotonic()
+    
+    def _count_busy(self):
+        now = time.monotonic()
+        for lane in LANES:
+            self.busy_time[lane] += self.running[lane] * (now - self._counted)
+        self._counted = now
+    
+    def _has_room(self, lane: str) -> bool:
+        if sum(self.running.values()) >= self.size:
+            return False
+        return lane == INTERACTIVE or self.running[BACKGROUND] < self.background_limit
+    
+    def _grant(self, lane: str, since: float):
+        waited = time.monotonic() - since
+        self._count_busy()
+        self.running[lane] += 1
+        self.granted[lane] += 1
+        self.wait_time[lane] += waited
+        self.max_wait[lane] = max(self.max_wait[lane], waited)
+    
+    def _next_lane(self) -> Optional[str]:
+        background = self.waiters[BACKGROUND]
+        if background and self._has_room(BACKGROUND):
+            aged = time.monotonic() - background[0][1] >= self.max_background_wait
+            if aged or not self.waiters[INTERACTIVE]:
+                return BACKGROUND
+        if self.waiters[INTERACTIVE] and self._has_room(INTERACTIVE):
+            return INTERACTIVE
+        return None
+    
+    def _dispatch(self):
+        while True:
+            lane = self._next_lane()
+            if lane is None:
+                return
+            future, since = self.waiters[lane].popleft()
+            if future.done():
+                continue  # gave up waiting
+            self._grant(lane, since)
+            future.set_result(None)
+    
+    async def acquire(self, lane: str, timeout: float):
+        """Wait for a slot in lane; raises asyncio.TimeoutError after timeout seconds"""
+        now = time.monotonic()
+        if not any(self.waiters.values()) and self._has_room(lane):
+            self._grant(lane, now)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self.waiters[lane].append((future, now))
+        self._dispatch()
+        try:
+            await asyncio.wait_for(future, timeout)
+        except BaseException:
+            if future.done() and not future.cancelled():
+                self.release(lane)  # granted just as we gave up
+            else:
+                future.cancel()
+                self.waiters[lane] = deque(item for item in self.waiters[lane] if item[0] is not future)
+            raise
+    
+    def release(self, lane: str):
+        self._count_busy()
+        self.running[lane] -= 1
+        self._dispatch()
+    
+    def stats(self) -> Dict[str, Any]:
+        """Running requests, queue depth and wait times per lane"""
+        # Aged background waiters only get a slot once one is released
+        self._dispatch()
+        self._count_busy()
+        busy = sum(self.busy_time.values())
+        return {
+            lane: {
+                "running": self.running[lane],
+                "queued": sum(1 for future, _ in self.waiters[lane] if not future.done()),
+                "limit": self.size if lane == INTERACTIVE else self.background_limit,
+                "granted": self.granted[lane],
+                "avg_wait": round(self.wait_time[lane] / self.granted[lane], 3) if self.granted[lane] else 0.0,
+                "max_wait": round(self.max_wait[lane], 3),
+                "slot_seconds": round(self.busy_time[lane], 1),
+                "slot_share": round(self.busy_time[lane] / busy, 3) if busy else 0.0
+            }
+            for lane in LANES
+        }
+
+class RequestScheduler:
+    """
+    Queue, pace and retry LLM requests
+    
+    Every request first waits for one of max_concurrency slots in its
+    lane (see LanePool), then for
+    its model's request and token budgets (token buckets refilled at the
+    per-minute limits), and is started once both allow it. Requests that
+    cannot start before their deadline fail with RateLimitTimeout instead
+    of piling up. Rate-limit and server errors are retried with
+    exponential backoff and full jitter, honouring the Retry-After the
+    server sends; a 429 also pauses the whole model so the other queued
+    requests back off with it. With several worker processes, each paces
+    itself to budget_share of the limits.
+    """
+    
+    RETRYABLE_ERRORS = (openai.RateLimitError, openai.InternalServerError, openai.APIConnectionError)
+    
+    def __init__(self, max_concurrency: int = 16, requests_per_minute: int = 500, tokens_per_minute: int = 200000,
+                 model_limits: Optional[Dict[str, Dict[str, int]]] = None, queue_timeout: float = 30.0,
+                 max_retries: int = 2, backoff_base: float = 0.5, backoff_max: float = 20.0,
+                 background_share: float = 0.25, max_background_wait: float = 5.0, budget_share: float = 1.0):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.model_limits = model_limits or {}
+        self.budget_share = budget_share
+        self.queue_timeout = queue_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.budgets: Dict[str, ModelBudget] = {}
+        self.lanes = LanePool(max_concurrency, background_share, max_background_wait)
+        self.queue_time = 0.0
+    
+    def _budget(self, model: str) -> ModelBudget:
+        budget = self.budgets.get(model)
+        if budget is None:
+            limits = self.model_limits.get(model, {})
+            rpm = limits.get("rpm", self.requests_per_minute) * self.budget_share
+            tpm = limits.get("tpm", self.tokens_per_minute) * self.budget_share
+            budget = self.budgets[model] = ModelBudget(
+                requests=TokenBucket(rpm) if rpm else None,
+                tokens=TokenBucket(tpm) if tpm else None
+            )
+        return budget
+    
+    async def run(self, model: str, tokens: int, call: Callable[[], Awaitable[Any]],
+                  timeout: Optional[float] = None, lane: str = INTERACTIVE) -> Any:
+        """
+        Await call() once the model's budgets allow it
+        
+        Args:
+            model: Model the request is for
+            tokens: Estimated tokens of the request (prompt + max completion)
+            call: Coroutine function making the request; called again on retries
+            timeout: Seconds the request may wait to start, queue_timeout by default
+            lane: INTERACTIVE for live user turns, BACKGROUND for work nobody waits on
+        
+        Returns:
+            The result of call()
+        
+        Raises:
+            RateLimitTimeout: if the request cannot start before its deadline
+        """
+        async with self.stream(model, tokens, call, timeout, lane) as result:
+            return result
+    
+    @asynccontextmanager
+    async def stream(self, model: str, tokens: int, call: Callable[[], Awaitable[Any]],
+                     timeout: Optional[float] = None, lane: str = INTERACTIVE) -> AsyncIterator[Any]:
+        """
+        Like run(), but the request slot is held until the block exits
+        
+        For calls that return a stream: the slot stays taken while the body
+        is read, so streamed replies count against max_concurrency too.
+        """
+        budget = self._budget(model)
+        deadline = time.monotonic() + (self.queue_timeout if timeout is None else timeout)
+        budget.stats["requests"] += 1
+        queued = time.monotonic()
+        
+        try:
+            await self.lanes.acquire(lane, max(deadline - time.monotonic(), 0))
+        except asyncio.TimeoutError:
+            budget.stats["timeouts"] += 1
+            raise RateLimitTimeout(f"No free {lane} request slot for {model} within the queue timeout")
+        
+        try:
+            yield await self._call(model, budget, tokens, call, deadline, queued)
+        finally:
+            self.lanes.release(lane)
+    
+    async def _call(self, model: str, budget: ModelBudget, tokens: int, call: Callable[[], Awaitable[Any]],
+                    deadline: float, queued: float) -> Any:
+        attempt = 0
+        while True:
+            await self._wait_for_budget(model, budget, tokens, deadline)
+            if attempt == 0:
+                self.queue_time += time.monotonic() - queued
+            try:
+                return await call()
+            except self.RETRYABLE_ERRORS as e:
+                # The rejected attempt used no tokens; the retry reserves its own.
+                # The request itself still counts against the request budget.
+                if budget.tokens is not None:
+                    budget.tokens.refund(tokens)
+                delay = self._backoff(attempt, e)
+                if isinstance(e, openai.RateLimitError):
+                    budget.stats["rate_limited"] += 1
+                    # Everyone queued for this model waits with us
+                    budget.paused_until = max(budget.paused_until, time.monotonic() + delay)
+                if attempt >= self.max_retries or time.monotonic() + delay > deadline:
+                    budget.stats["failures"] += 1
+                    raise
+                attempt += 1
+                budget.stats["retries"] += 1
+                logger.warning(f"{model} request failed ({e.__class__.__name__}), retry {attempt} in {delay:.2f}s")
+                if not isinstance(e, openai.RateLimitError):
+                    await asyncio.sleep(delay)  # rate limits wait out the model pause instead
+    
+    async def _wait_for_budget(self, model: str, budget: ModelBudget, tokens: int, deadline: float):
+        wait = max(budget.paused_until - time.monotonic(), 0.0)
+        reserved = []
+        for bucket, amount in ((budget.requests, 1), (budget.tokens, tokens)):
+            if bucket is not None:
+                wait = max(wait, bucket.reserve(amount))
+                reserved.append((bucket, amount))
+        if time.monotonic() + wait > deadline:
+            for bucket, amount in reserved:
+                bucket.refund(amount)
+            budget.stats["timeouts"] += 1
+            raise RateLimitTimeout(f"Rate limit budget for {model} exhausted for the next {wait:.1f}s")
+        if wait > 0:
+            try:
+                await asyncio.sleep(wait)
+            except asyncio.CancelledError:
+                # Never sent; give the budget back to the requests still queued
+                for bucket, amount in reserved:
+                    bucket.refund(amount)
+                raise
+    
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        """Seconds to wait before retrying: Retry-After if given, else jittered exponential"""
+        response = getattr(error, "response", None)
+        headers = response.headers if response is not None else {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            pass  # an HTTP date; fall back to our own backoff
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+    
+    def settle(self, model: str, estimated: int, used: Optional[int]):
+        """Return the part of a token reservation the request did not use"""
+        budget = self.budgets.get(model)
+        if budget is not None and budget.tokens is not None and used is not None and used < estimated:
+            budget.tokens.refund(estimated - used)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Queue and budget state per model"""
+        models = {}
+        for model, budget in self.budgets.items():
+            for bucket in (budget.requests, budget.tokens):
+                if bucket is not None:
+                    bucket._refill()
+            models[model] = {
+                **budget.stats,
+                "requests_available": round(budget.requests.level, 1) if budget.requests else None,
+                "tokens_available": round(budget.tokens.level) if budget.tokens else None,
+                "paused_for": round(max(budget.paused_until - time.monotonic(), 0.0), 2)
+            }
+        started = sum(budget.stats["requests"] - budget.stats["timeouts"] for budget in self.budgets.values())
+        lanes = self.lanes.stats()
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": sum(lane["running"] for lane in lanes.values()),
+            "waiting": sum(lane["queued"] for lane in lanes.values()),
+            "lanes": lanes,
+            "avg_queue_time": round(self.queue_time / started, 3) if started > 0 else 0.0,
+            "models": models
+        }
+
+# Global scheduler instance
+request_scheduler = RequestScheduler(
+    max_concurrency=settings.openai_max_concurrency,
+    requests_per_minute=settings.openai_requests_per_minute,
+    tokens_per_minute=settings.openai_tokens_per_minute,
+    model_limits=settings.openai_model_limits,
+    queue_timeout=settings.openai_queue_timeout,
+    max_retries=settings.openai_max_retries,
+    backoff_base=settings.openai_backoff_base,
+    backoff_max=settings.openai_backoff_max,
+    background_share=settings.openai_background_share,
+    max_background_wait=settings.openai_background_max_wait,
+    budget_share=1 / max(settings.workers, 1)
+)
@@ -0,0 +1,69 @@
+"""
+Single-flight coalescing of identical concurrent calls
+"""
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+class SingleFlight:
+    """
+    Run at most one call per key at a time
+    
+    Callers that ask for a key while a call for it is in flight await that
+    call instead of starting their own, and get the same result or the same
+    exception. The key is released as soon as the call finishes, so a
+    failure is never remembered: the next caller starts a fresh call.
+    
+    The call runs in its own task, so a caller that is cancelled (e.g. a
+    closed request) does not cancel it for the others still waiting.
+    """
+    
+    def __init__(self, name: str = "single-flight"):
+        self.name = name
+        self._calls: Dict[str, asyncio.Task] = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.failures = 0
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Await fn(), or the in-flight call for the same key
+        
+        Args:
+            key: Identity of the call; equal keys must mean equal results
+            fn: Coroutine function making the actual call
+        
+        Returns:
+            The call's result, shared by every caller of the flight
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+    
+    def _finish(self, key: str, task: asyncio.Task):
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Retrieve the exception so it is not reported as unhandled when
+        # every caller was cancelled
+        if not task.cancelled() and task.exception() is not None:
+            self.failures += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        """Number of calls made and of callers that joined one in flight"""
+        requested = self.calls + self.coalesced
+        return {
+            "name": self.name,
+            "in_flight": len(self._calls),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "failures": self.failures,
+            "coalesced_ratio": round(self.coalesced / requested, 3) if requested else 0.0
+        }
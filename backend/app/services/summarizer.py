@@ -0,0 +1,172 @@
+"""
+Rolling conversation summaries that keep long-session prompts bounded
+"""
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import logging
+
+from ..core.config import settings
+from .chat_database_service import chat_db_service
+from .openai_service import openai_service
+from .turns import Turn
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class SummaryState:
+    text: str = ""
+    upto: int = 0  # history entries folded into text
+    trimmed: int = 0  # entries dropped from the front of the history
+    turns: int = 0  # messages summarized over the session's lifetime
+    loaded: bool = False
+
+class ConversationSummarizer:
+    """
+    Fold older turns of a session into a running summary
+    
+    The prompt is built from the summary plus the history entries after
+    it, so its size stays roughly constant however long the session gets.
+    Once interval new messages have accumulated beyond the keep_recent
+    newest ones, they are folded into the summary by a background task,
+    and the result is merged into the session's extra_data["summary"]
+    together with the id and time of the last message it covers, so a
+    history loaded later skips the messages already folded in.
+    """
+    
+    def __init__(self, enabled: bool = True, interval: int = 8, keep_recent: int = 6, max_tokens: int = 400):
+        self.enabled = enabled
+        self.interval = max(interval, 1)
+        self.keep_recent = max(keep_recent, 0)
+        self.max_tokens = max_tokens
+        self.states: Dict[str, SummaryState] = {}
+        # Running refresh per session; at most one at a time
+        self._tasks: Dict[str, asyncio.Task] = {}
+    
+    async def get_context(self, session_id: Optional[str],
+                          history: List[Turn]) -> Tuple[Optional[str], List[Turn]]:
+        """
+        Split a session's history for prompting
+        
+        Returns:
+            Tuple of (summary text or None, history entries not yet summarized)
+        """
+        if not self.enabled or not session_id:
+            return None, history
+        state = await self._load(session_id, history)
+        return (state.text or None), history[state.upto:]
+    
+    def schedule(self, session_id: Optional[str], history: List[Turn]):
+        """Start a background refresh if enough unsummarized turns have accumulated"""
+        if not self.enabled or not session_id:
+            return
+        state = self.states.get(session_id)
+        if state is None or not state.loaded:
+            return
+        running = self._tasks.get(session_id)
+        if running is not None and not running.done():
+            return
+        
+        end = len(history) - self.keep_recent
+        if end - state.upto < self.interval:
+            return
+        turns = [turn.to_message() for turn in history[state.upto:end]]
+        task = asyncio.create_task(self._refresh(session_id, state, history, turns, end, state.trimmed,
+                                                 history[end - 1]))
+        self._tasks[session_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(session_id, None))
+    
+    def trim(self, session_id: str, count: int):
+        """Follow count entries being dropped from the front of a session's history"""
+        state = self.states.get(session_id)
+        if state is not None:
+            state.upto = max(state.upto - count, 0)
+            state.trimmed += count
+    
+    def truncate(self, session_id: str, length: int):
+        """Follow entries being dropped from the end of a session's history, leaving length"""
+        state = self.states.get(session_id)
+        if state is not None:
+            state.upto = min(state.upto, length)
+    
+    def forget(self, session_id: str):
+        """Drop the in-memory state of a session (e.g. when its history is cleared or evicted)"""
+        self.states.pop(session_id, None)
+    
+    async def drain(self):
+        """Wait for running refreshes, e.g. before shutdown"""
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+    
+    async def _load(self, session_id: str, history: List[Turn]) -> SummaryState:
+        state = self.states.get(session_id)
+        if state is None:
+            state = self.states[session_id] = SummaryState()
+        if not state.loaded:
+            # A summary persisted earlier (by another process, or before the
+            # history was evicted) covers the turns up to its boundary
+            chat_session = await chat_db_service.get_session_async(session_id)
+            stored = ((chat_session.extra_data or {}).get("summary") if chat_session else None) or {}
+            if stored.get("text") and not state.text:
+                state.text = stored["text"]
+                state.turns = stored.get("turns", 0)
+                state.upto = self._covered(history, stored.get("upto_id"), stored.get("upto_created"))
+            state.loaded = True
+        return state
+    
+    @staticmethod
+    def _covered(history: List[Turn], upto_id: Optional[str], upto_created: Optional[int]) -> int:
+        """Number of leading history entries a stored summary already covers"""
+        if upto_id is not None:
+            for index in range(len(history) - 1, -1, -1):
+                if history[index].id == upto_id:
+                    return index + 1
+        if upto_created is None:
+            return 0
+        # The boundary message is not in the history (older than the loaded
+        # window, or never stored); fall back to its time
+        covered = 0
+        for index, turn in enumerate(history):
+            if turn.created > upto_created:
+                break
+            covered = index + 1
+        return covered
+    
+    async def _refresh(self, session_id: str, state: SummaryState, history: List[Turn], turns: List[Dict[str, str]],
+                       end: int, trimmed: int, last: Turn):
+        try:
+            result = await openai_service.summarize_conversation(state.text or None, turns, self.max_tokens,
+                                                                 session_id=session_id)
+            if not result["success"]:
+                logger.warning(f"Summary refresh for session {session_id} failed: {result.get('error')}")
+                return
+            if self.states.get(session_id) is not state:
+                return  # forgotten meanwhile
+            
+            state.text = result["summary"]
+            # end is a position in the history as it was when the refresh started;
+            # entries may have been trimmed from its front or dropped from its end since
+            state.upto = min(max(end - (state.trimmed - trimmed), 0), len(history))
+            state.turns += len(turns)
+            await chat_db_service.update_session_metadata_async(session_id, {
+                "summary": {
+                    "text": state.text,
+                    "turns": state.turns,
+                    "upto_id": last.id,
+                    "upto_created": last.created,
+                    "updated_at": datetime.utcnow().isoformat(),
+                    "usage": result.get("usage")
+                }
+            })
+            logger.info(f"Summarized {len(turns)} messages of session {session_id}")
+        except Exception as e:
+            logger.error(f"Summary refresh for session {session_id} failed: {e}")
+
+# Global summarizer instance
+conversation_summarizer = ConversationSummarizer(
+    enabled=settings.chat_summary_enabled,
+    interval=settings.chat_summary_interval,
+    keep_recent=settings.chat_summary_keep_recent,
+    max_tokens=settings.chat_summary_max_tokens
+)
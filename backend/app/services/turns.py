@@ -0,0 +1,84 @@
+"""
+Compact in-memory records of conversation turns
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+import calendar
+import sys
+import time
+
+USER = sys.intern("user")
+ASSISTANT = sys.intern("assistant")
+
+# Shared by every turn without active functions
+NO_FUNCTIONS = ()
+
+class Turn:
+    """
+    One entry of a conversation history, kept small
+    
+    Slotted rather than a dict: the role and model are interned strings,
+    the timestamp is whole epoch seconds, functions a tuple (the shared
+    empty one when there are none) and usage only its two token counts.
+    The message dict of the completion API is built when a prompt needs
+    it, not stored.
+    """
+    
+    __slots__ = ("role", "content", "created", "functions", "model", "prompt_tokens", "completion_tokens",
+                 "id", "token_count", "token_encoding")
+    
+    def __init__(self, role: str, content: str, created: Optional[int] = None, functions: Iterable[str] = NO_FUNCTIONS,
+                 model: Optional[str] = None, usage: Optional[Dict[str, Any]] = None, id: Optional[str] = None):
+        self.role = sys.intern(role)
+        self.content = content
+        self.created = int(time.time()) if created is None else created
+        self.functions = tuple(functions) if functions else NO_FUNCTIONS
+        self.model = sys.intern(model) if model else None
+        self.prompt_tokens = usage.get("prompt_tokens", 0) if usage else 0
+        self.completion_tokens = usage.get("completion_tokens", 0) if usage else 0
+        self.id = id  # id of the stored message, None until stored
+        # Prompt token count, cached per tokenizer by the context builder
+        self.token_count: Optional[int] = None
+        self.token_encoding: Optional[str] = None
+    
+    @classmethod
+    def from_stored(cls, role: str, content: str, timestamp: Optional[datetime], id: str) -> "Turn":
+        """Turn of a stored message (timestamps are stored as naive UTC)"""
+        created = calendar.timegm(timestamp.utctimetuple()) if timestamp else None
+        return cls(role, content, created=created, id=id)
+    
+    @property
+    def usage(self) -> Optional[Dict[str, int]]:
+        if not (self.prompt_tokens or self.completion_tokens):
+            return None
+        return {
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "total_tokens": self.prompt_tokens + self.completion_tokens
+        }
+    
+    def to_message(self) -> Dict[str, str]:
+        """The turn as a chat completion API message"""
+        return {"role": self.role, "content": self.content}
+    
+    def metadata(self) -> Dict[str, Any]:
+        """Functions, model and usage of the turn, for storing it"""
+        metadata = {"functions": list(self.functions), "model": self.model, "usage": self.usage}
+        return {name: value for name, value in metadata.items() if value}
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "role": self.role,
+            "content": self.content,
+            "timestamp": datetime.fromtimestamp(self.created).isoformat(),
+            **self.metadata()
+        }
+    
+    def nbytes(self) -> int:
+        """Approximate bytes held by the turn; interned and shared values are not counted"""
+        size = sys.getsizeof(self) + sys.getsizeof(self.content)
+        if self.functions:
+            size += sys.getsizeof(self.functions)
+        if self.id is not None:
+            size += sys.getsizeof(self.id)
+        return size
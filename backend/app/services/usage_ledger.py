@@ -0,0 +1,172 @@
+"""
+Usage and cost ledger of LLM calls
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+import asyncio
+import logging
+
+from sqlalchemy import case, desc, func, insert
+from sqlalchemy.orm import Session
+
+from ..core.config import settings
+from ..models.llm import UsageRecord
+from .model_catalog import estimate_cost
+from .database import DatabaseService, db_service
+from .write_behind import WriteBehindQueue
+
+logger = logging.getLogger(__name__)
+
+# Columns the ledger can be aggregated by
+USAGE_GROUPS = ("session", "model", "day", "task")
+
+class UsageLedger:
+    """
+    Record tokens, latency and estimated cost of every LLM call
+    
+    Records are queued and written in batches by a write-behind thread,
+    so metering adds no database round trip to the call itself. Reads
+    flush the queue first, so aggregates include every recorded call.
+    Recording never waits: while max_pending records are waiting for the
+    writer (e.g. the database is failing), new ones are dropped and
+    counted in stats() rather than held in memory. Calls recorded after
+    close() are not metered.
+    """
+    
+    def __init__(self, db: DatabaseService = None, enabled: bool = True, batch_size: int = 200,
+                 max_delay: float = 1.0, max_pending: int = 10000):
+        self.db = db or db_service
+        self.enabled = enabled
+        self.queue = WriteBehindQueue(self._write, max_batch=batch_size, max_delay=max_delay,
+                                      max_pending=max_pending, name="usage-ledger")
+        self.closed = False
+        if enabled:
+            self.queue.start()
+    
+    def record(self, task: str, model: Optional[str], usage: Optional[Dict[str, Any]], latency: Optional[float],
+               session_id: Optional[str] = None, message_id: Optional[str] = None,
+               cached: bool = False, success: bool = True):
+        """
+        Queue a ledger record for one call
+        
+        Args:
+            task: Kind of call (chat, title, summary, connection_test)
+            model: Model that served the call
+            usage: Usage dict of the call, if any
+            latency: Seconds the call took
+            session_id: Chat session the call was made for
+            message_id: Message the call produced, when known
+            cached: Served without an upstream call of its own (from the completion
+                cache, or by joining an identical call in flight); costs nothing
+            success: False for failed calls
+        """
+        if not self.enabled or self.closed:
+            return
+        usage = usage or {}
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        completion_tokens = usage.get("completion_tokens", 0)
+        try:
+            self.queue.put({
+                "created_at": datetime.utcnow(),
+                "session_id": session_id,
+                "message_id": message_id,
+                "task": task,
+                "model": model,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": usage.get("total_tokens", prompt_tokens + completion_tokens),
+                "latency_ms": round(latency * 1000) if latency is not None else None,
+                "cost": 0.0 if cached else estimate_cost(model, prompt_tokens, completion_tokens),
+                "cached": cached,
+                "success": success
+            }, key=session_id, block=False)  # called on the event loop; dropped when full
+        except Exception as e:
+            # Metering must never fail the call it meters
+            logger.error(f"Failed to record LLM usage: {e}")
+    
+    def _write(self, rows: List[Dict[str, Any]]):
+        with self.db.get_session() as session:
+            session.execute(insert(UsageRecord), rows)
+    
+    def flush(self) -> int:
+        """Write out queued records now; returns the number written"""
+        return self.queue.flush()
+    
+    def close(self):
+        """Write out queued records and stop the writer thread"""
+        self.closed = True
+        self.queue.close()
+    
+    async def close_async(self):
+        await asyncio.to_thread(self.close)
+    
+    def get_usage(self, group_by: str = "model", days: int = 30, limit: int = 50,
+                  session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Get usage totals grouped by session, model, day or task"""
+        self.queue.flush()
+        with self.db.get_read_session() as session:
+            return self._get_usage(session, group_by, days, limit, session_id)
+    
+    async def get_usage_async(self, group_by: str = "model", days: int = 30, limit: int = 50,
+                              session_id: Optional[str] = None) -> Dict[str, Any]:
+        """Get usage totals grouped by session, model, day or task (async)"""
+        if self.queue.has_pending():
+            await asyncio.to_thread(self.queue.flush)
+        async with self.db.get_async_read_session() as session:
+            return await session.run_sync(self._get_usage, group_by, days, limit, session_id)
+    
+    def _get_usage(self, session: Session, group_by: str = "model", days: int = 30, limit: int = 50,
+                   session_id: Optional[str] = None) -> Dict[str, Any]:
+        if group_by not in USAGE_GROUPS:
+            raise ValueError(f"Cannot group usage by {group_by!r}, expected one of {', '.join(USAGE_GROUPS)}")
+        column = {
+            "session": UsageRecord.session_id,
+            "model": UsageRecord.model,
+            "day": func.date(UsageRecord.created_at),
+            "task": UsageRecord.task
+        }[group_by]
+        totals = (func.count(UsageRecord.id),
+                  func.sum(UsageRecord.prompt_tokens),
+                  func.sum(UsageRecord.completion_tokens),
+                  func.sum(UsageRecord.total_tokens),
+                  func.sum(UsageRecord.cost),
+                  func.avg(UsageRecord.latency_ms),
+                  func.sum(case((UsageRecord.cached, 1), else_=0)),
+                  func.sum(case((UsageRecord.success, 0), else_=1)))
+        
+        def usage(row) -> Dict[str, Any]:
+            calls, prompt, completion, total, cost, latency, cached, failed = row
+            return {"calls": calls or 0, "cached_calls": cached or 0, "failed_calls": failed or 0,
+                    "prompt_tokens": prompt or 0, "completion_tokens": completion or 0,
+                    "total_tokens": total or 0, "cost": round(cost or 0.0, 6),
+                    "avg_latency_ms": round(latency) if latency is not None else None}
+        
+        since = datetime.utcnow() - timedelta(days=days)
+        query = session.query(column, *totals).filter(UsageRecord.created_at >= since)
+        overall_query = session.query(*totals).filter(UsageRecord.created_at >= since)
+        if session_id:
+            query = query.filter(UsageRecord.session_id == session_id)
+            overall_query = overall_query.filter(UsageRecord.session_id == session_id)
+        if group_by == "day":
+            query = query.group_by(column).order_by(column)
+        else:
+            # Most expensive first
+            query = query.group_by(column).order_by(desc(totals[4]), desc(totals[3]))
+        
+        return {
+            **usage(overall_query.one()),
+            "group_by": group_by,
+            "days": days,
+            "groups": [{group_by: row[0], **usage(row[1:])} for row in query.limit(limit).all()]
+        }
+    
+    def stats(self) -> Dict[str, Any]:
+        """Writer queue counters"""
+        return self.queue.stats()
+
+# Global usage ledger instance
+usage_ledger = UsageLedger(
+    enabled=settings.usage_ledger_enabled,
+    batch_size=settings.usage_ledger_batch_size,
+    max_delay=settings.usage_ledger_max_delay_ms / 1000
+)
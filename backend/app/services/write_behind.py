@@ -0,0 +1,204 @@
+"""
+Write-behind queue that groups many small inserts into few transactions
+"""
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class WriteBehindQueue:
+    """
+    Buffer rows in memory and hand them to a flush callback in groups
+    
+    A background thread flushes as soon as max_batch rows are waiting or
+    the oldest row has waited max_delay seconds, whichever comes first.
+    Rows are tagged with a key (e.g. a session id) so readers can ask
+    whether their data is still in flight and flush it first. At most
+    max_pending rows are held: once that many are waiting, put() waits
+    for the flusher to take them, which pushes back on the callers.
+    Callers on the event loop pass block=False instead, and their rows
+    are dropped (and counted) while the queue is full.
+    
+    A failed flush puts its rows back and is retried with growing delays.
+    After max_retries failures in a row, the rows are written one at a
+    time and those that still fail are logged and dropped, so a single
+    bad row cannot hold up every later write.
+    """
+    
+    def __init__(self, flush: Callable[[List[Dict[str, Any]]], None], max_batch: int = 500,
+                 max_delay: float = 0.05, max_pending: int = 10000, max_retries: int = 5,
+                 name: str = "write-behind"):
+        self._flush_rows = flush
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.max_pending = max(max_pending, max_batch)
+        self.max_retries = max_retries
+        self.name = name
+        
+        self._pending: List[Tuple[Any, Dict[str, Any]]] = []
+        # Keys of rows queued or being flushed, i.e. not yet committed
+        self._pending_keys: Counter = Counter()
+        self._oldest: Optional[float] = None
+        self._cond = threading.Condition()
+        # Serializes flushes so rows reach the database in queue order
+        self._flush_lock = threading.Lock()
+        self._closed = False
+        self._thread: Optional[threading.Thread] = None
+        # Flushes failed in a row
+        self._retries = 0
+        # Whether rows are being dropped because the queue is full
+        self._overflowing = False
+        
+        self.enqueued = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.failures = 0
+        self.dropped = 0
+    
+    def start(self):
+        """Start the background flusher thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+    
+    def put(self, row: Dict[str, Any], key: Any = None, block: bool = True) -> bool:
+        """
+        Queue a row for the next flush
+        
+        Args:
+            row: Row handed to the flush callback
+            key: Tag for has_pending()
+            block: Wait while max_pending rows are queued; never pass
+                True from the event loop
+        
+        Returns:
+            False if the row was dropped because the queue is full
+        """
+        with self._cond:
+            while block and len(self._pending) >= self.max_pending and self._thread is not None \
+                    and threading.current_thread() is not self._thread and not self._closed:
+                self._cond.notify_all()
+                self._cond.wait()
+            if self._closed:
+                raise RuntimeError(f"{self.name} queue is closed")
+            if not block and len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                if not self._overflowing:
+                    self._overflowing = True
+                    logger.error(f"{self.name} queue is full ({len(self._pending)} rows), dropping new rows")
+                return False
+            self._pending.append((key, row))
+            self._pending_keys[key] += 1
+            self.enqueued += 1
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+            backlog = len(self._pending)
+            if backlog == 1 or backlog >= self.max_batch:
+                self._cond.notify_all()
+            return True
+    
+    def has_pending(self, key: Any = None) -> bool:
+        """Whether rows for key (or any rows, if key is None) are waiting"""
+        with self._cond:
+            if key is None:
+                return bool(self._pending_keys)
+            return self._pending_keys[key] > 0
+    
+    def flush(self) -> int:
+        """Write out everything queued so far; returns the number of rows written"""
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending = self._pending, []
+                self._oldest = None
+                self._overflowing = False
+                # Producers waiting for room can go on
+                self._cond.notify_all()
+            if not batch:
+                return 0
+            
+            try:
+                self._flush_rows([row for _, row in batch])
+                written = len(batch)
+            except Exception as e:
+                self.failures += 1
+                self._retries += 1
+                logger.error(f"Failed to flush {len(batch)} queued rows from {self.name}: {e}")
+                if self._retries <= self.max_retries:
+                    # Put the rows back in front of anything queued meanwhile so
+                    # the next flush retries them in order
+                    with self._cond:
+                        self._pending[:0] = batch
+                        self._oldest = time.monotonic()
+                    raise
+                written = self._flush_each(batch)
+            
+            self._retries = 0
+            with self._cond:
+                self._pending_keys.subtract(key for key, _ in batch)
+                self._pending_keys += Counter()  # drop keys that reached zero
+            self.flushed += written
+            self.flushes += 1
+            return written
+    
+    def _flush_each(self, batch: List[Tuple[Any, Dict[str, Any]]]) -> int:
+        """Write rows one at a time, dropping those that fail; returns the number written"""
+        written = 0
+        for key, row in batch:
+            try:
+                self._flush_rows([row])
+                written += 1
+            except Exception as e:
+                self.dropped += 1
+                logger.error(f"Dropping row of {self.name} (key {key!r}) after {self.max_retries} retries: {e}; "
+                             f"row: {row!r:.500}")
+        return written
+    
+    def close(self, timeout: Optional[float] = None):
+        """Stop accepting rows, drain the queue and stop the flusher thread"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        try:
+            self.flush()
+        except Exception:
+            logger.error(f"{self.name} closed with {len(self._pending)} rows not written")
+    
+    def stats(self) -> Dict[str, Any]:
+        """Queue counters for monitoring"""
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "enqueued": self.enqueued,
+            "flushed": self.flushed,
+            "flushes": self.flushes,
+            "failures": self.failures,
+            "dropped": self.dropped,
+            "avg_batch": round(self.flushed / self.flushes, 1) if self.flushes else 0
+        }
+    
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if self._closed:
+                    return
+                # Give the batch until the oldest row's deadline to fill up
+                while self._pending and len(self._pending) < self.max_batch and not self._closed:
+                    remaining = self._oldest + self.max_delay - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+            
+            try:
+                self.flush()
+            except Exception:
+                # Already logged; back off before retrying the same rows
+                time.sleep(min(self.max_delay * 2 ** self._retries, 30.0))
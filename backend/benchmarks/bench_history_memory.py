@@ -0,0 +1,96 @@
+"""
+Benchmark: memory held per cached history message, dicts vs Turn records
+
+Builds the same conversation turns twice, as the dicts the chat service
+used to keep (ISO timestamp string, functions list, usage dict, cached
+token count) and as slotted Turn records, and measures with tracemalloc
+what each representation allocates on top of the message texts, which
+both share. Reports bytes per message and the total for all of them.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_history_memory --turns 100000
+"""
+import argparse
+import gc
+import sys
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+from uuid import uuid4
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.services.turns import ASSISTANT, USER, Turn  # noqa: E402
+
+MODEL = "gpt-4o-mini"
+ENCODING = "o200k_base"
+
+
+def as_dicts(contents: List[str], ids: List[str], started: datetime) -> List[Dict[str, Any]]:
+    messages = []
+    for index, content in enumerate(contents):
+        timestamp = (started + timedelta(seconds=index)).isoformat()
+        if index % 2 == 0:
+            message = {"role": "user", "content": content, "timestamp": timestamp, "functions": []}
+        else:
+            message = {"role": "assistant", "content": content, "timestamp": timestamp, "model": MODEL,
+                       "usage": {"prompt_tokens": 900 + index % 50, "completion_tokens": 60 + index % 40,
+                                 "total_tokens": 960 + index % 90}}
+        message["token_count"] = 20 + index % 30
+        message["token_encoding"] = ENCODING
+        message["id"] = ids[index]
+        messages.append(message)
+    return messages
+
+
+def as_turns(contents: List[str], ids: List[str], started: datetime) -> List[Turn]:
+    turns = []
+    created = int(started.timestamp())
+    for index, content in enumerate(contents):
+        if index % 2 == 0:
+            turn = Turn(USER, content, created=created + index)
+        else:
+            turn = Turn(ASSISTANT, content, created=created + index, model=MODEL,
+                        usage={"prompt_tokens": 900 + index % 50, "completion_tokens": 60 + index % 40})
+        turn.token_count = 20 + index % 30
+        turn.token_encoding = ENCODING
+        turn.id = ids[index]
+        turns.append(turn)
+    return turns
+
+
+def measure(label: str, build: Callable[[], list], count: int) -> float:
+    gc.collect()
+    tracemalloc.start()
+    records = build()
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    per_message = allocated / count
+    print(f"{label:>6}: {per_message:,.0f} bytes/message, {allocated / 2 ** 20:,.1f} MiB for {count:,} messages")
+    del records
+    return per_message
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=100000, help="messages to build")
+    parser.add_argument("--content-chars", type=int, default=200, help="length of each message text")
+    args = parser.parse_args()
+
+    # Texts and stored ids exist once either way, so they are made up front and not measured
+    filler = "please summarize the open tickets " * (args.content_chars // 34 + 1)
+    contents = [f"{index} {filler}"[:args.content_chars] for index in range(args.turns)]
+    ids = [str(uuid4()) for _ in range(args.turns)]
+    started = datetime(2024, 1, 1)
+    text_bytes = sum(sys.getsizeof(content) for content in contents) / args.turns
+
+    print(f"message text: {text_bytes:,.0f} bytes/message, not included below")
+    before = measure("dicts", lambda: as_dicts(contents, ids, started), args.turns)
+    after = measure("turns", lambda: as_turns(contents, ids, started), args.turns)
+    print(f"saved: {before - after:,.0f} bytes/message ({1 - after / before:.0%}), "
+          f"{(before + text_bytes) / (after + text_bytes):.2f}x smaller including the text")
+
+
+if __name__ == "__main__":
+    main()
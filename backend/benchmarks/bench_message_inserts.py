@@ -0,0 +1,73 @@
+"""
+Benchmark: sustained add_message throughput, direct commits vs write-behind
+
+Concurrent producers insert messages into a set of sessions, first with a
+commit per message and then with the write-behind queue, against
+throwaway SQLite databases. Reports messages/s including the final drain,
+and checks that every message was written.
+
+Usage (from the backend directory):
+    python -m benchmarks.bench_message_inserts --producers 8 --messages 2000
+"""
+import argparse
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.models.chat import ChatMessage  # noqa: E402
+from app.services.database import DatabaseService  # noqa: E402
+from app.services.chat_database_service import ChatDatabaseService  # noqa: E402
+
+
+def run(write_behind: bool, producers: int, messages_per_producer: int, sessions: int) -> float:
+    with tempfile.TemporaryDirectory() as tmp:
+        database = DatabaseService(Path(tmp) / "bench.db")
+        service = ChatDatabaseService(database, write_behind=write_behind)
+        session_ids = [service.create_session(title=f"Benchmark session {i}").id for i in range(sessions)]
+
+        def produce(worker: int):
+            for j in range(messages_per_producer):
+                session_id = session_ids[(worker + j) % len(session_ids)]
+                service.add_message(session_id, f"message {worker}-{j}", "user" if j % 2 == 0 else "assistant")
+
+        threads = [threading.Thread(target=produce, args=(i,)) for i in range(producers)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        service.close()
+        elapsed = time.perf_counter() - started
+
+        with database.get_read_session() as session:
+            written = session.query(ChatMessage).count()
+        expected = producers * messages_per_producer
+        if written != expected:
+            raise SystemExit(f"expected {expected} messages, found {written}")
+
+        label = "write-behind" if write_behind else "direct"
+        extra = f"  {service.write_queue.stats()}" if service.write_queue else ""
+        print(f"{label:>13}: {expected} messages in {elapsed:.2f}s = {expected / elapsed:,.0f} msg/s{extra}")
+        database.engine.dispose()
+        database.read_engine.dispose()
+        return expected / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--producers", type=int, default=8)
+    parser.add_argument("--messages", type=int, default=2000, help="messages per producer")
+    parser.add_argument("--sessions", type=int, default=50)
+    args = parser.parse_args()
+
+    direct = run(False, args.producers, args.messages, args.sessions)
+    queued = run(True, args.producers, args.messages, args.sessions)
+    print(f"speed-up: {queued / direct:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+"""
+Load test: concurrent chat users against the full backend on the LLM stub
+
+Starts the backend with uvicorn on LLM_BACKEND=stub and a throwaway SQLite
+database, then runs simulated users concurrently. Each user follows the
+frontend's flow: create a session over REST, then per turn save the user
+message, get the reply over /ws/chat, save the reply and reload the recent
+messages. Reports throughput and p50/p95/p99 latency per operation, the
+time to first token of streamed replies, and the server's event loop lag
+(GET /health/loop) during the run.
+
+Usage (from the backend directory):
+    python -m benchmarks.load_test --users 1000 --turns 3 --stream
+    python -m benchmarks.load_test --users 2000 --scenario ws --latency-ms 800 --rate-limit 0.05
+    python -m benchmarks.load_test --users 2000 --stream --workers 4
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+import websockets
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+SCENARIOS = ("frontend", "ws", "rest")
+
+
+def percentile(samples: List[float], pct: float) -> float:
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    def add(self, op: str, started: float, ok: bool = True):
+        if ok:
+            self.latencies[op].append(time.perf_counter() - started)
+        else:
+            self.errors[op] += 1
+
+    def report(self, elapsed: float):
+        print(f"{'operation':<22}{'ok':>8}{'errors':>8}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+        for op in sorted(set(self.latencies) | set(self.errors)):
+            samples = self.latencies.get(op, [])
+            row = f"{op:<22}{len(samples):>8}{self.errors.get(op, 0):>8}{len(samples) / elapsed:>10.1f}"
+            if samples:
+                row += "".join(f"{percentile(samples, p) * 1000:>10.1f}" for p in (50, 95, 99))
+                row += f"{max(samples) * 1000:>10.1f}"
+            print(row)
+
+
+async def ws_turn(ws, recorder: Recorder, session_id: Optional[str], text: str, stream: bool):
+    started = time.perf_counter()
+    await ws.send(json.dumps({"message": text, "functions": [], "session_id": session_id, "stream": stream}))
+    if not stream:
+        reply = json.loads(await ws.recv())
+        recorder.add("ws reply", started, not reply.get("error"))
+        return reply
+    first = True
+    while True:
+        frame = json.loads(await ws.recv())
+        if frame["type"] == "delta" and first:
+            recorder.add("ws first token", started)
+            first = False
+        elif frame["type"] == "end":
+            recorder.add("ws reply", started, not frame.get("error"))
+            return frame
+
+
+async def rest_call(client: httpx.AsyncClient, recorder: Recorder, op: str, method: str, path: str, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, path, **kwargs)
+        recorder.add(op, started, response.status_code < 400)
+        return response.json() if response.status_code < 400 else None
+    except httpx.HTTPError:
+        recorder.add(op, started, False)
+        return None
+
+
+async def user(index: int, args, client: httpx.AsyncClient, recorder: Recorder):
+    # Spread session starts over the ramp-up period
+    await asyncio.sleep(random.uniform(0, args.ramp))
+    ws = None
+    try:
+        session_id = None
+        if args.scenario != "ws":
+            chat_session = await rest_call(client, recorder, "create session", "POST", "/api/chat/sessions",
+                                           json={"title": f"Load test user {index}"})
+            if chat_session is None:
+                return
+            session_id = chat_session["id"]
+        else:
+            session_id = f"load-{index}"
+
+        if args.scenario != "rest":
+            started = time.perf_counter()
+            try:
+                ws = await websockets.connect(f"ws://{args.host}:{args.port}/ws/chat", open_timeout=args.timeout,
+                                              max_queue=None)
+                recorder.add("ws connect", started)
+            except (OSError, asyncio.TimeoutError, websockets.WebSocketException):
+                recorder.add("ws connect", started, False)
+                return
+
+        for turn in range(args.turns):
+            text = f"User {index} turn {turn}: " + "please summarize the open tickets " * args.prompt_words
+            if args.scenario != "ws":
+                await rest_call(client, recorder, "save user message", "POST", f"/api/chat/sessions/{session_id}/messages",
+                                json={"content": text, "message_type": "user"})
+            if ws is not None:
+                try:
+                    reply = await asyncio.wait_for(ws_turn(ws, recorder, session_id, text, args.stream), args.timeout)
+                except (asyncio.TimeoutError, websockets.WebSocketException):
+                    recorder.add("ws reply", 0, False)
+                    return
+                content = reply.get("content", "")
+            else:
+                content = f"Reply {turn} to user {index}"
+            if args.scenario != "ws":
+                await rest_call(client, recorder, "save reply", "POST", f"/api/chat/sessions/{session_id}/messages",
+                                json={"content": content, "message_type": "assistant"})
+                await rest_call(client, recorder, "recent messages", "GET",
+                                f"/api/chat/sessions/{session_id}/messages/recent", params={"limit": 50})
+            await asyncio.sleep(random.uniform(0, 2 * args.think))
+    finally:
+        if ws is not None:
+            await ws.close()
+
+
+def start_server(args, db_path: Path, log) -> subprocess.Popen:
+    env = dict(os.environ,
+               LLM_BACKEND="stub",
+               SQLITE_PATH=str(db_path),
+               LLM_STUB_LATENCY_MS=str(args.latency_ms),
+               LLM_STUB_LATENCY_DISTRIBUTION=args.distribution,
+               LLM_STUB_TOKENS_PER_SECOND=str(args.tokens_per_second),
+               LLM_STUB_COMPLETION_TOKENS=str(args.completion_tokens),
+               LLM_STUB_RATE_LIMIT_PROBABILITY=str(args.rate_limit),
+               OPENAI_MAX_CONCURRENCY=str(args.max_concurrency),
+               WEB_CONCURRENCY=str(args.workers),
+               OPENAI_REQUESTS_PER_MINUTE="0",
+               OPENAI_TOKENS_PER_MINUTE="0")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", args.host, "--port", str(args.port),
+         "--log-level", "warning", "--no-access-log"],
+        cwd=BACKEND_DIR, env=env, stdout=log, stderr=log
+    )
+
+
+async def wait_until_up(client: httpx.AsyncClient, server: subprocess.Popen, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError("Backend exited during startup, see the server log")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Backend did not start in time")
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        log_path = Path(tmp) / "server.log"
+        with open(log_path, "w") as log:
+            server = start_server(args, Path(tmp) / "load.db", log)
+            limits = httpx.Limits(max_connections=args.users, max_keepalive_connections=args.users)
+            try:
+                async with httpx.AsyncClient(base_url=f"http://{args.host}:{args.port}", limits=limits,
+                                             timeout=args.timeout) as client:
+                    await wait_until_up(client, server)
+                    await client.get("/health/loop", params={"reset": True})
+
+                    recorder = Recorder()
+                    started = time.perf_counter()
+                    await asyncio.gather(*(user(i, args, client, recorder) for i in range(args.users)))
+                    elapsed = time.perf_counter() - started
+
+                    loop_lag = (await client.get("/health/loop")).json()
+                    scheduler = (await client.get("/api/settings/openai/scheduler")).json()
+            finally:
+                server.terminate()
+                server.wait(timeout=30)
+
+        print(f"{args.users} users x {args.turns} turns ({args.scenario}, stream={args.stream}, workers={args.workers}) "
+              f"on a {args.distribution} {args.latency_ms:.0f} ms stub in {elapsed:.1f}s")
+        recorder.report(elapsed)
+        print(f"server loop lag: p50 {loop_lag['p50_ms']} ms, p95 {loop_lag['p95_ms']} ms, "
+              f"p99 {loop_lag['p99_ms']} ms, max {loop_lag['max_ms']} ms over {loop_lag['samples']} samples")
+        totals = {key: sum(model[key] for model in scheduler["models"].values())
+                  for key in ("requests", "rate_limited", "retries", "timeouts", "failures")}
+        print(f"upstream calls: {json.dumps(totals)}, avg queue time {scheduler['avg_queue_time'] * 1000:.0f} ms")
+        errors = [line for line in log_path.read_text().splitlines() if "ERROR" in line] if log_path.exists() else []
+        if errors:
+            print(f"{len(errors)} server errors, first: {errors[0]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per user")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="frontend")
+    parser.add_argument("--stream", action="store_true", help="stream replies over the websocket")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which users start")
+    parser.add_argument("--think", type=float, default=0.5, help="mean pause between turns in seconds")
+    parser.add_argument("--prompt-words", type=int, default=10)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8799)
+    parser.add_argument("--latency-ms", type=float, default=300)
+    parser.add_argument("--distribution", default="lognormal",
+                        choices=("fixed", "uniform", "exponential", "lognormal"))
+    parser.add_argument("--tokens-per-second", type=float, default=80)
+    parser.add_argument("--completion-tokens", type=int, default=60)
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="share of stub requests answered with 429")
+    parser.add_argument("--max-concurrency", type=int, default=256, help="OPENAI_MAX_CONCURRENCY of the backend")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="uvicorn worker processes; loop lag is that of whichever worker answers")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
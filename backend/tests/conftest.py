@@ -0,0 +1,60 @@
+"""
+Shared test fixtures
+"""
+import asyncio
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Settings and the global services are created on import; keep them off the
+# local database and away from any real LLM API
+os.environ.setdefault("SQLITE_PATH", str(Path(tempfile.mkdtemp(prefix="attila-tests-")) / "attila.db"))
+os.environ.setdefault("LLM_BACKEND", "stub")
+os.environ.setdefault("LLM_STUB_LATENCY_MS", "20")
+os.environ.setdefault("LLM_STUB_LATENCY_DISTRIBUTION", "fixed")
+os.environ.setdefault("LLM_STUB_TOKENS_PER_SECOND", "5000")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import pytest  # noqa: E402
+
+from app.services.chat_database_service import ChatDatabaseService  # noqa: E402
+from app.services.database import DatabaseService  # noqa: E402
+from app.services.usage_ledger import UsageLedger  # noqa: E402
+
+
+@pytest.fixture
+def database(tmp_path):
+    db = DatabaseService(tmp_path / "test.db")
+    yield db
+    asyncio.run(db.dispose())
+
+
+@pytest.fixture
+def chat_db(database):
+    service = ChatDatabaseService(database, write_behind=False)
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def ledger(database):
+    service = UsageLedger(database)
+    yield service
+    service.close()
+
+
+@pytest.fixture
+def chat_api(chat_db, ledger, monkeypatch):
+    """Client for the chat API, backed by the test database"""
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.api import chat
+
+    monkeypatch.setattr(chat, "chat_db_service", chat_db)
+    monkeypatch.setattr(chat, "usage_ledger", ledger)
+    app = FastAPI()
+    app.include_router(chat.router, prefix="/api/chat")
+    with TestClient(app) as client:
+        yield client
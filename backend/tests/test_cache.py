@@ -0,0 +1,76 @@
+from app.services import cache as cache_module
+from app.services.cache import TTLCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def fake_clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    return clock
+
+
+def test_hit_and_miss():
+    cache = TTLCache(maxsize=4)
+    assert cache.get("a", "missing") == "missing"
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert cache.stats()["hit_ratio"] == 0.5
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = fake_clock(monkeypatch)
+    cache = TTLCache(ttl=10)
+    cache.set("a", 1)
+    clock.now += 9.9
+    assert cache.get("a") == 1
+    clock.now += 0.1
+    assert cache.get("a") is None
+    assert cache.expirations == 1
+    assert cache.stats()["size"] == 0
+
+
+def test_least_recently_used_is_evicted():
+    cache = TTLCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert (cache.get("a"), cache.get("c")) == (1, 3)
+    assert cache.evictions == 1
+
+
+def test_invalidate_drops_the_key():
+    cache = TTLCache()
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.invalidate("a")
+    assert cache.get("a") is None
+    assert cache.get("b") == 2
+    cache.clear()
+    assert cache.get("b") is None
+
+
+def test_load_raced_by_invalidation_is_not_stored():
+    cache = TTLCache()
+    generation = cache.generation
+    # A write lands between the loader's read and its set()
+    cache.invalidate("a")
+    assert cache.set("a", "stale", generation) is False
+    assert cache.get("a") is None
+    assert cache.set("a", "fresh", cache.generation) is True
+    assert cache.get("a") == "fresh"
+
+
+def test_zero_maxsize_disables_the_cache():
+    cache = TTLCache(maxsize=0)
+    assert cache.set("a", 1) is False
+    assert cache.get("a") is None
@@ -0,0 +1,110 @@
+import asyncio
+
+from app.services.completion_cache import CompletionCache
+from app.services.model_router import ModelRouter
+from app.services.openai_service import OpenAIService
+from app.services.rate_limiter import RequestScheduler
+
+MESSAGES = [{"role": "user", "content": "Summarize the open tickets"}]
+RESULT = {"content": "Three are open.", "model": "gpt-3.5-turbo", "finish_reason": "stop",
+          "usage": {"prompt_tokens": 12, "completion_tokens": 4, "total_tokens": 16}}
+
+
+class Ledger:
+    """Usage ledger that keeps its records in a list"""
+
+    def __init__(self):
+        self.records = []
+
+    def record(self, task, model, usage, latency, session_id=None, message_id=None, cached=False, success=True):
+        self.records.append({"task": task, "session_id": session_id, "cached": cached, "success": success})
+
+    @property
+    def upstream_calls(self):
+        return sum(1 for record in self.records if not record["cached"])
+
+
+def service(cache, ledger):
+    return OpenAIService(cache=cache, scheduler=RequestScheduler(), router=ModelRouter(["gpt-3.5-turbo"]),
+                         hedger=None, ledger=ledger)
+
+
+def test_key_depends_only_on_the_request():
+    key = CompletionCache.make_key("gpt-4o", MESSAGES, 0, 100, "scope")
+    annotated = [{**MESSAGES[0], "timestamp": "2024-01-01T00:00:00"}]
+    assert CompletionCache.make_key("gpt-4o", annotated, 0.0, 100, "scope") == key
+    assert CompletionCache.make_key("gpt-4o-mini", MESSAGES, 0, 100, "scope") != key
+    assert CompletionCache.make_key("gpt-4o", MESSAGES, 0.2, 100, "scope") != key
+    assert CompletionCache.make_key("gpt-4o", MESSAGES, 0, 100, "other key") != key
+
+
+def test_only_low_temperatures_are_cacheable():
+    cache = CompletionCache(max_temperature=0.3)
+    assert cache.is_cacheable(0.3)
+    assert not cache.is_cacheable(0.7)
+    assert not CompletionCache(enabled=False).is_cacheable(0)
+
+
+def test_hits_are_copies_marked_cached():
+    async def scenario():
+        cache = CompletionCache()
+        assert await cache.get("k") is None
+        await cache.set("k", RESULT)
+        hit = await cache.get("k")
+        hit["usage"]["total_tokens"] = 0
+        return cache, hit, await cache.get("k")
+
+    cache, hit, again = asyncio.run(scenario())
+    assert hit["cached"] is True
+    assert again["usage"] == RESULT["usage"]
+    assert "cached" not in RESULT
+    assert (cache.hits, cache.misses, cache.saved_tokens) == (2, 1, 32)
+
+
+def test_persisted_entries_survive_a_restart(database):
+    async def scenario():
+        await CompletionCache(persist=True, db=database).set("k", RESULT)
+        restarted = CompletionCache(persist=True, db=database)
+        return restarted, await restarted.get("k"), await restarted.get("missing")
+
+    restarted, hit, miss = asyncio.run(scenario())
+    assert hit["content"] == RESULT["content"]
+    assert miss is None
+    assert restarted.persisted_hits == 1
+
+
+def test_deterministic_completion_is_answered_from_the_cache():
+    ledger = Ledger()
+    cache = CompletionCache()
+
+    async def scenario():
+        openai_service = service(cache, ledger)
+        openai_service.temperature = 0
+        try:
+            return [await openai_service.generate_response("hello") for _ in range(2)]
+        finally:
+            await openai_service.aclose()
+
+    first, second = asyncio.run(scenario())
+    assert first["success"] and second["success"]
+    assert second["content"] == first["content"]
+    assert second.get("cached") and not first.get("cached")
+    assert ledger.upstream_calls == 1
+
+
+def test_hot_completion_bypasses_the_cache():
+    ledger = Ledger()
+    cache = CompletionCache()
+
+    async def scenario():
+        openai_service = service(cache, ledger)
+        openai_service.temperature = 0.7
+        try:
+            for _ in range(2):
+                await openai_service.generate_response("hello")
+        finally:
+            await openai_service.aclose()
+
+    asyncio.run(scenario())
+    assert ledger.upstream_calls == 2
+    assert cache.bypassed == 2
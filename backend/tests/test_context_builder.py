@@ -0,0 +1,121 @@
+import pytest
+
+from app.services import context_builder
+from app.services.context_builder import (MESSAGE_OVERHEAD_TOKENS, SUMMARY_PREFIX, TRUNCATION_MARKER, build_context,
+                                          count_tokens, message_tokens, prompt_budget, truncate_to_tokens)
+from app.services.turns import ASSISTANT, USER, Turn
+
+MODEL = "gpt-4"  # 8192 token context window
+
+
+class CharEncoding:
+    """Tokenizer with one token per character"""
+
+    name = "chars"
+
+    def encode(self, text, disallowed_special=()):
+        return list(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@pytest.fixture
+def char_tokens(monkeypatch):
+    monkeypatch.setitem(context_builder._encodings, context_builder._encoding_name(MODEL), CharEncoding())
+
+
+def conversation(count, words=50):
+    return [Turn(USER if index % 2 == 0 else ASSISTANT, f"turn{index} " + "word " * words)
+            for index in range(count)]
+
+
+def history_of(messages):
+    """The history part of built messages: everything between the system prompt(s) and the user message"""
+    return [message["content"] for message in messages[1:-1] if message["role"] != "system"]
+
+
+def test_estimate_without_a_tokenizer():
+    assert count_tokens("", MODEL) == 0
+    assert count_tokens("a" * 40, MODEL) == 11
+    assert context_builder.tokenizer_name(MODEL) == "estimate"
+
+
+def test_short_text_is_not_truncated():
+    assert truncate_to_tokens("keep me", 100, MODEL) == "keep me"
+
+
+def test_truncation_estimate_keeps_both_ends():
+    text = "".join(chr(ord("a") + index % 26) for index in range(4000))
+    truncated = truncate_to_tokens(text, 100, MODEL)
+    head, tail = truncated.split(TRUNCATION_MARKER)
+    assert text.startswith(head) and text.endswith(tail)
+    assert abs(len(head) - len(tail)) <= context_builder.CHARS_PER_TOKEN
+    assert count_tokens(truncated, MODEL) <= 100 + 2
+
+
+def test_truncation_with_a_tokenizer_cuts_the_middle(char_tokens):
+    text = "0123456789" * 30
+    truncated = truncate_to_tokens(text, 100, MODEL)
+    head, tail = truncated.split(TRUNCATION_MARKER)
+    budget = 100 - len(TRUNCATION_MARKER)
+    assert (head, tail) == (text[:budget // 2], text[-(budget - budget // 2):])
+    assert count_tokens(truncated, MODEL) == 100
+
+
+def test_token_counts_are_cached_per_tokenizer(char_tokens, monkeypatch):
+    turn = Turn(USER, "a" * 40)
+    assert message_tokens(turn, MODEL) == 40 + MESSAGE_OVERHEAD_TOKENS
+    assert turn.token_encoding == "chars"
+    monkeypatch.delitem(context_builder._encodings, context_builder._encoding_name(MODEL))
+    assert message_tokens(turn, MODEL) == 11 + MESSAGE_OVERHEAD_TOKENS
+    assert turn.token_encoding == "estimate"
+
+
+def test_history_is_packed_newest_first():
+    history = conversation(100)
+    messages, used = build_context("system", "question", history, model=MODEL, max_tokens=4000)
+
+    packed = history_of(messages)
+    assert 0 < len(packed) < len(history)
+    # The newest turns, in order, with no gap
+    assert packed == [turn.content for turn in history[-len(packed):]]
+    assert used <= prompt_budget(MODEL, 4000)
+    older = history[-len(packed) - 1]
+    assert used + message_tokens(older, MODEL) > prompt_budget(MODEL, 4000)
+    assert messages[-1] == {"role": "user", "content": "question"}
+
+
+def test_history_is_capped_by_history_tokens():
+    history = conversation(40)
+    cost = message_tokens(history[-1], MODEL)
+    messages, _ = build_context("system", "question", history, model="gpt-4o", history_tokens=cost * 3)
+    assert history_of(messages) == [turn.content for turn in history[-3:]]
+
+    uncapped, _ = build_context("system", "question", history, model="gpt-4o")
+    assert len(history_of(uncapped)) == 40
+
+
+def test_trailing_copy_of_the_message_is_skipped():
+    history = [Turn(USER, "hi"), Turn(ASSISTANT, "hello"), Turn(USER, "question")]
+    messages, _ = build_context("system", "question", history, model=MODEL)
+    assert [message["content"] for message in messages] == ["system", "hi", "hello", "question"]
+
+
+def test_summary_is_capped_at_a_quarter_of_the_budget():
+    budget = prompt_budget(MODEL, 2000)
+    messages, _ = build_context("system", "question", conversation(4), model=MODEL, summary="fact " * 20000)
+    summary = messages[1]
+    assert summary["role"] == "system"
+    assert summary["content"].startswith(SUMMARY_PREFIX)
+    assert TRUNCATION_MARKER in summary["content"]
+    assert count_tokens(summary["content"], MODEL) <= budget // 4 + 2
+    # The rest of the budget still carries the history
+    assert len(history_of(messages)) == 4
+
+
+def test_oversized_message_is_truncated_to_fit():
+    messages, used = build_context("system", "x" * 100000, conversation(4), model=MODEL, max_tokens=2000)
+    assert TRUNCATION_MARKER in messages[-1]["content"]
+    assert history_of(messages) == []
+    assert used <= prompt_budget(MODEL, 2000)
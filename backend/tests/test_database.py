@@ -0,0 +1,108 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from app.models.chat import ChatSession
+
+TIMEOUT = 10
+
+
+class Writers:
+    """Write one session per call, checking that no two write sessions overlap"""
+
+    def __init__(self, database):
+        self.database = database
+        self.active = 0
+        self.overlaps = 0
+        self._count_lock = threading.Lock()
+
+    def _enter(self):
+        with self._count_lock:
+            self.active += 1
+            if self.active > 1:
+                self.overlaps += 1
+
+    def _exit(self):
+        with self._count_lock:
+            self.active -= 1
+
+    def write(self, title):
+        with self.database.get_session() as session:
+            self._enter()
+            session.add(ChatSession(title=title))
+            time.sleep(0.002)
+            self._exit()
+
+    async def write_async(self, title):
+        async with self.database.get_async_session() as session:
+            self._enter()
+            session.add(ChatSession(title=title))
+            await asyncio.sleep(0.002)
+            self._exit()
+
+
+def titles(database):
+    with database.get_read_session() as session:
+        return sorted(title for title, in session.query(ChatSession.title))
+
+
+def test_sync_and_async_writers_take_turns(database):
+    writers = Writers(database)
+    threads = [threading.Thread(target=lambda n=n: [writers.write(f"sync {n}.{i}") for i in range(10)])
+               for n in range(3)]
+
+    async def steps():
+        for thread in threads:
+            thread.start()
+        await asyncio.wait_for(asyncio.gather(*(writers.write_async(f"async {n}") for n in range(30))), TIMEOUT)
+
+    asyncio.run(steps())
+    for thread in threads:
+        thread.join(TIMEOUT)
+        assert not thread.is_alive()
+
+    assert writers.overlaps == 0
+    assert len(titles(database)) == 60
+    assert not database._writer_lock.locked()
+
+
+def test_cancelled_async_waiter_hands_the_lock_back(database):
+    writers = Writers(database)
+    held, release = threading.Event(), threading.Event()
+
+    def hold():
+        with database.get_session() as session:
+            session.add(ChatSession(title="held"))
+            held.set()
+            release.wait(TIMEOUT)
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert held.wait(TIMEOUT)
+
+    async def steps():
+        waiter = asyncio.create_task(writers.write_async("cancelled"))
+        # Waiting for the writer lock in an executor thread by now
+        await asyncio.sleep(0.05)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        release.set()
+        # The executor thread still takes the lock once the holder is done;
+        # it must hand it back
+        deadline = time.monotonic() + TIMEOUT
+        while holder.is_alive() or database._writer_lock.locked():
+            assert time.monotonic() < deadline, "writer lock leaked"
+            await asyncio.sleep(0.01)
+        await asyncio.wait_for(writers.write_async("after"), TIMEOUT)
+
+    asyncio.run(steps())
+    holder.join(TIMEOUT)
+    assert not holder.is_alive()
+
+    assert titles(database) == ["after", "held"]
+    assert not database._writer_lock.locked()
+    writers.write("sync after")
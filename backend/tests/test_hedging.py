@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from app.services.hedging import MIN_HEDGE_SAMPLES, RequestHedger
+from app.services.model_router import ModelRouter
+
+
+def upstream(latencies, calls):
+    """Call that answers after the model's latency in seconds, or fails if it is an exception"""
+    async def call(model):
+        calls.append(model)
+        latency = latencies[model]
+        if isinstance(latency, Exception):
+            raise latency
+        await asyncio.sleep(latency)
+        return f"reply from {model}"
+    return call
+
+
+def hedger(**kwargs):
+    options = {"enabled": True, "default_delay": 0.05, "min_delay": 0.01, **kwargs}
+    return RequestHedger(ModelRouter(["slow", "fast"]), **options)
+
+
+def test_fast_request_is_not_hedged():
+    calls = []
+    subject = hedger()
+    result, model, latency = asyncio.run(subject.run("slow", [], upstream({"slow": 0.01}, calls)))
+    assert (result, model) == ("reply from slow", "slow")
+    assert latency < 0.05
+    assert calls == ["slow"]
+    assert subject.hedges == 0
+
+
+def test_slow_request_is_hedged_and_loser_recorded():
+    calls = []
+    subject = hedger()
+    result, model, latency = asyncio.run(subject.run("slow", [], upstream({"slow": 0.3}, calls)))
+    assert calls == ["slow", "slow"]
+    assert subject.hedges == 1
+    assert (result, latency >= 0.3) == ("reply from slow", True)
+    assert subject.hedge_wins == 0
+    # The cancelled hedge still counts, with the time it had run
+    samples = list(subject.router.latencies["slow"].samples)
+    assert samples == [pytest.approx(0.25, abs=0.04)]
+
+
+def test_hedge_goes_to_a_faster_model():
+    calls = []
+    subject = hedger()
+    for _ in range(5):
+        subject.router.record_latency("fast", 0.01)
+    result, model, latency = asyncio.run(subject.run("slow", ["fast"], upstream({"slow": 0.3, "fast": 0.01}, calls)))
+    assert (model, calls) == ("fast", ["slow", "fast"])
+    assert subject.hedge_wins == 1
+    assert latency < 0.3
+    assert subject.router.latencies["slow"].samples[-1] == pytest.approx(0.05, abs=0.04)
+
+
+def test_delay_follows_the_latency_percentile():
+    subject = hedger(percentile=90)
+    assert subject.delay("slow") == 0.05
+    for index in range(MIN_HEDGE_SAMPLES):
+        subject.router.record_latency("slow", index / 100)
+    assert subject.delay("slow") == pytest.approx(0.18)
+
+
+def test_hedges_stay_within_budget():
+    calls = []
+    subject = hedger(budget=0.1, burst=1)
+
+    async def scenario():
+        for _ in range(3):
+            await subject.run("slow", [], upstream({"slow": 0.1}, calls))
+
+    asyncio.run(scenario())
+    assert subject.hedges == 1
+    assert subject.over_budget == 2
+    assert subject.stats()["extra_requests_ratio"] == 0.333
+
+
+def test_error_is_raised_only_when_both_requests_fail():
+    calls = []
+    subject = hedger()
+    with pytest.raises(ValueError):
+        asyncio.run(subject.run("slow", [], upstream({"slow": ValueError("bad request")}, calls)))
+    assert calls == ["slow"]
+
+
+def test_cancelled_loser_is_awaited():
+    cleaned_up = []
+
+    async def call(model):
+        try:
+            await asyncio.sleep(0.3 if model == "slow" else 0.01)
+            return model
+        finally:
+            cleaned_up.append(model)
+            if model == "slow":
+                raise RuntimeError("connection reset while cancelling")
+
+    subject = hedger()
+    for _ in range(5):
+        subject.router.record_latency("fast", 0.01)
+    result, model, _ = asyncio.run(subject.run("slow", ["fast"], call))
+    assert (result, model) == ("fast", "fast")
+    # The loser finished its cleanup before run() returned, and its error was retrieved
+    assert sorted(cleaned_up) == ["fast", "slow"]
+    assert subject.stats()["cancelled"] == 1
+
+
+def test_hedged_completion_meters_and_settles_the_loser():
+    from app.services.openai_service import OpenAIService
+    from app.services.rate_limiter import ModelBudget, RequestScheduler, TokenBucket
+
+    records = []
+
+    class Ledger:
+        def record(self, task, model, usage, latency, session_id=None, message_id=None, cached=False, success=True):
+            records.append({"usage": usage or {}, "success": success, "session_id": session_id})
+
+    scheduler = RequestScheduler()
+    # A bucket that does not noticeably refill during the test
+    bucket = TokenBucket(0.001, capacity=100000)
+    scheduler.budgets["gpt-3.5-turbo"] = ModelBudget(requests=None, tokens=bucket)
+    subject = hedger(default_delay=0.005)
+
+    async def scenario():
+        openai_service = OpenAIService(cache=None, scheduler=scheduler, router=subject.router, hedger=subject,
+                                       ledger=Ledger())
+        try:
+            return await openai_service.generate_response("hello", session_id="s1")
+        finally:
+            await openai_service.aclose()
+
+    reply = asyncio.run(scenario())
+    assert reply["success"]
+    assert subject.hedges == 1 and subject.cancelled == 1
+    [winner] = [record for record in records if record["success"]]
+    [loser] = [record for record in records if not record["success"]]
+    assert loser["session_id"] == "s1"
+    assert loser["usage"]["prompt_tokens"] > 0
+    assert "completion_tokens" not in loser["usage"]
+    # Only the tokens actually used stay reserved
+    assert reply["model"] == "gpt-3.5-turbo"
+    used = winner["usage"]["total_tokens"] + loser["usage"]["prompt_tokens"]
+    assert bucket.capacity - bucket.level == pytest.approx(used, abs=1)
@@ -0,0 +1,146 @@
+import asyncio
+import time
+
+from app.services.history_store import HistoryStore
+from app.services.summarizer import ConversationSummarizer, SummaryState
+from app.services.turns import USER, Turn
+
+
+def fill(store, key, count):
+    for index in range(count):
+        store.append(key, Turn(USER, f"{key} {index}"))
+
+
+def test_history_is_trimmed_to_max_messages():
+    trims = []
+    store = HistoryStore(max_messages=3, load_limit=0, on_trim=lambda key, count: trims.append((key, count)))
+    fill(store, "a", 5)
+    assert [turn.content for turn in store.get("a")] == ["a 2", "a 3", "a 4"]
+    assert trims == [("a", 1), ("a", 1)]
+    assert store.stats()["trimmed_messages"] == 2
+    assert store.size == sum(turn.nbytes() for turn in store.get("a"))
+
+
+def test_least_recently_used_history_is_evicted():
+    evicted = []
+    store = HistoryStore(max_sessions=2, load_limit=0, on_evict=evicted.append)
+    fill(store, "a", 1)
+    fill(store, "b", 1)
+    store.get("a")
+    fill(store, "c", 1)
+    assert evicted == ["b"]
+    assert store.get("b") == []
+    assert store.stats()["evictions"] == 2  # b, then a for the new b
+
+
+def test_byte_limit_keeps_the_history_being_written():
+    store = HistoryStore(max_bytes=1, load_limit=0)
+    fill(store, "a", 2)
+    assert len(store.get("a")) == 2
+    fill(store, "b", 1)
+    assert store.stats()["histories"] == 1
+    assert store.size == sum(turn.nbytes() for turn in store.get("b"))
+
+
+def test_idle_histories_expire():
+    store = HistoryStore(ttl=0.2, load_limit=0)
+    fill(store, "a", 1)
+    time.sleep(0.1)
+    fill(store, "b", 1)
+    time.sleep(0.12)
+    assert store.stats()["histories"] == 1
+    assert store.get("a") == []
+    assert [turn.content for turn in store.get("b")] == ["b 0"]
+    assert store.expirations == 1
+
+
+def contents(history):
+    return [turn.content for turn in history]
+
+
+def load_scenario(chat_db, steps, **options):
+    """Run steps(store, session_id) on one event loop with a store reading chat_db"""
+    store = HistoryStore(db=chat_db, **options)
+    session_id = chat_db.create_session("history").id
+    asyncio.run(steps(store, session_id))
+    return store
+
+
+def test_first_load_starts_from_the_stored_window(chat_db):
+    async def steps(store, session_id):
+        for index in range(5):
+            chat_db.add_message(session_id, f"m{index}", "user" if index % 2 == 0 else "assistant")
+        chat_db.add_message(session_id, "function output", "function")
+        assert contents(await store.load(session_id)) == ["m2", "m3", "m4"]
+
+    store = load_scenario(chat_db, steps, load_limit=4)
+    assert store.loaded == 1
+
+
+def test_load_picks_up_messages_of_other_workers(chat_db):
+    async def steps(store, session_id):
+        chat_db.add_message(session_id, "hello", "user")
+        await store.load(session_id)
+        # Kept by this worker but never stored; replaced by the stored copy
+        store.append(session_id, Turn(USER, "pending"))
+        chat_db.add_message(session_id, "stored elsewhere", "user")
+        chat_db.add_message(session_id, "reply", "assistant")
+        assert contents(await store.load(session_id)) == ["hello", "stored elsewhere", "reply"]
+        assert contents(await store.load(session_id)) == ["hello", "stored elsewhere", "reply"]
+
+    store = load_scenario(chat_db, steps, load_limit=4)
+    assert store.synced == 2
+
+
+def test_reset_keeps_turns_stored_by_this_worker(chat_db):
+    resets = []
+
+    async def steps(store, session_id):
+        chat_db.add_message(session_id, "u0", "user")
+        await store.load(session_id)
+        for message in chat_db.add_messages(session_id, [{"content": "mine-u", "message_type": "user"},
+                                                         {"content": "mine-a", "message_type": "assistant"}]):
+            store.append(session_id, Turn(message.message_type, message.content, id=message.id))
+        # More were added elsewhere than one load fetches
+        for index in range(3):
+            chat_db.add_message(session_id, f"other{index}", "user")
+        assert contents(await store.load(session_id)) == ["mine-a", "other0", "other1", "other2"]
+
+    load_scenario(chat_db, steps, load_limit=4, on_evict=resets.append)
+    assert len(resets) == 1
+
+
+def test_without_sync_memory_is_authoritative(chat_db):
+    async def steps(store, session_id):
+        chat_db.add_message(session_id, "hello", "user")
+        await store.load(session_id)
+        chat_db.add_message(session_id, "stored elsewhere", "user")
+        assert contents(await store.load(session_id)) == ["hello"]
+
+    load_scenario(chat_db, steps, load_limit=4, sync=False)
+
+
+def test_dropping_unstored_turns_keeps_the_summarizer_in_range(chat_db):
+    summarizer = ConversationSummarizer()
+    truncations = []
+
+    def on_truncate(key, length):
+        truncations.append(length)
+        summarizer.truncate(key, length)
+
+    async def steps(store, session_id):
+        chat_db.add_message(session_id, "hello", "user")
+        history = await store.load(session_id)
+        for content in ("pending question", "pending answer", "pending follow-up"):
+            store.append(session_id, Turn(USER, content))
+        # Everything so far was folded into the summary
+        summarizer.states[session_id] = SummaryState(text="summary", upto=4, loaded=True)
+
+        chat_db.add_message(session_id, "stored elsewhere", "user")
+        await store.load(session_id)
+        assert truncations == [3, 2, 1]
+        assert summarizer.states[session_id].upto == 1
+        summary, recent = await summarizer.get_context(session_id, history)
+        assert (summary, contents(recent)) == ("summary", ["stored elsewhere"])
+
+    load_scenario(chat_db, steps, load_limit=4, on_truncate=on_truncate)
@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+
+def stored(chat_db, session_id):
+    messages, _, _ = chat_db.get_session_messages_page(session_id, 500)
+    return messages
+
+
+@pytest.fixture
+def session_id(chat_db):
+    return chat_db.create_session("import").id
+
+
+def test_mixed_timestamps_are_stored_as_naive_utc(chat_db, session_id):
+    plus_two = timezone(timedelta(hours=2))
+    imported = chat_db.import_messages([
+        {"session_id": session_id, "content": "aware", "message_type": "user",
+         "timestamp": datetime(2024, 1, 1, 12, 0, tzinfo=plus_two)},
+        {"session_id": session_id, "content": "naive", "message_type": "assistant",
+         "timestamp": datetime(2024, 1, 1, 10, 30)},
+        {"session_id": session_id, "content": "utc", "message_type": "user",
+         "timestamp": datetime(2024, 1, 1, 11, 0, tzinfo=timezone.utc)},
+    ])
+    assert imported == 3
+
+    messages = stored(chat_db, session_id)
+    assert [(message.content, message.timestamp) for message in messages] == [
+        ("aware", datetime(2024, 1, 1, 10, 0)),
+        ("naive", datetime(2024, 1, 1, 10, 30)),
+        ("utc", datetime(2024, 1, 1, 11, 0)),
+    ]
+    assert all(message.timestamp.tzinfo is None for message in messages)
+
+
+def test_aware_timestamps_order_against_server_defaults(chat_db, session_id):
+    chat_db.add_message(session_id, "now", "user")
+    an_hour_ago = datetime.now(timezone(timedelta(hours=-5))) - timedelta(hours=1)
+    chat_db.add_messages(session_id, [{"content": "earlier", "message_type": "user", "timestamp": an_hour_ago}])
+    assert [message.content for message in stored(chat_db, session_id)] == ["earlier", "now"]
+
+
+@pytest.mark.parametrize("bulk", ["add_messages", "import_messages"])
+def test_batch_order_survives_without_timestamps(chat_db, session_id, bulk):
+    contents = [f"m{index}" for index in range(200)]
+    if bulk == "add_messages":
+        chat_db.add_messages(session_id, [{"content": content, "message_type": "user"} for content in contents])
+    else:
+        chat_db.import_messages([{"session_id": session_id, "content": content, "message_type": "user"}
+                                 for content in contents])
+
+    messages = stored(chat_db, session_id)
+    assert [message.content for message in messages] == contents
+    # One microsecond apart, in batch order
+    steps = {later.timestamp - earlier.timestamp for earlier, later in zip(messages, messages[1:])}
+    assert steps == {timedelta(microseconds=1)}
+
+
+def test_import_endpoint_accepts_offsets(chat_api, chat_db, session_id):
+    response = chat_api.post("/api/chat/messages/import", json={"messages": [
+        {"session_id": session_id, "content": "a", "message_type": "user", "timestamp": "2024-01-01T12:00:00+02:00"},
+        {"session_id": session_id, "content": "b", "message_type": "user", "timestamp": "2024-01-01T10:30:00"},
+    ]})
+    assert response.json() == {"imported": 2}
+    assert [message.timestamp for message in stored(chat_db, session_id)] == [
+        datetime(2024, 1, 1, 10, 0), datetime(2024, 1, 1, 10, 30)]
@@ -0,0 +1,101 @@
+from sqlalchemy import text
+
+from app.services.migrations import _set_schema_version, rebuild_message_stats, run_migrations
+
+USAGE = {"usage": {"prompt_tokens": 100, "completion_tokens": 20, "total_tokens": 120}}
+
+
+def rollup(database):
+    """Messages and total tokens per (session, type) from the trigger-maintained rollup"""
+    with database.engine.connect() as conn:
+        return {(row[0], row[1]): (row[2], row[3]) for row in conn.execute(text(
+            "SELECT session_id, message_type, sum(message_count), sum(total_tokens) "
+            "FROM chat_message_stats GROUP BY session_id, message_type"))}
+
+
+def counted(database):
+    """The same numbers counted directly from chat_messages"""
+    with database.engine.connect() as conn:
+        return {(row[0], row[1]): (row[2], row[3]) for row in conn.execute(text(
+            "SELECT session_id, message_type, count(*), "
+            "sum(coalesce(json_extract(extra_data, '$.usage.total_tokens'), 0)) "
+            "FROM chat_messages GROUP BY session_id, message_type"))}
+
+
+def conversation(chat_db, title="stats"):
+    session_id = chat_db.create_session(title).id
+    chat_db.add_message(session_id, "question", "user")
+    answer = chat_db.add_message(session_id, "answer", "assistant", metadata=USAGE)
+    return session_id, answer
+
+
+def test_insert_is_counted(database, chat_db):
+    session_id, _ = conversation(chat_db)
+    assert rollup(database) == {(session_id, "user"): (1, 0), (session_id, "assistant"): (1, 120)}
+    assert rollup(database) == counted(database)
+
+
+def test_message_type_update_moves_the_count(database, chat_db):
+    session_id, answer = conversation(chat_db)
+    with database.engine.begin() as conn:
+        conn.execute(text("UPDATE chat_messages SET message_type = 'ai' WHERE id = :id"), {"id": answer.id})
+    assert rollup(database) == {(session_id, "user"): (1, 0), (session_id, "ai"): (1, 120)}
+
+
+def test_delete_is_subtracted(database, chat_db):
+    session_id, answer = conversation(chat_db)
+    chat_db.delete_message(answer.id)
+    assert rollup(database) == {(session_id, "user"): (1, 0)}
+
+
+def test_session_delete_cascades_to_the_rollup(database, chat_db):
+    session_id, _ = conversation(chat_db)
+    kept, _ = conversation(chat_db, "kept")
+    chat_db.delete_session_permanently(session_id)
+    assert {key[0] for key in rollup(database)} == {kept}
+    assert rollup(database) == counted(database)
+
+
+def test_rebuild_matches_the_messages(database, chat_db):
+    conversation(chat_db)
+    conversation(chat_db, "second")
+    expected = rollup(database)
+    with database.engine.begin() as conn:
+        conn.execute(text("DELETE FROM chat_message_stats"))
+    with database.engine.connect() as conn:
+        rebuild_message_stats(conn)
+    assert rollup(database) == expected == counted(database)
+
+
+def test_stats_endpoints_match_a_direct_count(chat_api, database, chat_db):
+    first, _ = conversation(chat_db)
+    second, _ = conversation(chat_db, "second")
+    chat_db.add_message(second, "follow-up", "user")
+
+    stats = chat_api.get("/api/chat/stats").json()
+    direct = counted(database)
+    assert stats["messages"] == sum(count for count, _ in direct.values())
+    assert stats["total_tokens"] == sum(tokens for _, tokens in direct.values())
+    assert {message_type: usage["messages"] for message_type, usage in stats["by_type"].items()} == \
+        {"user": 3, "assistant": 2}
+    assert {row["session_id"]: row["messages"] for row in stats["top_sessions"]} == {first: 2, second: 3}
+    assert stats["by_day"][-1]["messages"] == 5
+
+    session_stats = chat_api.get(f"/api/chat/sessions/{second}/stats").json()
+    assert session_stats["messages_by_type"] == {"user": 2, "assistant": 1}
+    assert session_stats["total_messages"] == 3
+
+
+def test_upgrade_rolls_up_existing_messages(database, chat_db):
+    conversation(chat_db)
+    conversation(chat_db, "second")
+    # The database as it was before the rollup existed
+    with database.engine.begin() as conn:
+        for trigger in ("insert", "delete", "update"):
+            conn.exec_driver_sql(f"DROP TRIGGER chat_message_stats_{trigger}")
+        conn.exec_driver_sql("DROP TABLE chat_message_stats")
+        _set_schema_version(conn, 3)
+
+    run_migrations(database.engine)
+    assert rollup(database) == counted(database)
+    assert len(rollup(database)) == 4
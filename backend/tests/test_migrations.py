@@ -0,0 +1,66 @@
+from sqlalchemy import create_engine
+
+from app.models import Base
+from app.services.migrations import (MIGRATIONS, _set_schema_version, get_schema_version,
+                                     has_message_search_index, run_migrations)
+
+LATEST = MIGRATIONS[-1].version
+
+
+def index_names(engine):
+    with engine.connect() as conn:
+        return {row[0] for row in conn.exec_driver_sql("SELECT name FROM sqlite_master WHERE type = 'index'")}
+
+
+def stats_rows(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("SELECT * FROM chat_message_stats ORDER BY session_id, message_type").all()
+
+
+def test_new_database_is_at_the_latest_version(database):
+    assert database.schema_version == LATEST
+    with database.engine.connect() as conn:
+        assert get_schema_version(conn) == LATEST
+        assert has_message_search_index(conn)
+
+
+def test_migrations_run_twice_change_nothing(database):
+    indexes = index_names(database.engine)
+    assert run_migrations(database.engine) == LATEST
+    assert index_names(database.engine) == indexes
+
+
+def test_every_step_is_idempotent(database, chat_db):
+    # Replays all steps over a current schema with data, as after an
+    # upgrade that was interrupted before its version was recorded
+    chat_session = chat_db.create_session("replay")
+    chat_db.add_message(chat_session.id, "the quick brown fox", "user")
+    chat_db.add_message(chat_session.id, "jumps over the lazy dog", "assistant")
+    indexes, stats = index_names(database.engine), stats_rows(database.engine)
+
+    with database.engine.connect() as conn:
+        _set_schema_version(conn, 0)
+        conn.commit()
+    assert run_migrations(database.engine) == LATEST
+
+    assert index_names(database.engine) == indexes
+    assert stats_rows(database.engine) == stats
+    assert [m.content for m in chat_db.search_messages("fox")] == ["the quick brown fox"]
+
+
+def test_upgrade_from_tables_without_indexes(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        for name in index_names(engine):
+            if not name.startswith("sqlite_autoindex"):
+                conn.exec_driver_sql(f"DROP INDEX {name}")
+
+    assert run_migrations(engine) == LATEST
+    indexes = index_names(engine)
+    assert {"ix_chat_sessions_active_updated_id", "ix_chat_messages_session_timestamp_id"} <= indexes
+    # Superseded by the keyset indexes of step 3
+    assert "ix_chat_sessions_active_updated" not in indexes
+    with engine.connect() as conn:
+        assert has_message_search_index(conn)
+    engine.dispose()
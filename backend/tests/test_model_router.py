@@ -0,0 +1,87 @@
+from app.services.model_router import MIN_LATENCY_SAMPLES, ModelRouter, model_cost
+
+CASCADE = ["gpt-4o", "gpt-4", "gpt-4o-mini"]
+
+
+def slow(router, model, latency):
+    for _ in range(MIN_LATENCY_SAMPLES):
+        router.record_latency(model, latency)
+
+
+def test_chat_cascades_from_the_requested_model():
+    router = ModelRouter(CASCADE)
+    assert router.route("chat", "gpt-4o", 1000, 500).models == CASCADE
+    assert router.route("chat", "gpt-4", 1000, 500).models == ["gpt-4", "gpt-4o-mini"]
+    assert router.route("chat", "gpt-4-turbo", 1000, 500).models == ["gpt-4-turbo"] + CASCADE
+
+
+def test_models_too_small_for_the_prompt_are_skipped():
+    router = ModelRouter(CASCADE)
+    decision = router.route("chat", "gpt-4o", 8000, 1000)
+    assert decision.models == ["gpt-4o", "gpt-4o-mini"]
+    assert decision.reason == "prompt size"
+
+
+def test_oversized_prompt_keeps_the_requested_model():
+    router = ModelRouter(CASCADE)
+    assert router.route("chat", "gpt-4o", 200000, 1000).models == ["gpt-4o"]
+
+
+def test_background_tasks_go_to_the_cheapest_model():
+    router = ModelRouter(CASCADE)
+    decision = router.route("title", "gpt-4o", 200, 50)
+    assert decision.models[0] == "gpt-4o-mini"
+    assert decision.reason == "cheapest for background task"
+
+
+def test_cost_target_skips_expensive_models():
+    router = ModelRouter(CASCADE, max_cost_per_1k=0.02)
+    assert router.route("chat", "gpt-4o", 1000, 500).models == ["gpt-4o", "gpt-4o-mini"]
+
+
+def test_slow_models_move_behind_the_latency_target():
+    router = ModelRouter(CASCADE, latency_target_ms=1000)
+    slow(router, "gpt-4o", 2.5)
+    slow(router, "gpt-4", 0.4)
+
+    decision = router.route("chat", "gpt-4o", 1000, 500)
+    assert decision.models == ["gpt-4", "gpt-4o-mini", "gpt-4o"]
+    assert decision.reason == "latency target"
+    # Turns with functions keep the most capable model first
+    assert router.route("chat", "gpt-4o", 1000, 500, functions=["search"]).models == CASCADE
+
+
+def test_too_few_samples_are_not_trusted():
+    router = ModelRouter(CASCADE, latency_target_ms=1000)
+    for _ in range(MIN_LATENCY_SAMPLES - 1):
+        router.record_latency("gpt-4o", 5.0)
+    assert router.route("chat", "gpt-4o", 1000, 500).models == CASCADE
+
+
+def test_disabled_router_uses_the_requested_model():
+    router = ModelRouter(CASCADE, enabled=False)
+    assert router.route("chat", "gpt-4", 1000, 500).models == ["gpt-4"]
+
+
+def test_attempts_are_recorded():
+    router = ModelRouter(CASCADE)
+    decision = router.route("chat", "gpt-4o", 1000, 500)
+    router.record(decision, "gpt-4o", 0.2, TimeoutError())
+    router.record(decision, "gpt-4", 0.5)
+
+    stats = router.stats()
+    assert stats["fallbacks"] == 1
+    assert stats["models"]["gpt-4o"] == {"calls": 1, "failures": 1, "p50_ms": None, "p95_ms": None}
+    assert [attempt["error"] for attempt in decision.attempts] == ["TimeoutError", None]
+
+
+def test_unpriced_models_count_as_the_most_expensive():
+    cascade = ["gpt-4o", "local-llama", "gpt-4o-mini-2024-07-18"]
+    assert model_cost("local-llama") == float("inf")
+    # Dated snapshots are priced like their family
+    assert model_cost("gpt-4o-mini-2024-07-18") == model_cost("gpt-4o-mini")
+
+    capped = ModelRouter(cascade, max_cost_per_1k=0.02)
+    assert capped.route("chat", "gpt-4o", 1000, 500).models == ["gpt-4o", "gpt-4o-mini-2024-07-18"]
+    assert ModelRouter(cascade).route("title", "gpt-4o", 200, 50).models == \
+        ["gpt-4o-mini-2024-07-18", "gpt-4o", "local-llama"]
@@ -0,0 +1,92 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.services.pagination import InvalidCursorError, NEXT, decode_cursor, encode_cursor
+
+
+def add_messages(chat_db, session_id, count, timestamp=None):
+    """Add count messages; all share timestamp if given, else they are a second apart"""
+    start = datetime(2024, 1, 1)
+    return chat_db.add_messages(session_id, [
+        {"content": f"m{i}", "message_type": "user", "timestamp": timestamp or start + timedelta(seconds=i)}
+        for i in range(count)
+    ])
+
+
+def walk(chat_db, session_id, limit, direction):
+    """Follow cursors from one end of a session's messages to the other"""
+    pages, cursor = [], None
+    while True:
+        messages, next_cursor, prev_cursor = chat_db.get_session_messages_page(session_id, limit, cursor, direction)
+        pages.append(messages)
+        cursor = next_cursor if direction == "newer" else prev_cursor
+        if cursor is None:
+            return pages
+
+
+def test_cursor_round_trip():
+    cursor = encode_cursor(NEXT, ["2024-01-01 00:00:00.000000", "abc"])
+    assert decode_cursor(cursor) == (NEXT, ["2024-01-01 00:00:00.000000", "abc"])
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", encode_cursor("sideways", ["x"])])
+def test_invalid_cursor_is_rejected(chat_db, cursor):
+    chat_session = chat_db.create_session("paging")
+    with pytest.raises(InvalidCursorError):
+        chat_db.get_session_messages_page(chat_session.id, 10, cursor)
+
+
+@pytest.mark.parametrize("tied", [False, True])
+def test_pages_cover_every_message_once(chat_db, tied):
+    chat_session = chat_db.create_session("paging")
+    added = add_messages(chat_db, chat_session.id, 23, timestamp=datetime(2024, 1, 1) if tied else None)
+    expected = [message.id for message in sorted(added, key=lambda message: (message.timestamp, message.id))]
+
+    forward = walk(chat_db, chat_session.id, 5, "newer")
+    assert [len(page) for page in forward] == [5, 5, 5, 5, 3]
+    assert [message.id for page in forward for message in page] == expected
+
+    backward = walk(chat_db, chat_session.id, 5, "older")
+    assert [message.id for page in reversed(backward) for message in page] == expected
+
+
+def test_prev_cursor_returns_the_previous_page(chat_db):
+    chat_session = chat_db.create_session("paging")
+    add_messages(chat_db, chat_session.id, 12, timestamp=datetime(2024, 1, 1))
+    first, next_cursor, _ = chat_db.get_session_messages_page(chat_session.id, 4)
+    second, _, prev_cursor = chat_db.get_session_messages_page(chat_session.id, 4, next_cursor)
+    again, _, _ = chat_db.get_session_messages_page(chat_session.id, 4, prev_cursor)
+    assert {message.id for message in first}.isdisjoint(message.id for message in second)
+    assert [message.id for message in again] == [message.id for message in first]
+
+
+def test_session_list_pages(chat_db):
+    created = [chat_db.create_session(f"session {i}").id for i in range(7)]
+    seen, cursor = [], None
+    while True:
+        sessions, cursor, _ = chat_db.get_sessions_page(limit=3, cursor=cursor)
+        seen.extend(chat_session.id for chat_session in sessions)
+        if cursor is None:
+            break
+    assert sorted(seen) == sorted(created)
+    assert len(seen) == len(set(seen))
+
+
+def test_tail_follows_new_messages(chat_db):
+    chat_session = chat_db.create_session("tail")
+    add_messages(chat_db, chat_session.id, 5)
+
+    messages, cursor = chat_db.get_messages_since(chat_session.id, limit=3)
+    assert [message.content for message in messages] == ["m2", "m3", "m4"]
+
+    assert chat_db.get_messages_since(chat_session.id, cursor, limit=3) == ([], cursor)
+
+    chat_db.add_messages(chat_session.id, [{"content": "new", "message_type": "assistant"}])
+    messages, cursor = chat_db.get_messages_since(chat_session.id, cursor, limit=3)
+    assert [message.content for message in messages] == ["new"]
+
+    # More than limit added since the cursor: only the newest limit come back
+    chat_db.add_messages(chat_session.id, [{"content": f"burst {i}", "message_type": "user"} for i in range(5)])
+    messages, _ = chat_db.get_messages_since(chat_session.id, cursor, limit=3)
+    assert [message.content for message in messages] == ["burst 2", "burst 3", "burst 4"]
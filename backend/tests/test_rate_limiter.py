@@ -0,0 +1,250 @@
+import asyncio
+
+import httpx
+import openai
+import pytest
+
+from app.services import rate_limiter
+from app.services.rate_limiter import (BACKGROUND, INTERACTIVE, LanePool, RateLimitTimeout, RequestScheduler,
+                                       TokenBucket)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(rate_limiter.time, "monotonic", clock)
+    return clock
+
+
+def test_bucket_reservations_queue_up(clock):
+    bucket = TokenBucket(rate_per_minute=60, capacity=2)
+    assert bucket.reserve(1) == 0
+    assert bucket.reserve(1) == 0
+    # One token per second: the next callers wait their turn
+    assert bucket.reserve(1) == pytest.approx(1.0)
+    assert bucket.reserve(1) == pytest.approx(2.0)
+    clock.now += 2
+    assert bucket.reserve(1) == pytest.approx(1.0)
+
+
+def test_bucket_refund_shortens_the_wait(clock):
+    bucket = TokenBucket(rate_per_minute=600, capacity=100)
+    assert bucket.reserve(150) == pytest.approx(0.0)  # capped at the capacity
+    assert bucket.reserve(50) == pytest.approx(5.0)
+    bucket.refund(30)
+    assert bucket.reserve(0) == pytest.approx(2.0)
+    clock.now += 60
+    bucket.refund(0)
+    assert bucket.level == 100
+
+
+def test_run_returns_the_result():
+    scheduler = RequestScheduler(max_concurrency=2)
+
+    async def call():
+        return "ok"
+
+    assert asyncio.run(scheduler.run("m", 100, call)) == "ok"
+    stats = scheduler.stats()
+    assert stats["models"]["m"]["requests"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_stream_holds_the_slot_until_exit():
+    scheduler = RequestScheduler(max_concurrency=1, queue_timeout=5)
+
+    async def call():
+        return "stream"
+
+    async def scenario():
+        async with scheduler.stream("m", 100, call) as stream:
+            assert stream == "stream"
+            assert scheduler.stats()["in_flight"] == 1
+            # The slot is taken while the body is read
+            with pytest.raises(RateLimitTimeout):
+                await scheduler.run("m", 100, call, timeout=0.05)
+        assert scheduler.stats()["in_flight"] == 0
+        return await scheduler.run("m", 100, call, timeout=0.05)
+
+    assert asyncio.run(scenario()) == "stream"
+
+
+def test_slot_is_released_when_the_reader_fails():
+    scheduler = RequestScheduler(max_concurrency=1)
+
+    async def call():
+        return "stream"
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            async with scheduler.stream("m", 100, call):
+                raise ValueError("client went away")
+        return scheduler.stats()["in_flight"]
+
+    assert asyncio.run(scenario()) == 0
+
+
+def test_exhausted_budget_raises_timeout():
+    scheduler = RequestScheduler(requests_per_minute=60, model_limits={"m": {"rpm": 1}}, queue_timeout=1)
+
+    async def call():
+        return "ok"
+
+    async def scenario():
+        await scheduler.run("m", 10, call)
+        with pytest.raises(RateLimitTimeout):
+            await scheduler.run("m", 10, call)
+        # The other model has its own budget
+        return await scheduler.run("other", 10, call)
+
+    assert asyncio.run(scenario()) == "ok"
+    assert scheduler.stats()["models"]["m"]["timeouts"] == 1
+
+
+def start(pool, lane):
+    """Queue an acquire on the running loop; it runs at the next await"""
+    return asyncio.ensure_future(pool.acquire(lane, timeout=5))
+
+
+def test_interactive_waiters_overtake_background_ones(clock):
+    async def scenario():
+        pool = LanePool(1, max_background_wait=5)
+        await pool.acquire(INTERACTIVE, 1)
+        background = start(pool, BACKGROUND)
+        await asyncio.sleep(0)
+        interactive = start(pool, INTERACTIVE)
+        await asyncio.sleep(0)
+
+        pool.release(INTERACTIVE)
+        assert pool.running == {INTERACTIVE: 1, BACKGROUND: 0}
+        await interactive
+        pool.release(INTERACTIVE)
+        await background
+        return pool
+
+    pool = asyncio.run(scenario())
+    assert pool.running == {INTERACTIVE: 0, BACKGROUND: 1}
+
+
+def test_background_lane_is_capped(clock):
+    async def scenario():
+        pool = LanePool(4, background_share=0.25)
+        await pool.acquire(BACKGROUND, 1)
+        background = start(pool, BACKGROUND)
+        await asyncio.sleep(0)
+        # Free slots are kept for interactive requests
+        assert not background.done()
+        for _ in range(3):
+            await pool.acquire(INTERACTIVE, 1)
+
+        pool.release(INTERACTIVE)
+        assert pool.running == {INTERACTIVE: 2, BACKGROUND: 1}
+        pool.release(BACKGROUND)
+        await background
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats[BACKGROUND]["limit"] == 1
+    assert stats[BACKGROUND]["running"] == 1
+    assert stats[INTERACTIVE]["running"] == 2
+
+
+def test_aged_background_waiter_is_served_first(clock):
+    async def scenario():
+        pool = LanePool(1, max_background_wait=5)
+        await pool.acquire(INTERACTIVE, 1)
+        background = start(pool, BACKGROUND)
+        await asyncio.sleep(0)
+        clock.now += 5
+        interactive = start(pool, INTERACTIVE)
+        await asyncio.sleep(0)
+
+        pool.release(INTERACTIVE)
+        assert pool.running == {INTERACTIVE: 0, BACKGROUND: 1}
+        await background
+        pool.release(BACKGROUND)
+        await interactive
+        return pool.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats[BACKGROUND]["max_wait"] == 5
+    assert stats[INTERACTIVE]["granted"] == 2
+
+
+def test_slot_share_counts_time_held(clock):
+    pool = LanePool(4)
+
+    async def scenario():
+        await pool.acquire(INTERACTIVE, 1)
+        await pool.acquire(BACKGROUND, 1)
+        clock.now += 1
+        pool.release(BACKGROUND)
+        clock.now += 2
+        pool.release(INTERACTIVE)
+
+    asyncio.run(scenario())
+    stats = pool.stats()
+    assert stats[INTERACTIVE]["slot_seconds"] == 3
+    assert stats[BACKGROUND]["slot_seconds"] == 1
+    assert stats[INTERACTIVE]["slot_share"] == 0.75
+    assert stats[BACKGROUND]["slot_share"] == 0.25
+
+
+def test_request_cancelled_while_paced_returns_its_reservation():
+    scheduler = RequestScheduler(requests_per_minute=0, tokens_per_minute=600, queue_timeout=60)
+
+    async def call():
+        return "ok"
+
+    async def scenario():
+        await scheduler.run("m", 600, call)
+        paced = asyncio.ensure_future(scheduler.run("m", 300, call))
+        await asyncio.sleep(0.05)
+        paced.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await paced
+
+    asyncio.run(scenario())
+    bucket = scheduler.budgets["m"].tokens
+    bucket.refund(0)
+    assert 0 <= bucket.level < 10
+
+
+def server_error():
+    request = httpx.Request("POST", "https://api.openai.com/v1/chat/completions")
+    return openai.InternalServerError("overloaded", response=httpx.Response(500, request=request), body=None)
+
+
+def test_failed_attempts_do_not_keep_their_tokens():
+    scheduler = RequestScheduler(requests_per_minute=0, tokens_per_minute=6000, max_retries=3,
+                                 backoff_base=0.001, backoff_max=0.001)
+    attempts = []
+
+    async def call():
+        attempts.append(len(attempts))
+        if len(attempts) < 3:
+            raise server_error()
+        return "ok"
+
+    async def failing():
+        raise server_error()
+
+    async def scenario():
+        assert await scheduler.run("m", 1000, call) == "ok"
+        with pytest.raises(openai.InternalServerError):
+            await scheduler.run("m", 1000, failing)
+
+    asyncio.run(scenario())
+    assert len(attempts) == 3
+    bucket = scheduler.budgets["m"].tokens
+    # Only the attempt that succeeded keeps its reservation
+    assert 5000 <= bucket.level < 5500
+    assert scheduler.stats()["models"]["m"]["retries"] == 5
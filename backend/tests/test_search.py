@@ -0,0 +1,93 @@
+import pytest
+from sqlalchemy import text
+
+from app.services.chat_database_service import ChatDatabaseService
+
+
+def indexed(database, word):
+    """Rowids of the search index entries matching word"""
+    with database.engine.connect() as conn:
+        return [row[0] for row in conn.execute(
+            text("SELECT rowid FROM chat_messages_fts WHERE chat_messages_fts MATCH :word"), {"word": word})]
+
+
+def contents(messages):
+    return sorted(message.content for message in messages)
+
+
+@pytest.fixture
+def session_id(chat_db):
+    return chat_db.create_session("search").id
+
+
+def test_triggers_keep_the_index_in_sync(database, chat_db, session_id):
+    message = chat_db.add_message(session_id, "deploy the gateway", "user")
+    assert len(indexed(database, "gateway")) == 1
+
+    with database.engine.begin() as conn:
+        conn.execute(text("UPDATE chat_messages SET content = 'rollback the gateway' WHERE id = :id"),
+                     {"id": message.id})
+    assert indexed(database, "deploy") == []
+    assert len(indexed(database, "rollback")) == 1
+
+    chat_db.delete_message(message.id)
+    assert indexed(database, "gateway") == []
+
+
+def test_session_delete_removes_its_messages_from_the_index(database, chat_db, session_id):
+    chat_db.add_message(session_id, "quarterly roadmap", "user")
+    chat_db.delete_session_permanently(session_id)
+    assert indexed(database, "roadmap") == []
+
+
+@pytest.mark.parametrize("query, expression", [
+    ("jira ticket", '"jira" "ticket"*'),
+    ('say "hi"', '"say" """hi"""*'),
+    ('"', '""""*'),
+    ("AND OR NOT (", '"AND" "OR" "NOT" "("*'),
+    ("   ", ""),
+])
+def test_match_expression_quotes_every_term(query, expression):
+    assert ChatDatabaseService._build_match_expression(query) == expression
+
+
+@pytest.mark.parametrize("query", ['"', "AND OR NOT (", "*", "NEAR(a b)", "col:value"])
+def test_fts_syntax_in_queries_is_searched_literally(chat_db, session_id, query):
+    chat_db.add_message(session_id, "nothing special here", "user")
+    assert chat_db.search_messages(query) == []
+
+
+def test_last_term_matches_as_a_prefix(chat_db, session_id):
+    chat_db.add_message(session_id, "the deployment finished", "user")
+    chat_db.add_message(session_id, "deploy later", "user")
+    assert contents(chat_db.search_messages("deploy")) == ["deploy later", "the deployment finished"]
+    assert contents(chat_db.search_messages("deploy the")) == []
+    assert contents(chat_db.search_messages("the deploy")) == ["the deployment finished"]
+
+
+def test_search_is_filtered_by_session(chat_db, session_id):
+    other = chat_db.create_session("other").id
+    chat_db.add_message(session_id, "budget review", "user")
+    chat_db.add_message(other, "budget draft", "user")
+    assert contents(chat_db.search_messages("budget", session_id=other)) == ["budget draft"]
+    assert len(chat_db.search_messages("budget")) == 2
+
+
+def test_like_fallback_without_the_search_index(database, chat_db, session_id):
+    chat_db.add_message(session_id, "release notes v2.1", "user")
+    database.has_message_search = False
+    messages = chat_db.search_messages("notes v2")
+    assert contents(messages) == ["release notes v2.1"]
+    assert not hasattr(messages[0], "_search_rank")
+
+
+def test_search_endpoint_returns_snippet_and_rank(chat_api, chat_db, session_id):
+    chat_db.add_message(session_id, "the gateway timed out again", "user")
+    chat_db.add_message(session_id, "unrelated", "user")
+
+    response = chat_api.get("/api/chat/search", params={"query": "gateway", "session_id": session_id})
+    assert response.status_code == 200
+    [result] = response.json()
+    assert result["content"] == "the gateway timed out again"
+    assert "<mark>gateway</mark>" in result["snippet"]
+    assert isinstance(result["rank"], float)
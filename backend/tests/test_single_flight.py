@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from app.services.model_router import ModelRouter
+from app.services.openai_service import OpenAIService
+from app.services.rate_limiter import RequestScheduler
+from app.services.single_flight import SingleFlight
+
+
+class Call:
+    """Coroutine function that blocks until released and counts its runs"""
+
+    def __init__(self, result="done", error=None):
+        self.runs = 0
+        self.release = None
+        self.result = result
+        self.error = error
+
+    async def __call__(self):
+        self.runs += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+def test_concurrent_callers_share_one_call():
+    async def scenario():
+        flight, call = SingleFlight(), Call()
+        call.release = asyncio.Event()
+        callers = [asyncio.ensure_future(flight.do("k", call)) for _ in range(3)]
+        await asyncio.sleep(0)
+        call.release.set()
+        return flight, call, await asyncio.gather(*callers)
+
+    flight, call, results = asyncio.run(scenario())
+    assert results == ["done"] * 3
+    assert call.runs == 1
+    assert flight.stats()["coalesced"] == 2
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_different_keys_do_not_coalesce():
+    async def scenario():
+        flight, call = SingleFlight(), Call()
+        call.release = asyncio.Event()
+        call.release.set()
+        return call, await asyncio.gather(flight.do("a", call), flight.do("b", call))
+
+    call, results = asyncio.run(scenario())
+    assert results == ["done", "done"]
+    assert call.runs == 2
+
+
+def test_cancelled_caller_does_not_cancel_the_flight():
+    async def scenario():
+        flight, call = SingleFlight(), Call()
+        call.release = asyncio.Event()
+        first = asyncio.ensure_future(flight.do("k", call))
+        second = asyncio.ensure_future(flight.do("k", call))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        call.release.set()
+        return first, await second
+
+    first, result = asyncio.run(scenario())
+    assert first.cancelled()
+    assert result == "done"
+
+
+def test_failure_is_shared_but_not_remembered():
+    async def scenario():
+        flight, failing = SingleFlight(), Call(error=ValueError("boom"))
+        failing.release = asyncio.Event()
+        callers = [asyncio.ensure_future(flight.do("k", failing)) for _ in range(2)]
+        await asyncio.sleep(0)
+        failing.release.set()
+        errors = await asyncio.gather(*callers, return_exceptions=True)
+
+        ok = Call()
+        ok.release = asyncio.Event()
+        ok.release.set()
+        return flight, failing, errors, await flight.do("k", ok)
+
+    flight, failing, errors, result = asyncio.run(scenario())
+    assert failing.runs == 1
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert result == "done"
+    assert flight.failures == 1
+
+
+def test_every_caller_cancelled_leaves_no_unhandled_error():
+    async def scenario():
+        flight, call = SingleFlight(), Call(error=ValueError("boom"))
+        call.release = asyncio.Event()
+        caller = asyncio.ensure_future(flight.do("k", call))
+        await asyncio.sleep(0)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        call.release.set()
+        await asyncio.sleep(0.01)
+        return flight
+
+    flight = asyncio.run(scenario())
+    assert flight.failures == 1
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_coalesced_completions_are_metered_per_session():
+    records = []
+
+    class Ledger:
+        def record(self, task, model, usage, latency, session_id=None, message_id=None, cached=False, success=True):
+            records.append((session_id, cached, bool(usage)))
+
+    async def scenario():
+        openai_service = OpenAIService(cache=None, scheduler=RequestScheduler(), router=ModelRouter(["gpt-3.5-turbo"]),
+                                       hedger=None, ledger=Ledger())
+        try:
+            return await asyncio.gather(*[openai_service.generate_response("hello", session_id=session_id)
+                                          for session_id in ("s1", "s2", "s3")])
+        finally:
+            await openai_service.aclose()
+
+    replies = asyncio.run(scenario())
+    assert len({reply["content"] for reply in replies}) == 1
+    # One upstream call, costed once; every session sees its share of usage
+    assert sorted(records) == [("s1", False, True), ("s2", True, True), ("s3", True, True)]
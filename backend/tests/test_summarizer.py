@@ -0,0 +1,148 @@
+import asyncio
+
+import pytest
+
+from app.services import summarizer as summarizer_module
+from app.services.history_store import HistoryStore
+from app.services.summarizer import ConversationSummarizer
+from app.services.turns import USER, Turn
+
+
+class Calls(list):
+    pass
+
+
+@pytest.fixture
+def summaries(chat_db, monkeypatch):
+    """Summarize into "summary N" and record the turns each call folded in"""
+    calls = Calls()
+    calls.failing = False
+
+    async def summarize_conversation(previous_summary, messages, max_tokens=400, session_id=None):
+        calls.append((previous_summary, [message["content"] for message in messages]))
+        if calls.failing:
+            return {"success": False, "error": "unavailable"}
+        return {"success": True, "summary": f"summary {len(calls)}", "usage": {"total_tokens": 10}}
+
+    monkeypatch.setattr(summarizer_module, "chat_db_service", chat_db)
+    monkeypatch.setattr(summarizer_module.openai_service, "summarize_conversation", summarize_conversation)
+    return calls
+
+
+def contents(history):
+    return [turn.content for turn in history]
+
+
+def store_messages(chat_db, session_id, count, start=0):
+    return chat_db.add_messages(session_id, [
+        {"content": f"m{index}", "message_type": "user" if index % 2 == 0 else "assistant"}
+        for index in range(start, start + count)
+    ])
+
+
+def test_schedule_waits_for_interval_turns_beyond_the_recent_ones(chat_db, summaries):
+    summarizer = ConversationSummarizer(interval=4, keep_recent=2)
+    session_id = chat_db.create_session("summary").id
+
+    async def steps():
+        history = [Turn(USER, f"m{index}") for index in range(5)]
+        assert await summarizer.get_context(session_id, history) == (None, history)
+        summarizer.schedule(session_id, history)
+        await summarizer.drain()
+        assert summaries == []
+
+        history.append(Turn(USER, "m5"))
+        summarizer.schedule(session_id, history)
+        # One refresh at a time
+        summarizer.schedule(session_id, history)
+        await summarizer.drain()
+        summary, recent = await summarizer.get_context(session_id, history)
+        assert (summary, contents(recent)) == ("summary 1", ["m4", "m5"])
+
+    asyncio.run(steps())
+    assert summaries == [(None, ["m0", "m1", "m2", "m3"])]
+    assert summarizer.states[session_id].turns == 4
+    assert not summarizer._tasks
+
+
+def test_schedule_needs_a_loaded_state(chat_db, summaries):
+    summarizer = ConversationSummarizer(interval=1, keep_recent=0)
+    session_id = chat_db.create_session("summary").id
+
+    async def steps():
+        summarizer.schedule(session_id, [Turn(USER, "m0"), Turn(USER, "m1")])
+        await summarizer.drain()
+
+    asyncio.run(steps())
+    assert summaries == []
+
+
+def test_failed_refresh_keeps_the_previous_summary(chat_db, summaries):
+    summarizer = ConversationSummarizer(interval=2, keep_recent=0)
+    session_id = chat_db.create_session("summary").id
+    summaries.failing = True
+
+    async def steps():
+        history = [Turn(USER, "m0"), Turn(USER, "m1")]
+        await summarizer.get_context(session_id, history)
+        summarizer.schedule(session_id, history)
+        await summarizer.drain()
+        assert await summarizer.get_context(session_id, history) == (None, history)
+
+    asyncio.run(steps())
+    assert len(summaries) == 1
+    assert "summary" not in (chat_db.get_session(session_id).extra_data or {})
+
+
+def test_summary_is_persisted_and_restored_by_another_worker(chat_db, summaries):
+    session_id = chat_db.create_session("summary").id
+    store_messages(chat_db, session_id, 6)
+
+    async def summarize():
+        summarizer = ConversationSummarizer(interval=4, keep_recent=2)
+        history = await HistoryStore(db=chat_db).load(session_id)
+        await summarizer.get_context(session_id, history)
+        summarizer.schedule(session_id, history)
+        await summarizer.drain()
+        return history
+
+    history = asyncio.run(summarize())
+    stored = chat_db.get_session(session_id).extra_data["summary"]
+    assert stored["text"] == "summary 1"
+    assert stored["turns"] == 4
+    assert stored["upto_id"] == history[3].id
+    assert stored["upto_created"] == history[3].created
+    assert stored["usage"] == {"total_tokens": 10}
+
+    async def restore():
+        # A fresh worker with more messages stored since
+        store_messages(chat_db, session_id, 2, start=6)
+        summarizer = ConversationSummarizer(interval=4, keep_recent=2)
+        history = await HistoryStore(db=chat_db).load(session_id)
+        return await summarizer.get_context(session_id, history), summarizer.states[session_id]
+
+    (summary, recent), state = asyncio.run(restore())
+    assert (summary, contents(recent)) == ("summary 1", ["m4", "m5", "m6", "m7"])
+    assert state.turns == 4
+
+
+def test_covered_falls_back_to_the_boundary_time():
+    history = [Turn(USER, f"m{index}", created=100 + index, id=f"id{index}") for index in range(4)]
+    covered = ConversationSummarizer._covered
+    assert covered(history, "id1", 100) == 2
+    # Boundary message older than the loaded window, or never stored
+    assert covered(history, "gone", 101) == 2
+    assert covered(history, "gone", 99) == 0
+    assert covered(history, None, 200) == 4
+    assert covered(history, None, None) == 0
+
+
+def test_metadata_update_replaces_all_but_the_summary(chat_api, chat_db):
+    session_id = chat_db.create_session("summary", metadata={"pinned": True, "tag": "x"}).id
+    chat_db.update_session_metadata(session_id, {"summary": {"text": "kept"}})
+
+    response = chat_api.put(f"/api/chat/sessions/{session_id}", json={"metadata": {"tag": "y"}})
+    assert response.json()["metadata"] == {"tag": "y", "summary": {"text": "kept"}}
+    # A client cannot overwrite the server's summary either
+    chat_db.update_session(session_id, metadata={"summary": {"text": "client"}})
+    assert chat_db.get_session(session_id).extra_data == {"summary": {"text": "kept"}}
@@ -0,0 +1,71 @@
+import asyncio
+import sys
+from datetime import datetime
+
+from app.services.history_store import HistoryStore
+from app.services.turns import ASSISTANT, NO_FUNCTIONS, USER, Turn
+
+USAGE = {"prompt_tokens": 12, "completion_tokens": 30, "total_tokens": 42}
+
+
+def test_to_message_has_only_role_and_content():
+    turn = Turn(ASSISTANT, "hi there", functions=["Create Idea"], model="gpt-4", usage=USAGE, id="m1")
+    assert turn.to_message() == {"role": "assistant", "content": "hi there"}
+
+
+def test_roles_and_models_are_interned():
+    role, model = "".join(["assis", "tant"]), "".join(["gpt-", "4"])
+    turn = Turn(role, "hi", model=model)
+    assert turn.role is ASSISTANT
+    assert turn.model is sys.intern("gpt-4")
+    assert Turn(USER, "hi").functions is NO_FUNCTIONS
+
+
+def test_usage_and_metadata_keep_only_what_is_set():
+    turn = Turn(ASSISTANT, "hi", functions=["Create Idea"], model="gpt-4", usage=USAGE)
+    assert turn.usage == USAGE
+    assert turn.metadata() == {"functions": ["Create Idea"], "model": "gpt-4", "usage": USAGE}
+    plain = Turn(USER, "hi")
+    assert plain.usage is None
+    assert plain.metadata() == {}
+
+
+def test_from_stored_reads_naive_utc_timestamps():
+    turn = Turn.from_stored(USER, "hi", datetime(2024, 1, 1, 12, 0, 30), "m1")
+    assert turn.created == 1704110430
+    assert turn.id == "m1"
+    assert Turn.from_stored(USER, "hi", None, "m2").created > 1704110430
+
+
+def test_stored_ai_messages_load_as_assistant_turns(chat_db):
+    session_id = chat_db.create_session("roles").id
+    for content, message_type in (("question", "user"), ("legacy answer", "ai"), ("answer", "assistant"),
+                                  ("function output", "function")):
+        chat_db.add_message(session_id, content, message_type)
+
+    history = asyncio.run(HistoryStore(db=chat_db).load(session_id))
+    assert [turn.to_message() for turn in history] == [
+        {"role": "user", "content": "question"},
+        {"role": "assistant", "content": "legacy answer"},
+        {"role": "assistant", "content": "answer"},
+    ]
+    assert all(turn.role is ASSISTANT for turn in history[1:])
+
+
+def test_nbytes_counts_content_but_not_shared_values():
+    short, long = Turn(USER, "x", model="gpt-4"), Turn(USER, "x" * 1000, model="gpt-4")
+    assert long.nbytes() - short.nbytes() == sys.getsizeof("x" * 1000) - sys.getsizeof("x")
+    # Interned role and model and the shared empty functions add nothing
+    assert Turn(USER, "x").nbytes() == short.nbytes()
+    stored = Turn(USER, "x", functions=["Create Idea"], id="m1")
+    assert stored.nbytes() == short.nbytes() + sys.getsizeof(stored.functions) + sys.getsizeof("m1")
+
+
+def test_store_size_is_the_sum_of_its_turns():
+    store = HistoryStore(load_limit=0)
+    for index in range(5):
+        store.append("a", Turn(USER if index % 2 == 0 else ASSISTANT, "y" * index * 100, model="gpt-4"))
+    store.append("b", Turn(USER, "z"))
+    assert store.size == sum(turn.nbytes() for key in ("a", "b") for turn in store.get(key))
+    store.drop("a")
+    assert store.size == store.get("b")[0].nbytes()
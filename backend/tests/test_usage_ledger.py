@@ -0,0 +1,100 @@
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import text
+
+from app.services.model_catalog import estimate_cost
+from app.services.usage_ledger import UsageLedger
+
+USAGE = {"prompt_tokens": 1000, "completion_tokens": 500, "total_tokens": 1500}
+
+
+def test_estimate_cost_by_model_family():
+    assert estimate_cost("gpt-4o", 1000, 1000) == pytest.approx(0.02)
+    # Dated snapshots are priced like their family, not like a shorter prefix
+    assert estimate_cost("gpt-4o-mini-2024-07-18", 1000, 1000) == estimate_cost("gpt-4o-mini", 1000, 1000)
+    assert estimate_cost("local-llama", 1000, 1000) is None
+    assert estimate_cost(None, 1000, 1000) is None
+
+
+def test_cached_calls_cost_nothing(ledger):
+    ledger.record("chat", "gpt-4o", USAGE, 0.5, session_id="s1")
+    ledger.record("chat", "gpt-4o", USAGE, 0.01, session_id="s2", cached=True)
+    usage = ledger.get_usage(group_by="session")
+
+    costs = {group["session"]: group["cost"] for group in usage["groups"]}
+    assert costs == {"s1": pytest.approx(estimate_cost("gpt-4o", 1000, 500)), "s2": 0.0}
+    assert usage["cached_calls"] == 1
+    assert usage["total_tokens"] == 3000
+
+
+def test_usage_is_grouped(ledger, database):
+    ledger.record("chat", "gpt-4o", USAGE, 1.0, session_id="s1")
+    ledger.record("title", "gpt-4o-mini", USAGE, 0.2, session_id="s1")
+    ledger.record("chat", "gpt-4o-mini", None, 0.1, session_id="s2", success=False)
+    ledger.flush()
+    yesterday = datetime.utcnow() - timedelta(days=1)
+    with database.engine.begin() as conn:
+        conn.execute(text("UPDATE llm_usage SET created_at = :day WHERE task = 'title'"), {"day": yesterday})
+
+    by_model = {group["model"]: group for group in ledger.get_usage(group_by="model")["groups"]}
+    assert by_model["gpt-4o"]["calls"] == 1
+    assert by_model["gpt-4o-mini"]["calls"] == 2
+    assert by_model["gpt-4o-mini"]["failed_calls"] == 1
+    assert by_model["gpt-4o"]["avg_latency_ms"] == 1000
+
+    by_task = {group["task"]: group["calls"] for group in ledger.get_usage(group_by="task")["groups"]}
+    assert by_task == {"chat": 2, "title": 1}
+
+    by_day = ledger.get_usage(group_by="day")["groups"]
+    assert [group["calls"] for group in by_day] == [1, 2]
+    assert by_day[0]["day"] == yesterday.date().isoformat()
+
+    assert ledger.get_usage(group_by="day", days=1)["calls"] == 2
+    assert ledger.get_usage(group_by="task", session_id="s2")["groups"] == [
+        {"task": "chat", "calls": 1, "cached_calls": 0, "failed_calls": 1, "prompt_tokens": 0,
+         "completion_tokens": 0, "total_tokens": 0, "cost": 0.0, "avg_latency_ms": 100}
+    ]
+
+
+def test_unknown_grouping_is_rejected(ledger):
+    with pytest.raises(ValueError):
+        ledger.get_usage(group_by="user")
+
+
+def test_usage_endpoints_include_queued_records(chat_api, ledger):
+    ledger.record("chat", "gpt-4o", USAGE, 0.5, session_id="s1")
+    ledger.record("summary", "gpt-4o-mini", USAGE, 0.5, session_id="s2")
+
+    usage = chat_api.get("/api/chat/usage", params={"group_by": "session"}).json()
+    assert usage["calls"] == 2
+    assert {group["session"] for group in usage["groups"]} == {"s1", "s2"}
+
+    session_usage = chat_api.get("/api/chat/sessions/s2/usage", params={"group_by": "task"}).json()
+    assert session_usage["calls"] == 1
+    assert session_usage["groups"][0]["task"] == "summary"
+    assert session_usage["cost"] == pytest.approx(estimate_cost("gpt-4o-mini", 1000, 500))
+
+
+def test_records_are_dropped_while_the_writer_is_stalled(database):
+    ledger = UsageLedger(database, batch_size=2, max_delay=0.01, max_pending=2)
+    with database._writer_lock:
+        # The writer takes the first two records and waits for the lock
+        for _ in range(2):
+            ledger.record("chat", "gpt-4o", USAGE, 0.1)
+        deadline = time.monotonic() + 5
+        while ledger.stats()["pending"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        for _ in range(5):
+            ledger.record("chat", "gpt-4o", USAGE, 0.1)
+        assert ledger.stats()["pending"] == 2
+        assert ledger.stats()["dropped"] == 3
+    ledger.close()
+    assert ledger.get_usage()["calls"] == 4
+
+
+def test_nothing_is_recorded_after_close(ledger):
+    ledger.close()
+    ledger.record("chat", "gpt-4o", USAGE, 0.1)
+    assert ledger.get_usage()["calls"] == 0
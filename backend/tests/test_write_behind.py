@@ -0,0 +1,128 @@
+import threading
+import time
+
+import pytest
+
+from app.services.write_behind import WriteBehindQueue
+
+
+class Sink:
+    """Flush callback that records batches and fails on request"""
+
+    def __init__(self, fail_times=0, bad=None):
+        self.batches = []
+        self.fail_times = fail_times
+        self.bad = bad
+
+    def __call__(self, rows):
+        if self.fail_times:
+            self.fail_times -= 1
+            raise RuntimeError("database is locked")
+        if self.bad is not None and self.bad in [row["n"] for row in rows]:
+            raise ValueError("bad row")
+        self.batches.append([row["n"] for row in rows])
+
+    @property
+    def written(self):
+        return [n for batch in self.batches for n in batch]
+
+
+def test_put_does_not_flush_inline():
+    sink = Sink()
+    queue = WriteBehindQueue(sink, max_batch=2, max_pending=2)
+    for n in range(5):
+        queue.put({"n": n}, key="s")
+    # No flusher thread: the callers never write themselves
+    assert sink.batches == []
+    assert queue.stats()["pending"] == 5
+    assert queue.flush() == 5
+    assert sink.written == [0, 1, 2, 3, 4]
+
+
+def test_failed_flush_is_requeued_in_order():
+    sink = Sink(fail_times=1)
+    queue = WriteBehindQueue(sink)
+    queue.put({"n": 0}, key="a")
+    queue.put({"n": 1}, key="b")
+
+    with pytest.raises(RuntimeError):
+        queue.flush()
+    assert queue.has_pending("a") and queue.has_pending("b")
+    queue.put({"n": 2}, key="a")
+
+    assert queue.flush() == 3
+    assert sink.written == [0, 1, 2]
+    assert not queue.has_pending()
+    assert queue.stats()["failures"] == 1
+
+
+def test_bad_row_is_dropped_after_max_retries():
+    sink = Sink(bad=1)
+    queue = WriteBehindQueue(sink, max_retries=2)
+    for n in range(3):
+        queue.put({"n": n}, key=n)
+
+    for _ in range(2):
+        with pytest.raises(ValueError):
+            queue.flush()
+    assert queue.flush() == 2
+
+    assert sink.written == [0, 2]
+    assert queue.dropped == 1
+    assert not queue.has_pending()
+
+
+def test_put_waits_for_room():
+    release = threading.Event()
+    sink = Sink()
+
+    def slow_flush(rows):
+        release.wait(5)
+        sink(rows)
+
+    queue = WriteBehindQueue(slow_flush, max_batch=2, max_delay=0.01, max_pending=2)
+    queue.start()
+    try:
+        queue.put({"n": 0})
+        queue.put({"n": 1})
+        # The flusher takes both rows and waits inside the callback
+        deadline = time.monotonic() + 5
+        while queue.stats()["pending"] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        queue.put({"n": 2})
+        queue.put({"n": 3})
+
+        producer = threading.Thread(target=queue.put, args=({"n": 4},))
+        producer.start()
+        producer.join(0.2)
+        assert producer.is_alive()
+        assert queue.stats()["pending"] == 2
+
+        release.set()
+        producer.join(5)
+        assert not producer.is_alive()
+    finally:
+        queue.close(5)
+    assert sink.written == [0, 1, 2, 3, 4]
+
+
+def test_non_blocking_put_drops_rows_when_full():
+    sink = Sink()
+    queue = WriteBehindQueue(sink, max_batch=2, max_pending=2)
+    assert queue.put({"n": 0}, block=False)
+    assert queue.put({"n": 1}, block=False)
+    assert not queue.put({"n": 2}, block=False)
+    assert queue.stats()["pending"] == 2
+    assert queue.dropped == 1
+
+    queue.flush()
+    assert queue.put({"n": 3}, block=False)
+    queue.flush()
+    assert sink.written == [0, 1, 3]
+
+
+def test_put_after_close_raises():
+    queue = WriteBehindQueue(Sink())
+    queue.close()
+    with pytest.raises(RuntimeError):
+        queue.put({"n": 0})